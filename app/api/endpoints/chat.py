@@ -1,33 +1,80 @@
 from datetime import datetime
 import json
-from fastapi import APIRouter, HTTPException, Body
-from fastapi.responses import JSONResponse
-from models.chat import ChatRequestTP1, ChatRequestTP2, ChatRequestWithContext, ChatResponse, SummaryResponse, SummaryRequest, ChatRequestAdv, MemoryTagRequest, MemoryClearRequest, MetadataResponse, ToolRequest
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Body, Query
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from models.chat import ChatRequestTP1, ChatRequestTP2, ChatRequestWithContext, ChatResponse, SummaryResponse, SummaryRequest, ChatRequestAdv, MemoryTagRequest, MemoryClearRequest, MetadataResponse, ToolRequest, SessionPage, SessionSummary, IngestionJobResponse
 from services.llm_service import LLMService
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from services.rag_service import RAGService 
-from fastapi import UploadFile, File, Body, HTTPException
+from services.mongo_service import MongoService
+from fastapi import UploadFile, File, Form, Body, HTTPException
+from starlette.concurrency import run_in_threadpool
 from typing import List
 import os
 import mimetypes
 import uuid
 
+from core.dependencies import get_llm_service, get_mongo_service, get_rag_service, get_ingestion_jobs
+from services.ingestion_jobs import IngestionItem, IngestionJobManager, discard_uploads
+from core.config import settings
+import asyncio
+
 router = APIRouter()
-llm_service = LLMService()
-rag_service = RAGService()
+
+
+async def _sse_events(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Formate un flux de tokens en événements Server-Sent Events. Une erreur pendant le flux
+    (les en-têtes sont déjà envoyés) est journalisée et signalée par un événement `error`
+    terminal au lieu de couper la connexion.
+    """
+    try:
+        async for token in tokens:
+            yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        logging.exception(f"Streaming response failed: {str(e)}")
+        detail = str(e) or type(e).__name__
+        yield f"event: error\ndata: {json.dumps({'detail': detail}, ensure_ascii=False)}\n\n"
+        return
+    yield "event: end\ndata: {}\n\n"
+
+
+def _streaming_response(tokens: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        _sse_events(tokens),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def _cache_scope(scope: str, request: ChatRequestTP2) -> Optional[str]:
+    """Espace du cache de réponses pour un endpoint (None si la requête le désactive)"""
+    return scope if request.use_cache else None
 
 @router.post("/chat/simple", response_model=ChatResponse)
-async def chat_simple(request: ChatRequestTP2) -> ChatResponse:
+async def chat_simple(request: ChatRequestTP2, llm_service: LLMService = Depends(get_llm_service)) -> ChatResponse:
     """Endpoint simple du TP1"""
     try:
         response = await llm_service.generate_response(
              message=request.message,
-             session_id=request.session_id
+             session_id=request.session_id,
+             cache_scope=_cache_scope("chat_simple", request)
             )
         return ChatResponse(response=response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/simple/stream")
+async def chat_simple_stream(request: ChatRequestTP2, llm_service: LLMService = Depends(get_llm_service)) -> StreamingResponse:
+    """Version streamée (SSE) de /chat/simple"""
+    return _streaming_response(
+        llm_service.stream_response(
+            message=request.message,
+            session_id=request.session_id,
+            cache_scope=_cache_scope("chat_simple", request)
+        )
+    )
+
 # @router.post("/chat/with-context", response_model=ChatResponse)
 # async def chat_with_context(request: ChatRequestWithContext) -> ChatResponse:
 #     """Endpoint avec contexte du TP1"""
@@ -42,25 +89,36 @@ async def chat_simple(request: ChatRequestTP2) -> ChatResponse:
 #         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequestTP2) -> ChatResponse:
+async def chat(request: ChatRequestTP2, llm_service: LLMService = Depends(get_llm_service)) -> ChatResponse:
     """Nouvel endpoint du TP2 avec gestion de session"""
     try:
         response = await llm_service.generate_response(
             message=request.message,
-            session_id=request.session_id
+            session_id=request.session_id,
+            cache_scope=_cache_scope("chat", request)
         )
         return ChatResponse(response=response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequestTP2, llm_service: LLMService = Depends(get_llm_service)) -> StreamingResponse:
+    """Version streamée (SSE) de /chat"""
+    return _streaming_response(
+        llm_service.stream_response(
+            message=request.message,
+            session_id=request.session_id,
+            cache_scope=_cache_scope("chat", request)
+        )
+    )
+
 """
 Service de résumé de texte multi-niveaux
 """
 @router.post("/summarize", response_model=SummaryResponse)
-async def summarize_text(request: SummaryRequest):
+async def summarize_text(request: SummaryRequest, llm_service: LLMService = Depends(get_llm_service)):
     try:
-        print("Request body:", request.json())  # Log the raw JSON payload
-        summary = await llm_service.generate_summary(request.text, request.max_length)
+        summary = await llm_service.generate_summary(request.text, request.max_length or 1000, request.mode)
         return SummaryResponse(**summary)
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
@@ -69,10 +127,18 @@ async def summarize_text(request: SummaryRequest):
 
 
 @router.get("/history/{session_id}")
-async def get_history(session_id: str) -> List[Dict[str, str]]:
-    """Récupération de l'historique d'une conversation"""
+async def get_history(
+    session_id: str,
+    skip: Optional[int] = Query(None, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    llm_service: LLMService = Depends(get_llm_service)
+    ) -> List[Dict[str, str]]:
+    """
+    Récupération de l'historique d'une conversation.
+    `limit` seul renvoie les derniers messages, `skip` + `limit` une page.
+    """
     try:
-        raw_history = await llm_service.get_conversation_history(session_id)
+        raw_history = await llm_service.get_conversation_history(session_id, skip=skip, limit=limit)
         # raw_history est une liste de dict { "role":..., "content":..., "timestamp": ... }
 
         # Convertir chaque 'timestamp' en isoformat (ou un autre format de chaîne)
@@ -90,7 +156,7 @@ async def get_history(session_id: str) -> List[Dict[str, str]]:
 
 # Endpoint to create new chat session
 @router.post("/chat/new-session")
-async def create_new_session() -> dict:
+async def create_new_session(llm_service: LLMService = Depends(get_llm_service)) -> dict:
     """
     Endpoint pour créer une nouvelle session de chat
     """
@@ -169,22 +235,25 @@ async def create_new_session() -> dict:
 #     except Exception as e:
 #         raise HTTPException(status_code=500, detail=str(e))
 
-# @router.post("/assistant/tool", response_model=ChatResponse)
-# async def use_tool(request: ToolRequest):
-#     try:
-#         response = await llm_service.process_with_tools(request.message)
-#         return ChatResponse(response=response)
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=str(e))
+@router.post("/assistant/tool", response_model=ChatResponse)
+async def use_tool(request: ToolRequest, llm_service: LLMService = Depends(get_llm_service)):
+    try:
+        response = await llm_service.process_with_tools(request.message, tool=request.tool)
+        return ChatResponse(response=response)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/documents/index")
 async def index_documents(
     files: List[str] = Body(...),
-    clear_existing: bool = Body(False)
+    clear_existing: bool = Body(False),
+    rag_service: RAGService = Depends(get_rag_service)
     ) -> dict:
-    print(files[0])
     try:
         processed_texts = []
+        sources = []
         upload_dir = "./uploads"
         os.makedirs(upload_dir, exist_ok=True) 
 
@@ -198,61 +267,274 @@ async def index_documents(
                     file_path += ".pdf"
                 with open(file_path, "wb") as f:
                     f.write(body.encode("latin1")) 
-                text = rag_service.extract_text_from_pdf(file_path)
+                try:
+                    text = await rag_service.aextract_text_from_pdf(file_path)
+                finally:
+                    await run_in_threadpool(discard_uploads, [file_path])
 
             else:
                 text = body.strip()
 
             processed_texts.append(text)
+            sources.append(filename)
 
-        await rag_service.load_and_index_texts(processed_texts, clear_existing)
+        counts = await rag_service.load_and_index_texts(processed_texts, clear_existing, sources=sources)
 
-        return {"message": "Documents indexed successfully", "processed_files": [filename for filename in files]}
+        return {"message": "Documents indexed successfully", "processed_files": [filename for filename in files], "chunks": counts}
         # return {"message": "Documents indexed successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _save_upload(file: UploadFile, upload_dir: str) -> Tuple[str, bool]:
+    """
+    Enregistre un fichier téléversé sur disque par morceaux (sans le charger en mémoire).
+    Renvoie le chemin du fichier et s'il s'agit d'un PDF.
+    """
+    filename = os.path.basename(file.filename or "unknown_file.txt")
+    file_path = os.path.join(upload_dir, f"{uuid.uuid4().hex}_{filename}")
+    is_pdf = file.content_type == "application/pdf" or filename.lower().endswith(".pdf")
+    try:
+        with open(file_path, "wb") as out:
+            first_chunk = True
+            while chunk := await file.read(settings.upload_chunk_size):
+                if first_chunk:
+                    is_pdf = is_pdf or chunk.startswith(b"%PDF-")
+                    first_chunk = False
+                await run_in_threadpool(out.write, chunk)
+    except BaseException:
+        await run_in_threadpool(discard_uploads, [file_path])
+        raise
+    finally:
+        await file.close()
+    return file_path, is_pdf
+
+
+async def _read_upload_text(file_path: str, is_pdf: bool, rag_service: RAGService) -> str:
+    if is_pdf:
+        return await rag_service.aextract_text_from_pdf(file_path)
+
+    def _read() -> str:
+        with open(file_path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read().strip()
+    return await run_in_threadpool(_read)
+
+
+@router.post("/documents/upload")
+async def upload_documents(
+    files: List[UploadFile] = File(...),
+    clear_existing: bool = Form(False),
+    rag_service: RAGService = Depends(get_rag_service)
+    ) -> dict:
+    """
+    Indexation de documents envoyés en multipart/form-data.
+    Les fichiers sont écrits sur disque par morceaux et les PDF extraits en parallèle ;
+    ils sont supprimés une fois le texte extrait.
+    """
+    saved: List[Tuple[str, bool]] = []
+    try:
+        os.makedirs(settings.upload_dir, exist_ok=True)
+        for file in files:
+            saved.append(await _save_upload(file, settings.upload_dir))
+        texts = await asyncio.gather(*[
+            _read_upload_text(file_path, is_pdf, rag_service) for file_path, is_pdf in saved
+        ])
+        sources = [os.path.basename(file.filename or "unknown_file.txt") for file in files]
+        counts = await rag_service.load_and_index_texts(list(texts), clear_existing, sources=sources)
+        return {"message": "Documents indexed successfully", "processed_files": sources, "chunks": counts}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await run_in_threadpool(discard_uploads, [file_path for file_path, _ in saved])
+
+@router.post("/documents/jobs", response_model=IngestionJobResponse, status_code=202)
+async def submit_ingestion_job(
+    files: List[UploadFile] = File(...),
+    clear_existing: bool = Form(False),
+    ingestion_jobs: IngestionJobManager = Depends(get_ingestion_jobs)
+    ) -> IngestionJobResponse:
+    """
+    Soumet une indexation en arrière-plan : les fichiers sont enregistrés sur disque
+    puis la tâche est renvoyée immédiatement (suivi via GET /documents/jobs/{job_id}).
+    """
+    items = []
+    try:
+        os.makedirs(settings.upload_dir, exist_ok=True)
+        for file in files:
+            source = os.path.basename(file.filename or "unknown_file.txt")
+            file_path, is_pdf = await _save_upload(file, settings.upload_dir)
+            items.append(IngestionItem(source=source, path=file_path, is_pdf=is_pdf))
+        # Les fichiers sont supprimés par la tâche une fois extraits
+        job = ingestion_jobs.submit(items, clear_existing=clear_existing)
+        return IngestionJobResponse(**job.to_dict())
+    except Exception as e:
+        await run_in_threadpool(discard_uploads, [item.path for item in items])
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/documents/jobs/{job_id}", response_model=IngestionJobResponse)
+async def get_ingestion_job(
+    job_id: str,
+    ingestion_jobs: IngestionJobManager = Depends(get_ingestion_jobs)
+    ) -> IngestionJobResponse:
+    """Avancement, débit et erreurs d'une tâche d'indexation"""
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Tâche '{job_id}' introuvable")
+    return IngestionJobResponse(**job.to_dict())
+
 @router.delete("/documents")
-async def clear_documents() -> dict:
+async def clear_documents(rag_service: RAGService = Depends(get_rag_service)) -> dict:
     """Endpoint pour supprimer tous les documents indexés"""
     try:
-        llm_service.rag_service.clear()
+        await rag_service.clear()
         return {"message": "Vector store cleared successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/documents/embedding-cache", response_model=Dict[str, float])
+async def get_embedding_cache_stats(rag_service: RAGService = Depends(get_rag_service)):
+    """Statistiques du cache d'embeddings (hits, misses, taux de hit, taille)"""
+    return rag_service.embedding_cache_stats()
+
+@router.get("/documents/embedding-pipeline", response_model=Dict[str, float])
+async def get_embedding_pipeline_stats(rag_service: RAGService = Depends(get_rag_service)):
+    """Débit (chunks embeddés par seconde) et réglages courants du pipeline d'embeddings"""
+    return rag_service.embedding_pipeline_stats()
+
 @router.post("/chat/rag", response_model=ChatResponse)
-async def chat_rag(request: ChatRequestTP2) -> ChatResponse:
+async def chat_rag(request: ChatRequestTP2, llm_service: LLMService = Depends(get_llm_service)) -> ChatResponse:
     """Endpoint de chat utilisant le RAG"""
     try:
         response = await llm_service.generate_response(
             message=request.message,
             session_id=request.session_id,
-            use_rag=True
+            use_rag=True,
+            retrieval_mode=request.retrieval_mode,
+            cache_scope=_cache_scope("chat_rag", request)
         )
         return ChatResponse(response=response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/rag/stream")
+async def chat_rag_stream(request: ChatRequestTP2, llm_service: LLMService = Depends(get_llm_service)) -> StreamingResponse:
+    """Version streamée (SSE) de /chat/rag"""
+    return _streaming_response(
+        llm_service.stream_response(
+            message=request.message,
+            session_id=request.session_id,
+            use_rag=True,
+            retrieval_mode=request.retrieval_mode,
+            cache_scope=_cache_scope("chat_rag", request)
+        )
+    )
     
 
 # @router.get("/chat/documents", response_model=List[str])
 @router.get("/chat/documents", response_model=Dict[str, List[str]])
-async def get_documents():
+async def get_documents(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    source: Optional[str] = None,
+    rag_service: RAGService = Depends(get_rag_service)
+    ):
+    """Liste paginée des chunks indexés, éventuellement filtrée par document source"""
     try:
-        documents = rag_service.get_all_documents()
+        documents = await rag_service.get_all_documents(limit=limit, offset=offset, source=source)
         # return JSONResponse(content=json.dumps(formatted_response, indent=4))
         return {"documents": documents}
     except ValueError as e:
         # return JSONResponse(content=json.dumps({"error": str(e)}, indent=4))
         return {"error": str(e)}
     
-# Endpoint to get all the session_id only (meaning the id of the conversation)
+# Endpoint to get the session_id only (meaning the id of the conversation), one page at a time
 @router.get("/chat/sessions", response_model=List[str])
-async def get_all_sessions():
+async def get_all_sessions(
+    response: Response,
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    llm_service: LLMService = Depends(get_llm_service)
+    ):
+    """
+    Identifiants de session, une page à la fois (même ordre et même curseur que /chat/sessions/page).
+    Le curseur de la page suivante est renvoyé dans l'en-tête X-Next-Cursor.
+    """
+    try:
+        sessions, next_cursor = await llm_service.list_sessions(limit=limit, after=after)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return [session["session_id"] for session in sessions]
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=str(ve))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+@router.get("/chat/sessions/page", response_model=SessionPage)
+async def get_sessions_page(
+    limit: int = Query(50, ge=1, le=200),
+    after: Optional[str] = None,
+    llm_service: LLMService = Depends(get_llm_service)
+    ) -> SessionPage:
+    """Liste paginée des sessions (curseur `after`), triée par dernière activité"""
     try:
-        session_ids = await llm_service.get_all_conversation_ids()
-        return session_ids
+        sessions, next_cursor = await llm_service.list_sessions(limit=limit, after=after)
+        return SessionPage(
+            sessions=[
+                SessionSummary(
+                    session_id=session["session_id"],
+                    message_count=session.get("message_count", 0),
+                    last_activity=session.get("updated_at")
+                )
+                for session in sessions
+            ],
+            next_cursor=next_cursor
+        )
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Server error: {str(e)}")
+
+
+@router.get("/chat/sessions/cache", response_model=Dict[str, int])
+async def get_session_cache_stats(llm_service: LLMService = Depends(get_llm_service)):
+    """Compteurs du cache de sessions en mémoire (hits, misses, évictions)"""
+    return llm_service.conversation_store.stats()
+
+
+@router.get("/chat/llm-gateway")
+async def get_llm_gateway_stats(llm_service: LLMService = Depends(get_llm_service)) -> dict:
+    """Appels au LLM en cours et en file, fusions single-flight, délais dépassés et attente en file par usage"""
+    return llm_service.gateway.stats()
+
+
+@router.get("/chat/response-cache", response_model=Dict[str, float])
+async def get_response_cache_stats(llm_service: LLMService = Depends(get_llm_service)):
+    """Compteurs du cache de réponses (hits exacts et sémantiques, taux de hit)"""
+    if llm_service.response_cache is None:
+        raise HTTPException(status_code=404, detail="Cache de réponses désactivé")
+    return llm_service.response_cache.stats()
+
+
+@router.delete("/chat/response-cache")
+async def clear_response_cache(llm_service: LLMService = Depends(get_llm_service)) -> dict:
+    """Vide le cache de réponses"""
+    if llm_service.response_cache is None:
+        raise HTTPException(status_code=404, detail="Cache de réponses désactivé")
+    removed = llm_service.response_cache.invalidate()
+    return {"message": f"{removed} réponse(s) retirée(s) du cache"}
+
+
+@router.get("/chat/write-behind", response_model=Dict[str, int])
+async def get_write_behind_stats(mongo_service: MongoService = Depends(get_mongo_service)):
+    """Compteurs de l'écriture différée (lots écrits, nouvelles tentatives, lettres mortes)"""
+    if mongo_service.write_behind is None:
+        raise HTTPException(status_code=404, detail="Écriture différée désactivée")
+    return mongo_service.write_behind.stats()
+
+
+@router.post("/chat/write-behind/requeue")
+async def requeue_write_behind_dead_letters(mongo_service: MongoService = Depends(get_mongo_service)) -> dict:
+    """Remet en file les lots de messages abandonnés après leurs nouvelles tentatives"""
+    if mongo_service.write_behind is None:
+        raise HTTPException(status_code=404, detail="Écriture différée désactivée")
+    requeued = await mongo_service.write_behind.requeue_dead_letters()
+    return {"message": f"{requeued} lot(s) remis en file"}
@@ -1,6 +1,7 @@
 from pydantic_settings import BaseSettings
 import logging
 import os
+from typing import List, Optional
 from dotenv import load_dotenv
 
 # Charger les variables d'environnement depuis .env uniquement en local
@@ -11,6 +12,99 @@ class Settings(BaseSettings):
     mongodb_uri: str
     database_name: str = "chatbot"
     collection_name: str = "conversations"
+    bucket_collection_name: str = "conversation_buckets"
+    bucket_size: int = 50  # messages par bucket
+    counter_collection_name: str = "counters"
+    session_id_mode: str = "counter"  # "counter" (session_<n>) ou "uuid"
+
+    # Cache des sessions de conversation en mémoire
+    session_max_sessions: int = 1000
+    session_max_messages: int = 50
+    session_idle_timeout: int = 3600  # secondes
+    session_sweep_interval: int = 60  # secondes
+    session_history_refresh: int = 30  # secondes avant rechargement de l'historique depuis MongoDB
+
+    # Écriture différée des messages dans MongoDB (regroupée par bulk_write)
+    mongo_write_behind: bool = False
+    mongo_write_behind_batch_size: int = 100
+    mongo_write_behind_flush_interval: float = 0.05  # secondes
+    mongo_write_behind_max_retries: int = 3  # nouvelles tentatives d'un lot avant les lettres mortes
+    mongo_write_behind_retry_backoff: float = 0.5  # secondes, doublé à chaque tentative
+    mongo_write_behind_dead_letter_max: int = 1000  # lots conservés en lettres mortes
+
+    # Exécution des appels RAG bloquants hors de la boucle d'événements
+    rag_query_workers: int = 4
+    rag_index_workers: int = 1
+    rag_max_pending_index_jobs: int = 4
+
+    # Cache disque des embeddings (clé : sha256(modèle, texte))
+    embedding_cache_enabled: bool = True
+    embedding_cache_path: str = "./data/embedding_cache.sqlite3"
+    embedding_cache_max_mb: int = 512
+
+    # Téléversement et extraction des documents
+    upload_dir: str = "./uploads"
+    upload_chunk_size: int = 1024 * 1024  # octets lus par itération
+    pdf_extraction_workers: int = 2
+    pdf_pages_per_task: int = 8
+
+    # Tâches d'indexation en arrière-plan
+    ingestion_workers: int = 1
+    ingestion_batch_size: int = 16
+    ingestion_max_jobs_kept: int = 1000
+
+    # Point d'accès compatible OpenAI (ex. serveur local de test) ; None = API OpenAI
+    openai_base_url: Optional[str] = None
+
+    # Pipeline d'embeddings de l'indexation
+    embedding_batch_size: int = 256
+    embedding_batch_tokens: int = 100000
+    embedding_concurrency: int = 4
+    embedding_max_retries: int = 6
+
+    # Backend vectoriel : "chroma" ou "numpy" (matrice float32 partagée par mmap)
+    vector_backend: str = "chroma"
+    vector_ivf_min_rows: int = 100000  # taille du corpus à partir de laquelle l'index IVF est construit (0 = jamais)
+    vector_ivf_nprobe: int = 16
+
+    # Recherche RAG : "dense" ou "hybrid" (BM25 + dense fusionnés par RRF)
+    rag_retrieval_mode: str = "dense"
+    bm25_enabled: bool = True
+    hybrid_candidate_factor: int = 5  # candidats par méthode = k * facteur
+    rrf_k: int = 60
+
+    # Cache des réponses du LLM (correspondance exacte puis sémantique)
+    response_cache_enabled: bool = True
+    response_cache_max_entries: int = 1000
+    response_cache_ttl: int = 3600  # secondes
+    response_cache_similarity_threshold: float = 0.95
+    response_cache_endpoints: List[str] = ["chat", "chat_rag"]  # endpoints autorisés à utiliser le cache (sessions sans historique uniquement)
+
+    # Assemblage du prompt sous budget de tokens
+    prompt_history_token_budget: int = 1500  # fenêtre de messages récents + résumé glissant
+    prompt_context_token_budget: int = 1500  # chunks RAG, ajoutés par pertinence
+    rag_context_candidates: int = 8  # chunks récupérés avant tri par budget
+    history_summary_min_messages: int = 6  # messages hors fenêtre avant mise à jour du résumé
+    history_summary_max_words: int = 150
+
+    # Résumés : map-reduce au-delà de summary_chunk_size caractères
+    summary_chunk_size: int = 12000
+    summary_map_concurrency: int = 4
+    summary_max_depth: int = 3  # passes map-reduce maximum (arrêt aussi si une passe ne réduit pas le texte)
+
+    # Passerelle des appels au LLM
+    llm_max_concurrency: int = 8  # appels simultanés au fournisseur, tous usages confondus
+    llm_call_timeout: float = 60  # secondes, hors attente en file
+    llm_stream_first_token_timeout: float = 30  # secondes avant le premier fragment d'un flux
+    llm_stream_chunk_timeout: float = 15  # secondes maximum entre deux fragments d'un flux
+
+    # Traces OpenTelemetry (si le paquet opentelemetry est installé et configuré)
+    otel_enabled: bool = False
+    # Outils de l'assistant (function calling)
+    tool_timeout: float = 10  # secondes par appel d'outil
+    tool_max_steps: int = 4  # allers-retours maximum avec le LLM par requête
+    tool_cache_max_entries: int = 256
+    tool_cache_ttl: int = 300  # secondes
 
     class Config:
         """Classe de configuration pour MongoDB."""
@@ -0,0 +1,88 @@
+# core/dependencies.py
+"""
+Conteneur de services partagé par tout le processus.
+Chaque service n'est construit qu'une seule fois (au démarrage de l'application)
+puis injecté dans les endpoints via FastAPI `Depends`.
+"""
+import logging
+from fastapi import Request
+from services.mongo_service import MongoService
+from services.rag_service import RAGService
+from services.llm_service import LLMService
+from services.ingestion_jobs import IngestionJobManager
+from services.metrics import metrics
+from core.config import settings
+
+
+class ServiceContainer:
+    """Regroupe les instances uniques des services de l'application"""
+
+    def __init__(self):
+        self.mongo_service = MongoService()
+        self.rag_service = RAGService()
+        self.llm_service = LLMService(
+            mongo_service=self.mongo_service,
+            rag_service=self.rag_service
+        )
+        self.ingestion_jobs = IngestionJobManager(
+            self.rag_service,
+            workers=settings.ingestion_workers,
+            batch_size=settings.ingestion_batch_size,
+            max_jobs_kept=settings.ingestion_max_jobs_kept
+        )
+        self._register_metrics()
+
+    def _register_metrics(self) -> None:
+        """Expose les compteurs existants des services sur /metrics (lus à la collecte)"""
+        llm_service, rag_service = self.llm_service, self.rag_service
+        metrics.register_stats("session_cache", "Cache des sessions", llm_service.conversation_store.stats)
+        metrics.register_stats("llm_gateway", "Passerelle LLM", llm_service.gateway.stats)
+        metrics.register_stats("assistant_tools", "Outils de l'assistant", llm_service.tools.stats)
+        metrics.register_stats("background_tasks", "Tâches de fond après réponse", llm_service.background.stats)
+        if llm_service.response_cache is not None:
+            metrics.register_stats("response_cache", "Cache des réponses", llm_service.response_cache.stats)
+        if rag_service.embedding_cache is not None:
+            metrics.register_stats("embedding_cache", "Cache des embeddings", rag_service.embedding_cache.stats)
+        metrics.register_stats("embedding_pipeline", "Pipeline d'embeddings", rag_service.embedding_pipeline.stats)
+        if self.mongo_service.write_behind is not None:
+            metrics.register_stats("mongo_write_behind", "Écriture différée MongoDB", self.mongo_service.write_behind.stats)
+        metrics.register_stats("ingestion", "Tâches d'indexation", lambda: {"pending": self.ingestion_jobs.pending()})
+
+    async def startup(self) -> None:
+        """Hook appelé au démarrage de l'application"""
+        await self.mongo_service.ensure_indexes()
+        await self.rag_service.start()
+        self.mongo_service.start()
+        self.llm_service.conversation_store.start()
+        self.ingestion_jobs.start()
+        logging.info("Service container started.")
+
+    async def shutdown(self) -> None:
+        """Libère les ressources (connexions, clients) à l'arrêt de l'application"""
+        await self.ingestion_jobs.stop()
+        await self.llm_service.conversation_store.stop()
+        await self.llm_service.stop()
+        await self.mongo_service.stop()
+        self.mongo_service.close()
+        self.rag_service.close()
+        logging.info("Service container stopped.")
+
+
+def get_container(request: Request) -> ServiceContainer:
+    return request.app.state.container
+
+
+def get_llm_service(request: Request) -> LLMService:
+    return get_container(request).llm_service
+
+
+def get_rag_service(request: Request) -> RAGService:
+    return get_container(request).rag_service
+
+
+def get_mongo_service(request: Request) -> MongoService:
+    return get_container(request).mongo_service
+
+
+def get_ingestion_jobs(request: Request) -> IngestionJobManager:
+    return get_container(request).ingestion_jobs
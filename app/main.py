@@ -1,28 +1,32 @@
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.router import router as api_router
-from services.llm_service import LLMService
+from core.dependencies import ServiceContainer
 import uvicorn
-from services.rag_service import RAGService
-from fastapi.responses import JSONResponse
-import json
 
-from fastapi import FastAPI
 
-app = FastAPI()
+load_dotenv()
 
-@app.get("/")
-def read_root():
-    return {"message": "Hello, Heroku!"}
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Construction unique des services pour tout le processus
+    container = ServiceContainer()
+    app.state.container = container
+    await container.startup()
+    try:
+        yield
+    finally:
+        await container.shutdown()
 
-load_dotenv()
 
 app = FastAPI(
     title="Agent conversationnel",
     description="API pour un agent conversationnel donné lors du TP1",
     version="1.0",
+    lifespan=lifespan,
 )
 
 app.add_middleware(
@@ -31,15 +35,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
-# Instance du service LLM
-llm_service = LLMService()
-rag_service = RAGService()
+@app.get("/")
+def read_root():
+    return {"message": "Hello, Heroku!"}
 
 # Inclure les routes
 app.include_router(api_router)
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import Any, ClassVar, Dict, List, Optional
+from typing import Any, ClassVar, Dict, List, Literal, Optional
 from pydantic import BaseModel, Field
 
 # models/chat.py
@@ -29,6 +29,8 @@ class ChatRequestTP2(BaseModel):
     """Requête de base pour une conversation sans contexte"""
     message: str
     session_id: str  # Ajouté pour supporter les deux versions
+    retrieval_mode: Optional[Literal["dense", "hybrid"]] = None  # Utilisé par les endpoints RAG
+    use_cache: bool = True  # False pour forcer un nouvel appel au LLM (ex. "régénérer")
 
 class ChatMessage(BaseModel):
     """Structure d'un message individuel dans l'historique"""
@@ -43,6 +45,7 @@ class ChatHistory(BaseModel):
 class SummaryRequest(BaseModel):
     text: str
     max_length: Optional[int] = 1000
+    mode: Literal["standard", "fast"] = "standard"  # "fast" : un seul appel structuré
 
 class SummaryResponse(BaseModel):
     full_summary: str
@@ -75,8 +78,35 @@ class MetadataResponse(BaseModel):
     summary: Optional[str] = None
     is_active: bool
 
+class SessionSummary(BaseModel):
+    """Résumé d'une session pour la liste des conversations"""
+    session_id: str
+    message_count: int = 0
+    last_activity: Optional[datetime] = None
+
+class SessionPage(BaseModel):
+    """Page de sessions avec le curseur de la page suivante"""
+    sessions: List[SessionSummary]
+    next_cursor: Optional[str] = None
+
+class IngestionJobResponse(BaseModel):
+    """Statut d'une tâche d'indexation en arrière-plan"""
+    job_id: str
+    status: str  # "queued", "running", "completed", "failed" ou "cancelled"
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    total_documents: int
+    processed_documents: int
+    failed_documents: int
+    progress: float
+    chunks: Dict[str, int]
+    documents_per_second: float
+    chunks_per_second: float
+    errors: List[str]
+
 # Pour l'assitant avec outils
 class ToolRequest(BaseModel):
     message: str
     session_id: str
-    tool: str
\ No newline at end of file
+    tool: Optional[str] = None  # outil à utiliser obligatoirement, sinon choisi par le modèle
\ No newline at end of file
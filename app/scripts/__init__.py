@@ -0,0 +1 @@
+# Ce dossier contient les scripts de maintenance (migrations de données, etc.)
@@ -0,0 +1,106 @@
+# scripts/migrate_conversation_buckets.py
+"""
+Migration des conversations vers le stockage par buckets.
+
+Les anciens documents `conversations` contiennent tous leurs messages dans un tableau
+`messages`. Ce script découpe ce tableau en buckets de taille fixe dans la collection
+des buckets, renseigne `message_count` puis supprime le tableau du document de session.
+Les sessions sans `updated_at` reçoivent aussi les champs dénormalisés utilisés par la
+liste paginée des sessions.
+
+À exécuter AVANT de déployer la version utilisant les buckets, application arrêtée : le
+nouveau code ne lit pas le tableau `messages` et le script réécrit `message_count`, ce
+qui n'est pas sûr si des messages sont ajoutés pendant la migration.
+Si des messages ont malgré tout déjà été écrits dans des buckets pour une session
+ancienne, ils sont conservés et placés après l'historique ancien (le résumé glissant
+de la session est alors effacé, il sera recalculé).
+Le script peut être relancé : seuls les documents possédant encore un champ `messages`
+sont traités, et une session dont les buckets ont déjà été réécrits (migration
+interrompue) ne reçoit pas une seconde fois l'historique ancien.
+
+Usage (depuis le dossier app/) :
+    python -m scripts.migrate_conversation_buckets [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict
+from pymongo import UpdateOne
+from services.mongo_service import MongoService
+
+
+async def migrate_session(mongo_service: MongoService, conversation: Dict, dry_run: bool = False) -> None:
+    """Fusionne l'historique ancien d'une session avec les buckets existants éventuels"""
+    session_id = conversation["session_id"]
+    bucket_size = mongo_service.bucket_size
+    legacy = conversation.get("messages") or []
+    buckets = await mongo_service._read_buckets({"session_id": session_id})
+    if buckets and buckets[0]["bucket_no"] == 0 and buckets[0].get("legacy_migrated"):
+        # Migration interrompue après la réécriture des buckets : l'historique ancien y est déjà
+        legacy = []
+    existing = [message for _, message in mongo_service._ordered_messages(buckets)]
+    messages = [{**message, "position": position} for position, message in enumerate(legacy + existing)]
+
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne(
+            {"session_id": session_id, "bucket_no": bucket_no},
+            {
+                "$set": {
+                    "messages": messages[start:start + bucket_size],
+                    "count": len(messages[start:start + bucket_size]),
+                    "legacy_migrated": True,
+                    "updated_at": now
+                },
+                "$setOnInsert": {"created_at": now}
+            },
+            upsert=True
+        )
+        for bucket_no, start in enumerate(range(0, len(messages), bucket_size))
+    ]
+    logging.info(
+        f"{session_id}: {len(legacy)} ancien(s) + {len(existing)} existant(s) message(s) -> {len(operations)} bucket(s)"
+    )
+    if dry_run:
+        return
+    if operations:
+        await mongo_service.buckets.bulk_write(operations, ordered=True)
+    update: Dict = {"$set": {"message_count": len(messages)}, "$unset": {"messages": ""}}
+    if existing and legacy:
+        # Le résumé portait sur les premiers messages sans l'historique ancien : il est recalculé
+        update["$unset"].update({"summary": "", "summary_upto": ""})
+    await mongo_service.conversations.update_one({"_id": conversation["_id"]}, update)
+
+
+async def migrate(dry_run: bool = False) -> int:
+    mongo_service = MongoService()
+    await mongo_service.ensure_indexes()
+    migrated = 0
+    try:
+        cursor = mongo_service.conversations.find({"messages": {"$exists": True}})
+        async for conversation in cursor:
+            await migrate_session(mongo_service, conversation, dry_run)
+            migrated += 1
+
+        # Les sessions sans dernière activité n'apparaissent pas dans la liste paginée
+        if not dry_run:
+            await mongo_service.conversations.update_many(
+                {"updated_at": {"$exists": False}},
+                [{"$set": {
+                    "updated_at": {"$ifNull": ["$created_at", datetime.utcnow()]},
+                    "message_count": {"$ifNull": ["$message_count", 0]}
+                }}]
+            )
+    finally:
+        mongo_service.close()
+    return migrated
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Migration des conversations vers le stockage par buckets")
+    parser.add_argument("--dry-run", action="store_true", help="Affiche la migration sans rien écrire")
+    args = parser.parse_args()
+    count = asyncio.run(migrate(dry_run=args.dry_run))
+    logging.info(f"{count} conversation(s) migrée(s)")
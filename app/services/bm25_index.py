@@ -0,0 +1,169 @@
+# services/bm25_index.py
+"""
+Index lexical BM25 maintenu de manière incrémentale sur les chunks indexés.
+Complète la recherche dense pour les termes exacts (compétences, frameworks,
+certifications) qu'un embedding rapproche mal.
+Les postings sont stockés dans une base SQLite FTS5 sur disque, partagée par tous les
+workers : une indexation faite par un worker est visible des autres sans redémarrage,
+et aucun worker ne garde de copie du corpus en mémoire.
+Les écritures passent par une connexion unique protégée par un verrou ; les recherches
+utilisent une connexion de lecture par thread (mode WAL) et n'attendent donc pas la fin
+d'une indexation en cours.
+"""
+import json
+import re
+import sqlite3
+import threading
+import unicodedata
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Mots conservant leurs caractères techniques : "c++", "c#", "node.js", "iso-27001"
+TOKEN_PATTERN = re.compile(r"\w+(?:[+#]+|(?:[.\-]\w+)+)?")
+# Les termes sont découpés par tokenize() : FTS5 ne doit couper que sur les espaces
+FTS_TOKENIZER = "unicode61 remove_diacritics 0 tokenchars '+#.-_'"
+
+
+def tokenize(text: str) -> List[str]:
+    """Découpe un texte en termes normalisés (minuscules, sans accents)"""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    folded = "".join(char for char in folded if not unicodedata.combining(char))
+    return TOKEN_PATTERN.findall(folded)
+
+
+class BM25Index:
+    def __init__(self, path: str):
+        """
+        Args:
+            path: Fichier SQLite de l'index (partagé entre workers)
+        """
+        self.path = path
+        # Verrou des écritures uniquement (les lectures ont leurs propres connexions)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " rowid INTEGER PRIMARY KEY,"
+            " id TEXT NOT NULL UNIQUE,"
+            " content TEXT NOT NULL,"
+            " metadata TEXT)"
+        )
+        self._conn.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(terms, tokenize="{FTS_TOKENIZER}")')
+        self._conn.commit()
+
+        # Une connexion de lecture par thread, en lecture seule
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def __len__(self) -> int:
+        return self._reader().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def _remove_unlocked(self, doc_ids: List[str]) -> None:
+        for start in range(0, len(doc_ids), 500):
+            batch = doc_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rowids = [(r,) for (r,) in self._conn.execute(
+                f"SELECT rowid FROM chunks WHERE id IN ({placeholders})", batch
+            )]
+            self._conn.executemany("DELETE FROM chunks_fts WHERE rowid = ?", rowids)
+            self._conn.executemany("DELETE FROM chunks WHERE rowid = ?", rowids)
+
+    def add(self, doc_id: str, text: str, metadata: Optional[Dict] = None) -> None:
+        """Ajoute (ou remplace) un chunk dans l'index"""
+        self.add_many([(doc_id, text, metadata or {})])
+
+    def add_many(self, chunks: Iterable[Tuple[str, str, Dict]]) -> None:
+        """Ajoute (ou remplace) des chunks en une seule transaction"""
+        chunks = list(chunks)
+        if not chunks:
+            return
+        with self._lock:
+            # BEGIN IMMEDIATE : un seul worker écrit à la fois dans l'index partagé
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._remove_unlocked([doc_id for doc_id, _, _ in chunks])
+                for doc_id, text, metadata in chunks:
+                    cursor = self._conn.execute(
+                        "INSERT OR REPLACE INTO chunks (id, content, metadata) VALUES (?, ?, ?)",
+                        (doc_id, text, json.dumps(metadata or {}))
+                    )
+                    self._conn.execute(
+                        "INSERT INTO chunks_fts (rowid, terms) VALUES (?, ?)",
+                        (cursor.lastrowid, " ".join(tokenize(text)))
+                    )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def remove(self, doc_ids: Iterable[str]) -> None:
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._remove_unlocked(doc_ids)
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM chunks_fts")
+                self._conn.execute("DELETE FROM chunks")
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def get(self, doc_id: str) -> Optional[Tuple[str, Dict]]:
+        row = self._reader().execute("SELECT content, metadata FROM chunks WHERE id = ?", (doc_id,)).fetchone()
+        return (row[0], json.loads(row[1] or "{}")) if row else None
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[str, float]]:
+        """Renvoie les k chunks les mieux classés par BM25 : [(id, score)]"""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        # Termes entre guillemets : aucun n'est interprété comme un opérateur FTS5
+        match = " OR ".join(f'"{term}"' for term in terms)
+        rows = self._reader().execute(
+            "SELECT c.id, bm25(chunks_fts) AS score FROM chunks_fts"
+            " JOIN chunks c ON c.rowid = chunks_fts.rowid"
+            " WHERE chunks_fts MATCH ? ORDER BY score LIMIT ?",
+            (match, k)
+        ).fetchall()
+        # bm25() de FTS5 est négatif (plus petit = plus pertinent)
+        return [(doc_id, -score) for doc_id, score in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fusionne plusieurs classements (listes d'identifiants) par Reciprocal Rank Fusion"""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -1,87 +1,196 @@
-from typing import Any, Dict
-from langchain.chains import LLMChain, SequentialChain
+import asyncio
+from typing import Any, Dict, List, Optional
 from langchain.prompts import PromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pydantic import BaseModel, Field
+from services.llm_gateway import LLMGateway, PRIORITY_BACKGROUND
+from services.metrics import span, traced
 import logging
 
+
+class StructuredSummary(BaseModel):
+    """Sortie structurée du mode rapide : les trois niveaux de résumé en un seul appel"""
+    full_summary: str = Field(description="Résumé détaillé du texte")
+    bullet_points: List[str] = Field(description="3 à 5 points clés")
+    one_liner: str = Field(description="Phrase de synthèse unique et percutante")
+
+
 class SummaryService:
-    def __init__(self, llm):
-        self.llm = llm
-        
+    def __init__(self, llm, chunk_size: int = 12000, chunk_overlap: int = 200, map_concurrency: int = 4,
+                 max_depth: int = 3, gateway: Optional[LLMGateway] = None):
+        """
+        Args:
+            llm: Modèle de chat utilisé par toutes les chaînes
+            chunk_size: Taille (caractères) au-delà de laquelle le texte est résumé en map-reduce
+            chunk_overlap: Chevauchement (caractères) entre deux morceaux
+            map_concurrency: Nombre maximal de morceaux résumés simultanément
+            max_depth: Nombre maximal de passes map-reduce sur un texte
+            gateway: Passerelle LLM (priorité basse) par laquelle passent les appels, si fournie
+        """
+        self.llm = gateway.wrap(llm, "summary", PRIORITY_BACKGROUND) if gateway else llm
+        self.chunk_size = chunk_size
+        self.max_depth = max_depth
+        self.text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self._map_slots = asyncio.Semaphore(map_concurrency)
+
         # Chaîne pour le résumé complet
         self.full_summary_prompt = PromptTemplate(
-            template="""Résumez le texte suivant en conservant les points importants :
-            
+            template="""Résumez le texte suivant en conservant les points importants, en {max_length} caractères maximum :
+
             {text}
-            
+
             Résumé détaillé :""",
+            input_variables=["text", "max_length"]
+        )
+        self.full_summary_chain = self.full_summary_prompt | self.llm | StrOutputParser()
+
+        # Chaîne "map" : résumé d'un morceau d'un long document
+        self.map_prompt = PromptTemplate(
+            template="""Voici un extrait d'un document plus long. Résumez-le en conservant les faits, chiffres et règles importants :
+
+            {text}
+
+            Résumé de l'extrait :""",
             input_variables=["text"]
         )
-        self.full_summary_chain = LLMChain(
-            llm=self.llm,
-            prompt=self.full_summary_prompt,
-            output_key="full_summary"
+        self.map_chain = self.map_prompt | self.llm | StrOutputParser()
+
+        # Chaîne "reduce" : fusion des résumés partiels
+        self.reduce_prompt = PromptTemplate(
+            template="""Voici les résumés successifs des parties d'un même document. Fusionnez-les en un résumé unique et cohérent, en {max_length} caractères maximum :
+
+            {text}
+
+            Résumé détaillé :""",
+            input_variables=["text", "max_length"]
         )
-        
+        self.reduce_chain = self.reduce_prompt | self.llm | StrOutputParser()
+
         # Chaîne pour les points clés
         self.bullet_points_prompt = PromptTemplate(
             template="""Extrayez les 3-5 points clés de ce résumé :
-            
+
             {full_summary}
-            
+
             Points clés :""",
             input_variables=["full_summary"]
         )
-        self.bullet_points_chain = LLMChain(
-            llm=self.llm,
-            prompt=self.bullet_points_prompt,
-            output_key="bullet_points"
-        )
-        
+        self.bullet_points_chain = self.bullet_points_prompt | self.llm | StrOutputParser()
+
         # Chaîne pour la phrase de synthèse
         self.one_liner_prompt = PromptTemplate(
-            template="""Résumez ces points clés en une seule phrase percutante :
-            
-            {bullet_points}
-            
+            template="""Résumez ce texte en une seule phrase percutante :
+
+            {full_summary}
+
             Phrase de synthèse :""",
-            input_variables=["bullet_points"]
-        )
-        self.one_liner_chain = LLMChain(
-            llm=self.llm,
-            prompt=self.one_liner_prompt,
-            output_key="one_liner"
+            input_variables=["full_summary"]
         )
-        
-        # Chaîne séquentielle complète
-        self.summary_chain = SequentialChain(
-            chains=[
-                self.full_summary_chain,
-                self.bullet_points_chain,
-                self.one_liner_chain
-            ],
-            input_variables=["text"],
-            output_variables=["full_summary", "bullet_points", "one_liner"]
+        self.one_liner_chain = self.one_liner_prompt | self.llm | StrOutputParser()
+
+        # Mode rapide : résumé, points clés et phrase de synthèse en un seul appel structuré
+        self.structured_prompt = PromptTemplate(
+            template="""Résumez le texte suivant. Fournissez un résumé détaillé de {max_length} caractères maximum,
+            3 à 5 points clés et une phrase de synthèse percutante :
+
+            {text}""",
+            input_variables=["text", "max_length"]
         )
+        structured_llm = llm.with_structured_output(StructuredSummary)
+        if gateway:
+            structured_llm = gateway.wrap(structured_llm, "summary", PRIORITY_BACKGROUND)
+        self.structured_chain = self.structured_prompt | structured_llm
+
+    @staticmethod
+    def _truncate(text: str, max_length: int) -> str:
+        """Coupe le texte à max_length caractères, si possible à la fin d'une phrase"""
+        text = text.strip()
+        if len(text) <= max_length:
+            return text
+        cut = text[:max_length]
+        end = max(cut.rfind(". "), cut.rfind(".\n"))
+        return cut[:end + 1] if end > 0 else cut.rstrip() + "…"
+
+    async def _map(self, chunk: str) -> str:
+        async with self._map_slots:
+            return await self.map_chain.ainvoke({"text": chunk})
+
+    async def _reduce(self, group: str, max_length: int) -> str:
+        async with self._map_slots:
+            return await self.reduce_chain.ainvoke({"text": group, "max_length": max_length})
+
+    @traced("summary", "map_reduce")
+    async def _condense(self, text: str, max_length: int) -> str:
+        """
+        Réduit un long texte par map-reduce jusqu'à ce qu'il tienne en un seul prompt.
+        Les morceaux sont résumés en parallèle ; si les résumés partiels restent trop longs,
+        ils sont à leur tour regroupés et réduits. Au plus max_depth passes, et arrêt dès
+        qu'une passe ne raccourcit pas le texte : le résultat est alors tronqué.
+        """
+        for depth in range(self.max_depth):
+            if len(text) <= self.chunk_size:
+                return text
+            previous_length = len(text)
+            chunks = self.text_splitter.split_text(text)
+            logging.info(f"Map-reduce summary (pass {depth + 1}): {len(chunks)} chunk(s) of {len(text)} characters")
+            partials = await asyncio.gather(*[self._map(chunk) for chunk in chunks])
+            text = "\n\n".join(partials)
+            if len(text) > self.chunk_size:
+                # Regroupement des résumés partiels par paquets tenant dans un prompt
+                groups = self.text_splitter.split_text(text)
+                text = "\n\n".join(await asyncio.gather(*[self._reduce(group, max_length) for group in groups]))
+            if len(text) >= previous_length:
+                logging.warning(f"Map-reduce summary: pass {depth + 1} did not shrink the text ({len(text)} characters)")
+                break
+        if len(text) > self.chunk_size:
+            logging.warning(f"Map-reduce summary: condensed text truncated to {self.chunk_size} characters")
+            text = self._truncate(text, self.chunk_size)
+        return text
 
-    async def generate_summary(self, text: str, max_length: int) -> Dict[str, Any]:
+    async def generate_summary(self, text: str, max_length: int, mode: str = "standard") -> Dict[str, Any]:
+        """
+        Args:
+            text: Texte à résumer (les textes longs sont résumés en map-reduce)
+            max_length: Longueur maximale (caractères) du résumé détaillé
+            mode: "standard" (points clés et synthèse calculés en parallèle)
+                ou "fast" (un seul appel structuré pour les trois niveaux)
+        """
+        if not 0 < max_length <= self.chunk_size:
+            raise ValueError(f"max_length doit être compris entre 1 et {self.chunk_size} caractères")
         try:
-            logging.info(f"Received text: {text}")
-            logging.info(f"Received max_length: {max_length}")
-
-            # Étape 1 : Résumé complet
-            full_summary_result = await self.full_summary_chain.arun({"text": text, "max_length": max_length})
-            
-            # Étape 2 : Points clés
-            bullet_points_result = await self.bullet_points_chain.arun({"full_summary": full_summary_result, "max_length": max_length})
-            
-            # Étape 3 : Phrase de synthèse
-            one_liner_result = await self.one_liner_chain.arun({"bullet_points": bullet_points_result, "max_length": max_length})
-            
+            logging.info(f"Summary requested: {len(text)} characters, max_length={max_length}, mode={mode}")
+            is_long = len(text) > self.chunk_size
+            condensed = await self._condense(text, max_length) if is_long else text
+
+            if mode == "fast":
+                with span("summary", "structured"):
+                    result = await self.structured_chain.ainvoke({"text": condensed, "max_length": max_length})
+                return {
+                    "full_summary": self._truncate(result.full_summary, max_length),
+                    "bullet_points": result.bullet_points,
+                    "one_liner": result.one_liner
+                }
+
+            # Étape 1 : Résumé complet (étape "reduce" pour un texte long)
+            summary_chain = self.reduce_chain if is_long else self.full_summary_chain
+            with span("summary", "full_summary"):
+                full_summary_result = self._truncate(
+                    await summary_chain.ainvoke({"text": condensed, "max_length": max_length}), max_length
+                )
+
+            # Étapes 2 et 3 : Points clés et phrase de synthèse, indépendants l'un de l'autre
+            with span("summary", "key_points"):
+                bullet_points_result, one_liner_result = await asyncio.gather(
+                    self.bullet_points_chain.ainvoke({"full_summary": full_summary_result}),
+                    self.one_liner_chain.ainvoke({"full_summary": full_summary_result})
+                )
+
             return {
                 "full_summary": full_summary_result,
-                "bullet_points": bullet_points_result.split("\n"),
-                "one_liner": one_liner_result
+                "bullet_points": [line for line in bullet_points_result.split("\n") if line.strip()],
+                "one_liner": one_liner_result.strip()
             }
         except Exception as e:
             logging.error(f"Error during summary generation: {str(e)}")
-            raise ValueError(f"Erreur lors de la génération du résumé : {str(e)}")
\ No newline at end of file
+            raise ValueError(f"Erreur lors de la génération du résumé : {str(e)}")
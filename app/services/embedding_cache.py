@@ -0,0 +1,188 @@
+# services/embedding_cache.py
+"""
+Cache persistant des embeddings, indexé par sha256(modèle, texte).
+Les vecteurs sont stockés dans une base SQLite locale (float32) avec une éviction
+des entrées les moins récemment utilisées lorsque la taille maximale est dépassée.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+
+
+class EmbeddingCacheStore:
+    def __init__(self, path: str, max_bytes: int = 512 * 1024 * 1024):
+        """
+        Args:
+            path: Chemin du fichier SQLite
+            max_bytes: Taille maximale (en octets) des vecteurs stockés avant éviction
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._compute_total_bytes()
+        self.evictions = 0
+
+    def _compute_total_bytes(self) -> int:
+        row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        return int(row[0])
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Renvoie les vecteurs trouvés pour les clés données (et met à jour leur date d'accès)"""
+        if not keys:
+            return {}
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # Découpage pour respecter la limite de paramètres de SQLite
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """Enregistre des vecteurs puis applique l'éviction si la taille maximale est dépassée"""
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, size, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+            self._total_bytes += sum(row[2] for row in rows)
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # La base peut être partagée entre workers : on recalcule la taille réelle
+        self._total_bytes = self._compute_total_bytes()
+        excess = self._total_bytes - self.max_bytes
+        if excess <= 0:
+            return
+        # On libère un peu plus que nécessaire pour éviter d'évincer à chaque insertion
+        target = excess + self.max_bytes // 10
+        freed = 0
+        keys = []
+        for key, size in self._conn.execute("SELECT key, size FROM embeddings ORDER BY last_access ASC"):
+            keys.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", keys)
+        self._conn.commit()
+        self._total_bytes -= freed
+        self.evictions += len(keys)
+        logging.info(f"Embedding cache eviction: {len(keys)} entries removed, {freed} bytes freed")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return {"entries": int(entries), "bytes": self._total_bytes, "evictions": self.evictions}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Enveloppe un objet Embeddings : les textes déjà vus (même modèle, même contenu)
+    sont servis depuis le cache sans appel au fournisseur.
+    """
+
+    def __init__(self, underlying: Embeddings, store: EmbeddingCacheStore, model: Optional[str] = None):
+        self.underlying = underlying
+        self.store = store
+        self.model = model or getattr(underlying, "model", underlying.__class__.__name__)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def _split_hits(self, texts: List[str], cached: Dict[str, List[float]], keys: List[str]) -> List[str]:
+        """Comptabilise les hits/misses et renvoie les textes à calculer (dédoublonnés)"""
+        missing: Dict[str, str] = {}
+        for text, key in zip(texts, keys):
+            if key in cached:
+                self.hits += 1
+            else:
+                self.misses += 1
+                missing.setdefault(key, text)
+        return list(missing.values())
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self.store.get_many(list(set(keys)))
+        missing = self._split_hits(texts, cached, keys)
+        if missing:
+            computed = dict(zip([self._key(text) for text in missing], self.underlying.embed_documents(missing)))
+            self.store.put_many(computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = await asyncio.to_thread(self.store.get_many, list(set(keys)))
+        missing = self._split_hits(texts, cached, keys)
+        if missing:
+            vectors = await self.underlying.aembed_documents(missing)
+            computed = dict(zip([self._key(text) for text in missing], vectors))
+            await asyncio.to_thread(self.store.put_many, computed)
+            cached.update(computed)
+        return [cached[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Statistiques d'utilisation du cache (taux de hit inclus)"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            **self.store.stats(),
+        }
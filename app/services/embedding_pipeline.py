@@ -0,0 +1,174 @@
+# services/embedding_pipeline.py
+"""
+Pipeline d'embeddings par lots pour l'indexation.
+Les chunks sont regroupés en lots limités en nombre et en tokens, plusieurs lots sont
+envoyés en parallèle, et la taille des lots comme le parallélisme s'adaptent aux
+limitations de débit (429) du fournisseur, avec un backoff exponentiel.
+"""
+import asyncio
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+from langchain_core.embeddings import Embeddings
+from services.token_counter import TokenCounter
+
+
+def _is_rate_limit(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or error.__class__.__name__ == "RateLimitError"
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Délai demandé par le fournisseur (en-tête Retry-After), s'il est présent"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveLimiter:
+    """Limite de requêtes simultanées ajustable à chaud"""
+
+    def __init__(self, limit: int, max_limit: int):
+        self.limit = limit
+        self.max_limit = max_limit
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def __aexit__(self, *exc):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def shrink(self) -> None:
+        async with self._condition:
+            self.limit = max(1, self.limit // 2)
+
+    async def grow(self) -> None:
+        async with self._condition:
+            if self.limit < self.max_limit:
+                self.limit += 1
+                self._condition.notify_all()
+
+
+class EmbeddingPipeline:
+    def __init__(self,
+                 embeddings: Embeddings,
+                 max_batch_size: int = 256,
+                 max_batch_tokens: int = 100000,
+                 max_concurrency: int = 4,
+                 max_retries: int = 6,
+                 initial_backoff: float = 1.0,
+                 counter: Optional[TokenCounter] = None):
+        """
+        Args:
+            embeddings: Objet Embeddings utilisé pour chaque lot (cache compris)
+            max_batch_size: Nombre maximal de chunks par requête
+            max_batch_tokens: Nombre maximal de tokens par requête
+            max_concurrency: Nombre maximal de requêtes simultanées
+            max_retries: Nombre de tentatives en cas de limitation de débit
+            initial_backoff: Délai (secondes) avant la première nouvelle tentative
+            counter: Compteur de tokens des lots (encodage cl100k_base par défaut, chargé au premier lot)
+        """
+        self.embeddings = embeddings
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.batch_size = max_batch_size
+        self.limiter = AdaptiveLimiter(max_concurrency, max_concurrency)
+        self.counter = counter or TokenCounter()
+        self._successes = 0
+
+        self.embedded_chunks = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.busy_seconds = 0.0
+        self.last_chunks_per_second = 0.0
+
+    def count_tokens(self, text: str) -> int:
+        return self.counter.count(text)
+
+    def _make_batches(self, texts: List[str]) -> List[List[str]]:
+        batches: List[List[str]] = []
+        current: List[str] = []
+        current_tokens = 0
+        for text in texts:
+            tokens = self.count_tokens(text)
+            if current and (len(current) >= self.batch_size or current_tokens + tokens > self.max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(text)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _on_success(self) -> None:
+        self._successes += 1
+        # Remontée progressive après une série de succès
+        if self._successes % 10 == 0:
+            self.batch_size = min(self.max_batch_size, self.batch_size * 2)
+            await self.limiter.grow()
+
+    async def _on_rate_limit(self) -> None:
+        self.rate_limited += 1
+        self._successes = 0
+        self.batch_size = max(1, self.batch_size // 2)
+        await self.limiter.shrink()
+
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.limiter:
+                    self.requests += 1
+                    vectors = await self.embeddings.aembed_documents(texts)
+                await self._on_success()
+                return vectors
+            except Exception as e:
+                if not _is_rate_limit(e) or attempt == self.max_retries:
+                    raise
+                await self._on_rate_limit()
+                delay = _retry_after(e) or self.initial_backoff * (2 ** attempt)
+                delay *= 1 + random.random() * 0.25
+                logging.warning(f"Embedding rate limited, retrying {len(texts)} chunk(s) in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                # Le lot est redécoupé si la taille de lot a été réduite entre-temps
+                if len(texts) > self.batch_size:
+                    parts = await asyncio.gather(*[
+                        self._embed_batch(batch) for batch in self._make_batches(texts)
+                    ])
+                    return [vector for part in parts for vector in part]
+        raise RuntimeError("Unreachable")
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """Calcule les embeddings de tous les textes, dans l'ordre"""
+        if not texts:
+            return []
+        started = time.monotonic()
+        parts = await asyncio.gather(*[self._embed_batch(batch) for batch in self._make_batches(texts)])
+        elapsed = time.monotonic() - started
+
+        self.embedded_chunks += len(texts)
+        self.busy_seconds += elapsed
+        self.last_chunks_per_second = len(texts) / elapsed if elapsed else 0.0
+        logging.info(f"Embedded {len(texts)} chunk(s) in {elapsed:.2f}s ({self.last_chunks_per_second:.1f} chunks/s)")
+        return [vector for part in parts for vector in part]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "embedded_chunks": self.embedded_chunks,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "batch_size": self.batch_size,
+            "concurrency": self.limiter.limit,
+            "chunks_per_second": self.embedded_chunks / self.busy_seconds if self.busy_seconds else 0.0,
+            "last_chunks_per_second": self.last_chunks_per_second,
+        }
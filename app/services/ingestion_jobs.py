@@ -0,0 +1,206 @@
+# services/ingestion_jobs.py
+"""
+File de tâches d'indexation en arrière-plan.
+La soumission renvoie immédiatement un identifiant de tâche ; un nombre borné de workers
+extrait, découpe et indexe les documents par lots via RAGService, et l'avancement est
+consultable à tout moment.
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional
+from services.rag_service import RAGService
+
+
+def discard_uploads(paths: Iterable[str]) -> None:
+    """Supprime des fichiers téléversés devenus inutiles (déjà absents : ignorés)"""
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning(f"Unable to remove uploaded file {path}: {str(e)}")
+
+
+class IngestionItem(NamedTuple):
+    """Document à indexer : nom de la source et fichier téléversé"""
+    source: str
+    path: str
+    is_pdf: bool
+
+
+class IngestionJob:
+    def __init__(self, items: List[IngestionItem], clear_existing: bool = False):
+        self.id = uuid.uuid4().hex
+        self.items = items
+        self.clear_existing = clear_existing
+        self.status = "queued"
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.processed_documents = 0
+        self.failed_documents = 0
+        self.chunks = {"added": 0, "unchanged": 0, "removed": 0}
+        self.errors: List[str] = []
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+
+    @property
+    def elapsed(self) -> float:
+        if self._started is None:
+            return 0.0
+        return (self._finished or time.monotonic()) - self._started
+
+    def to_dict(self) -> Dict:
+        total = len(self.items)
+        elapsed = self.elapsed
+        done = self.processed_documents + self.failed_documents
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "total_documents": total,
+            "processed_documents": self.processed_documents,
+            "failed_documents": self.failed_documents,
+            "progress": done / total if total else 1.0,
+            "chunks": dict(self.chunks),
+            "documents_per_second": done / elapsed if elapsed else 0.0,
+            "chunks_per_second": self.chunks["added"] / elapsed if elapsed else 0.0,
+            "errors": list(self.errors),
+        }
+
+
+class IngestionJobManager:
+    def __init__(self,
+                 rag_service: RAGService,
+                 workers: int = 1,
+                 batch_size: int = 16,
+                 max_jobs_kept: int = 1000):
+        """
+        Args:
+            rag_service: Service RAG utilisé pour l'extraction et l'indexation
+            workers: Nombre de tâches traitées simultanément
+            batch_size: Nombre de documents extraits puis indexés ensemble
+            max_jobs_kept: Nombre de tâches conservées pour la consultation du statut
+        """
+        self.rag_service = rag_service
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_jobs_kept = max_jobs_kept
+        self._jobs: "OrderedDict[str, IngestionJob]" = OrderedDict()
+        self._queue: "asyncio.Queue[IngestionJob]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    def submit(self, items: List[IngestionItem], clear_existing: bool = False) -> IngestionJob:
+        """Ajoute une tâche à la file et la renvoie sans attendre son traitement"""
+        job = IngestionJob(items, clear_existing=clear_existing)
+        self._jobs[job.id] = job
+        self._forget_old_jobs()
+        self._queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        return self._jobs.get(job_id)
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _forget_old_jobs(self) -> None:
+        # On ne retire que des tâches terminées, les plus anciennes d'abord
+        for job_id in list(self._jobs.keys()):
+            if len(self._jobs) <= self.max_jobs_kept:
+                break
+            if self._jobs[job_id].status in ("completed", "failed", "cancelled"):
+                del self._jobs[job_id]
+
+    async def _extract(self, item: IngestionItem) -> str:
+        if item.is_pdf:
+            return await self.rag_service.aextract_text_from_pdf(item.path)
+
+        def _read() -> str:
+            with open(item.path, "r", encoding="utf-8", errors="replace") as f:
+                return f.read().strip()
+        return await asyncio.to_thread(_read)
+
+    async def _process(self, job: IngestionJob) -> None:
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        job._started = time.monotonic()
+        clear_existing = job.clear_existing
+        try:
+            for start in range(0, len(job.items), self.batch_size):
+                batch = job.items[start:start + self.batch_size]
+                texts = await asyncio.gather(*[self._extract(item) for item in batch], return_exceptions=True)
+                # Le texte est extrait : les fichiers du lot ne servent plus
+                await asyncio.to_thread(discard_uploads, [item.path for item in batch])
+
+                documents = []
+                for item, text in zip(batch, texts):
+                    if isinstance(text, Exception):
+                        job.failed_documents += 1
+                        job.errors.append(f"{item.source}: {str(text)}")
+                    else:
+                        documents.append((item.source, text))
+
+                if documents:
+                    try:
+                        counts = await self.rag_service.index_documents(documents, clear_existing=clear_existing)
+                        for key, value in counts.items():
+                            job.chunks[key] += value
+                        job.processed_documents += len(documents)
+                    except Exception as e:
+                        job.failed_documents += len(documents)
+                        job.errors.append(f"Indexation du lot {start // self.batch_size}: {str(e)}")
+                # L'index n'est vidé qu'avant le premier lot
+                clear_existing = False
+            job.status = "failed" if job.failed_documents and not job.processed_documents else "completed"
+        except asyncio.CancelledError:
+            # Arrêt du service pendant le traitement : la tâche est marquée interrompue
+            job.status = "cancelled"
+            job.finished_at = datetime.utcnow()
+            job._finished = time.monotonic()
+            job.errors.append("Tâche interrompue à l'arrêt du service")
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.errors.append(str(e))
+            logging.error(f"Ingestion job {job.id} failed: {str(e)}")
+        finally:
+            if job._finished is None:
+                job.finished_at = datetime.utcnow()
+                job._finished = time.monotonic()
+            # Fichiers des lots non traités (tâche en échec ou interrompue)
+            await asyncio.shield(asyncio.to_thread(discard_uploads, [item.path for item in job.items]))
+            logging.info(f"Ingestion job {job.id} {job.status} in {job.elapsed:.2f}s")
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            finally:
+                self._queue.task_done()
+
+    def start(self) -> None:
+        """Démarre les workers d'indexation"""
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Arrête les workers (les tâches en cours sont interrompues, celles en file abandonnées)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while not self._queue.empty():
+            job = self._queue.get_nowait()
+            job.status = "failed"
+            job.errors.append("Tâche abandonnée à l'arrêt du service")
+            discard_uploads(item.path for item in job.items)
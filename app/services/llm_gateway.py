@@ -0,0 +1,280 @@
+# services/llm_gateway.py
+"""
+Passerelle des appels sortants au LLM.
+- Single-flight : les appels identiques en cours sont fusionnés en un seul appel amont.
+- Limite globale de concurrence avec file de priorité (le chat passe avant les résumés
+  et les outils).
+- Délai maximal par appel (premier fragment puis fragments suivants pour les flux) et
+  métriques d'attente en file.
+"""
+import asyncio
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+from langchain_core.runnables import Runnable, RunnableConfig
+from services.metrics import LLM_CALLS, LLM_QUEUE_WAIT_SECONDS, record_llm_usage, span
+
+# Plus la valeur est basse, plus l'appel est prioritaire
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 10
+
+
+class PriorityLimiter:
+    """Sémaphore dont les places libérées sont attribuées par ordre de priorité, puis d'arrivée"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority: int) -> None:
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # La place a pu être attribuée juste avant l'annulation : on la rend
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        # La place est transmise directement au prochain appel en attente
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                future.set_result(None)
+                return
+        self.in_flight -= 1
+
+
+class CallStats:
+    def __init__(self):
+        self.calls = 0
+        self.upstream_calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        return {
+            "calls": self.calls,
+            "upstream_calls": self.upstream_calls,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+            "queue_wait_avg": self.queue_wait_total / self.upstream_calls if self.upstream_calls else 0.0,
+            "queue_wait_max": self.queue_wait_max,
+        }
+
+
+class LLMGateway:
+    def __init__(self, max_concurrency: int = 8, timeout: Optional[float] = 60,
+                 first_token_timeout: Optional[float] = 30, chunk_timeout: Optional[float] = 15):
+        """
+        Args:
+            max_concurrency: Nombre maximal d'appels simultanés au fournisseur (tous usages confondus)
+            timeout: Délai maximal (secondes) d'un appel, hors attente en file (None = illimité)
+            first_token_timeout: Délai maximal (secondes) avant le premier fragment d'un flux
+            chunk_timeout: Délai maximal (secondes) entre deux fragments d'un flux
+        """
+        self.limiter = PriorityLimiter(max_concurrency)
+        self.timeout = timeout
+        self.first_token_timeout = first_token_timeout
+        self.chunk_timeout = chunk_timeout
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._stats: Dict[str, CallStats] = {}
+
+    def _stats_for(self, name: str) -> CallStats:
+        return self._stats.setdefault(name, CallStats())
+
+    async def _acquire(self, name: str, priority: int) -> None:
+        """Attend une place et comptabilise le temps passé en file"""
+        started = time.monotonic()
+        await self.limiter.acquire(priority)
+        waited = time.monotonic() - started
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, usage=name)
+        LLM_CALLS.inc(usage=name, outcome="upstream")
+        stats = self._stats_for(name)
+        stats.upstream_calls += 1
+        stats.queue_wait_total += waited
+        stats.queue_wait_max = max(stats.queue_wait_max, waited)
+
+    async def _execute(self, name: str, priority: int, call: Callable[[], Awaitable[Any]],
+                       timeout: Optional[float]) -> Any:
+        await self._acquire(name, priority)
+        try:
+            with span("llm", name):
+                result = await asyncio.wait_for(call(), timeout)
+            record_llm_usage(name, result)
+            return result
+        except asyncio.TimeoutError:
+            self._stats_for(name).timeouts += 1
+            LLM_CALLS.inc(usage=name, outcome="timeout")
+            logging.warning(f"LLM call '{name}' timed out after {timeout}s")
+            raise
+        except Exception:
+            self._stats_for(name).errors += 1
+            LLM_CALLS.inc(usage=name, outcome="error")
+            raise
+        finally:
+            self.limiter.release()
+
+    async def run(self, name: str, call: Callable[[], Awaitable[Any]], priority: int = PRIORITY_INTERACTIVE,
+                  key: Optional[str] = None, timeout: Optional[float] = None) -> Any:
+        """
+        Exécute un appel au LLM sous la limite de concurrence
+
+        Args:
+            name: Usage de l'appel (métriques)
+            call: Fonction lançant l'appel amont
+            priority: Priorité dans la file d'attente
+            key: Empreinte de l'appel ; les appels de même clé en cours sont fusionnés
+            timeout: Délai maximal propre à cet appel (par défaut celui de la passerelle)
+        """
+        self._stats_for(name).calls += 1
+        timeout = timeout if timeout is not None else self.timeout
+        if key is None:
+            return await self._execute(name, priority, call, timeout)
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            self._stats_for(name).coalesced += 1
+            LLM_CALLS.inc(usage=name, outcome="coalesced")
+        else:
+            task = asyncio.create_task(self._execute(name, priority, call, timeout))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # shield : l'annulation d'un appelant (client déconnecté) n'annule pas l'appel partagé
+        return await asyncio.shield(task)
+
+    async def stream(self, name: str, chunks: Callable[[], AsyncIterator[Any]],
+                     priority: int = PRIORITY_INTERACTIVE) -> AsyncIterator[Any]:
+        """
+        Flux sous la limite de concurrence (non fusionné : chaque flux a son propre consommateur).
+        Un fournisseur muet avant le premier fragment ou entre deux fragments lève TimeoutError
+        et libère la place.
+        """
+        self._stats_for(name).calls += 1
+        await self._acquire(name, priority)
+        iterator = chunks().__aiter__()
+        timeout = self.first_token_timeout
+        try:
+            with span("llm", f"{name}_stream"):
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(iterator.__anext__(), timeout)
+                    except StopAsyncIteration:
+                        break
+                    yield chunk
+                    timeout = self.chunk_timeout
+        except asyncio.TimeoutError:
+            self._stats_for(name).timeouts += 1
+            LLM_CALLS.inc(usage=name, outcome="timeout")
+            logging.warning(f"LLM stream '{name}' timed out after {timeout}s without a chunk")
+            raise
+        except Exception:
+            self._stats_for(name).errors += 1
+            LLM_CALLS.inc(usage=name, outcome="error")
+            raise
+        finally:
+            self.limiter.release()
+            aclose = getattr(iterator, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def wrap(self, runnable: Runnable, name: str, priority: int = PRIORITY_INTERACTIVE,
+             timeout: Optional[float] = None) -> "GatedRunnable":
+        """Enveloppe un modèle (ou tout Runnable) pour que ses appels passent par la passerelle"""
+        return GatedRunnable(runnable, self, name, priority, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "in_flight": self.limiter.in_flight,
+            "queued": self.limiter.queued,
+            "max_concurrency": self.limiter.limit,
+            "calls": {name: stats.to_dict() for name, stats in self._stats.items()},
+        }
+
+
+# Champs d'un message sans effet sur la requête envoyée au modèle (identifiants, métadonnées de réponse)
+_UNKEYED_MESSAGE_FIELDS = {"id", "response_metadata", "usage_metadata"}
+
+
+def _message_key(message: Any) -> Any:
+    # Message complet : appels d'outils (AIMessage.tool_calls), identifiant d'appel
+    # (ToolMessage.tool_call_id), nom, additional_kwargs...
+    if hasattr(message, "model_dump"):
+        return message.model_dump(exclude=_UNKEYED_MESSAGE_FIELDS)
+    return message
+
+
+def _input_key(name: str, input: Any, kwargs: Dict[str, Any]) -> str:
+    """Empreinte d'un appel : usage, messages du prompt et paramètres (stop, outils...)"""
+    if hasattr(input, "to_messages"):
+        input = input.to_messages()
+    if isinstance(input, list):
+        input = [_message_key(message) for message in input]
+    payload = json.dumps([name, input, kwargs], default=repr, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class GatedRunnable(Runnable):
+    """Runnable dont les appels asynchrones passent par une LLMGateway"""
+
+    def __init__(self, bound: Runnable, gateway: LLMGateway, name: str,
+                 priority: int = PRIORITY_INTERACTIVE, timeout: Optional[float] = None):
+        self.bound = bound
+        self.gateway = gateway
+        self.name = name
+        self.priority = priority
+        self.timeout = timeout
+
+    @property
+    def InputType(self) -> Any:
+        return self.bound.InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return self.bound.OutputType
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None):
+        return self.bound.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None):
+        return self.bound.get_output_schema(config)
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        # Les appels synchrones ne sont pas utilisés par l'application et ne sont pas limités
+        return self.bound.invoke(input, config, **kwargs)
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return await self.gateway.run(
+            self.name,
+            lambda: self.bound.ainvoke(input, config, **kwargs),
+            priority=self.priority,
+            key=_input_key(self.name, input, kwargs),
+            timeout=self.timeout
+        )
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        async for chunk in self.gateway.stream(
+            self.name,
+            lambda: self.bound.astream(input, config, **kwargs),
+            priority=self.priority
+        ):
+            yield chunk
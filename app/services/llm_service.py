@@ -1,33 +1,30 @@
 from datetime import datetime
-from langchain_openai import ChatOpenAI
-from langchain.schema import HumanMessage, SystemMessage, AIMessage
+import logging
 import os
-from typing import Any, List, Dict
-from services.mongo_service import MongoService
+from typing import Any, AsyncIterator, List, Dict, Optional, Tuple
 
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage, AIMessage
+from langchain_core.messages import BaseMessage, SystemMessage, HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.runnables.history import RunnableWithMessageHistory
+from services.mongo_service import MongoService
 from services.memory import InMemoryHistory
 from services.memoryAdvenced import EnhancedMemoryHistory
+from services.session_cache import SessionCache
+from services.response_cache import CacheLookup, ResponseCache
+from services.prompt_builder import PromptBuilder, TokenCounter
+from services.llm_gateway import LLMGateway, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE
+from services.metrics import span, traced
+from services.pipeline import BackgroundTasks, Stage, StagePipeline
+from services.mongo_history import MongoChatMessageHistory
+from core.config import settings
 from services.chains import SummaryService
 from services.tools import AssistantTools
-import os
-from typing import List, Dict, Optional
 from services.rag_service import RAGService
-import logging 
-import re
-from pymongo.collection import Collection
-import uuid
 
 class LLMService:
 
-    def __init__(self):
-        self.mongo_service = MongoService("DATABASE_NAME")
-
-    def __init__(self):
+    def __init__(self, mongo_service: Optional[MongoService] = None, rag_service: Optional[RAGService] = None):
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             raise ValueError("OPENAI_API_KEY n'est pas définie")
@@ -36,170 +33,301 @@ class LLMService:
         self.llm = ChatOpenAI(
             temperature=0.7,
             model_name="gpt-3.5-turbo",
-            api_key=api_key
+            api_key=api_key,
+            base_url=settings.openai_base_url
         )
-        self.rag_service = RAGService()
+
+        # Tous les appels au LLM passent par la passerelle : appels identiques fusionnés,
+        # concurrence globale limitée, le chat étant prioritaire sur les tâches de fond
+        self.gateway = LLMGateway(
+            max_concurrency=settings.llm_max_concurrency,
+            timeout=settings.llm_call_timeout,
+            first_token_timeout=settings.llm_stream_first_token_timeout,
+            chunk_timeout=settings.llm_stream_chunk_timeout
+        )
+        self.chat_model = self.gateway.wrap(self.llm, "chat", PRIORITY_INTERACTIVE)
         
-        # Configuration pour le TP2
-        self.conversation_store = {}
+        # Configuration pour le TP2 : cache borné (LRU + expiration) des historiques,
+        # chaque historique étant hydraté depuis MongoDB et persisté à chaque tour
+        self.conversation_store = SessionCache(
+            factory=lambda session_id: MongoChatMessageHistory(
+                session_id,
+                self.mongo_service,
+                max_messages=settings.session_max_messages,
+                refresh_interval=settings.session_history_refresh
+            ),
+            max_sessions=settings.session_max_sessions,
+            idle_timeout=settings.session_idle_timeout,
+            sweep_interval=settings.session_sweep_interval
+        )
         # self.prompt = ChatPromptTemplate.from_messages([
         #     ("system", "Vous êtes un assistant utile et concis."),
         #     MessagesPlaceholder(variable_name="history"),
         #     ("human", "{question}")
         # ])
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", "Vous êtes un assistant spécialisé uniquement en ressources humaines. Vous êtes un assistant linguistique IA avec une expertise en ressources humaines (RH)."
+        system_prompt = ("Vous êtes un assistant spécialisé uniquement en ressources humaines. Vous êtes un assistant linguistique IA avec une expertise en ressources humaines (RH)."
             "Votre objectif principal est de fournir des réponses détaillées et précises liées au recrutement, à la gestion des talents, à l'engagement des employés, aux politiques RH, à la rémunération et aux avantages sociaux, à la conformité et au développement organisationnel,"
             "aux politiques RH et aux sujets connexes. "
             "Assurez-vous que vos réponses sont pertinentes pour les professionnels des RH ou les demandeurs d'emploi."
             "Évitez les interprétations qui ne sont pas liées aux RH, sauf demande explicite."
-            "Pour les questions hors de ce domaine, répondez : 'Je suis désolé, je ne suis spécialisé que dans les ressources humaines.'"),
+            "Pour les questions hors de ce domaine, répondez : 'Je suis désolé, je ne suis spécialisé que dans les ressources humaines.'")
+        self.prompt = ChatPromptTemplate.from_messages([
+            ("system", system_prompt),
             ("system", "Contexte : {context}"),
             MessagesPlaceholder(variable_name="history"),
             ("human", "{question}")
         ])
         
-        self.chain = self.prompt | self.llm
-        
-        # Configuration du gestionnaire d'historique
-        self.chain_with_history = RunnableWithMessageHistory(
-            self.chain,
-            self._get_session_history,
-            input_messages_key="question",
-            history_messages_key="history"
-        )
+        # Les entrées du prompt (historique fenêtré, contexte) sont préparées par les étapes
+        # du tour (voir _turn_stages), l'historique est mis à jour après la réponse
+        self.chain = self.prompt | self.chat_model
+
+        # Écritures faites après la réponse (historique), hors du chemin critique
+        self.background = BackgroundTasks()
 
-        # Configuration de MongoDB
-        self.mongo_service = MongoService()
+        # Configuration de MongoDB (partagée via le conteneur de services si fournie)
+        self.mongo_service = mongo_service or MongoService()
+
+        # Assemblage du prompt sous budget de tokens
+        self.prompt_builder = PromptBuilder(
+            self.gateway.wrap(self.llm, "history_summary", PRIORITY_BACKGROUND),
+            self.mongo_service,
+            TokenCounter(self.llm.model_name),
+            system_prompt=system_prompt,
+            history_budget=settings.prompt_history_token_budget,
+            context_budget=settings.prompt_context_token_budget,
+            summary_min_messages=settings.history_summary_min_messages,
+            summary_max_words=settings.history_summary_max_words
+        )
 
         # Configuration du service de résumé pour le TP2 exo 1 (voir services/chains.py)
-        self.summary_service = SummaryService(self.llm)
+        self.summary_service = SummaryService(
+            self.llm,
+            gateway=self.gateway,
+            chunk_size=settings.summary_chunk_size,
+            map_concurrency=settings.summary_map_concurrency,
+            max_depth=settings.summary_max_depth
+        )
 
         # Configuration pour l'Assistant avec Outils
-        self.tools = AssistantTools(self.llm)
+        self.tools = AssistantTools(
+            self.llm,
+            gateway=self.gateway,
+            tool_timeout=settings.tool_timeout,
+            max_steps=settings.tool_max_steps,
+            cache_max_entries=settings.tool_cache_max_entries,
+            cache_ttl=settings.tool_cache_ttl
+        )
 
-                # Ajout du service RAG
-        self.rag_service = RAGService()
+        # Ajout du service RAG (partagé via le conteneur de services si fourni)
+        self.rag_service = rag_service or RAGService()
+
+        # Cache des réponses : les questions récurrentes sont servies sans appel au LLM
+        self.response_cache: Optional[ResponseCache] = None
+        if settings.response_cache_enabled:
+            self.response_cache = ResponseCache(
+                self.rag_service.embeddings,
+                max_entries=settings.response_cache_max_entries,
+                ttl=settings.response_cache_ttl,
+                similarity_threshold=settings.response_cache_similarity_threshold
+            )
 
     
     def _get_session_history(self, session_id: str) -> BaseChatMessageHistory:
         """Récupère ou crée l'historique pour une session donnée"""
-        if session_id not in self.conversation_store:
-            self.conversation_store[session_id] = InMemoryHistory()
-        return self.conversation_store[session_id]
+        return self.conversation_store.get(session_id)
     
     def _get_session_history_advanced(self, session_id: str) -> BaseChatMessageHistory:
-        if session_id not in self.conversation_store:
-            self.conversation_store[session_id] = EnhancedMemoryHistory()
-        return self.conversation_store[session_id]
+        return self.conversation_store.get(
+            session_id,
+            factory=lambda _: EnhancedMemoryHistory(max_messages=settings.session_max_messages)
+        )
 
     
-    async def generate_response(self, message: str, session_id: str, context: Optional[List[Dict[str, str]]] = None, use_rag: bool = False) -> str:
-        # Retrieve conversation history
-        
-        history = await self.mongo_service.get_conversation_history(session_id)
-
-        # Initialize RAG context
+    async def _build_rag_context(self, message: str, retrieval_mode: Optional[str] = None) -> str:
+        """Construit le contexte RAG à partir des documents les plus pertinents, dans le budget de tokens"""
         rag_context = ""
+        with span("llm_service", "retrieval"):
+            relevant_docs = await self.rag_service.search(message, k=settings.rag_context_candidates, mode=retrieval_mode)
+        if relevant_docs:
+            rag_context, tokens = self.prompt_builder.pack_context(relevant_docs)
+            logging.info(f"RAG context generated: {len(relevant_docs)} chunk(s) retrieved, {tokens} tokens")
+        return rag_context
+
+    def _cache_namespace(self, cache_scope: Optional[str], use_rag: bool, retrieval_mode: Optional[str]) -> Optional[str]:
+        """Espace du cache de réponses pour un endpoint, ou None si le cache n'est pas utilisé"""
+        if self.response_cache is None or cache_scope not in settings.response_cache_endpoints:
+            return None
+        if not use_rag:
+            return cache_scope
+        # Les réponses RAG dépendent du mode de recherche et de la version du corpus
+        mode = retrieval_mode or settings.rag_retrieval_mode
+        return f"{cache_scope}:{mode}:{self.rag_service.corpus_version}"
+
+    async def _lookup_cached_response(self, namespace: str, message: str, context: str,
+                                      history: BaseChatMessageHistory, messages: List[BaseMessage]) -> Optional[CacheLookup]:
+        """
+        Cherche la réponse en cache, uniquement si la session n'a pas encore d'historique :
+        la clé du cache ignore la conversation, une question de suivi ("et le deuxième ?")
+        ou une réponse contenant des données d'une session ne doit pas être partagée.
+        """
+        if messages or getattr(history, "summary", ""):
+            self.response_cache.record_bypass()
+            return None
+        return await self.response_cache.lookup(namespace, message, context)
+
+    def _turn_stages(self, history: BaseChatMessageHistory, message: str, session_id: str, use_rag: bool,
+                     retrieval_mode: Optional[str], namespace: Optional[str]) -> List[Stage]:
+        """
+        Étapes précédant l'appel au LLM. Le chargement de l'historique et la recherche RAG
+        (embedding de la requête compris) sont indépendants et s'exécutent en parallèle ;
+        le cache de réponses attend les deux (il n'est consulté que sans historique).
+        """
+        context_stage = ("retrieval",) if use_rag else ()
+        stages = [Stage("history", lambda _: history.aget_messages())]
         if use_rag:
-            # Fetch relevant documents for RAG
-            relevant_docs = await self.rag_service.similarity_search(message)
-            if relevant_docs:
-                # rag_context = "\n\n".join([doc.page_content for doc in relevant_docs])
-                rag_context = "\n\n".join([f"- {doc.page_content}" for doc in relevant_docs])
-                logging.info(f"RAG Context generated: {rag_context}")
-
-        # Include context in messages for the LLM
-        messages = [SystemMessage(content="You are a helpful assistant.")]
-        if rag_context:
-            messages.append(SystemMessage(content=f"Context: {rag_context}"))
-
-        # Add history to messages
-        for msg in history:
-            if msg["role"] == "user":
-                messages.append(HumanMessage(content=msg["content"]))
-            elif msg["role"] == "assistant":
-                messages.append(AIMessage(content=msg["content"]))
-
-        # Add user query
-        messages.append(HumanMessage(content=message))
-
-        # Generate response with the chain
-        response = await self.chain_with_history.ainvoke(
-            {"question": message, "context": rag_context},
-            config={"configurable": {"session_id": session_id}}
+            # Fetch relevant documents for RAG ("dense" ou "hybrid")
+            stages.append(Stage("retrieval", lambda _: self._build_rag_context(message, retrieval_mode)))
+        if namespace is not None:
+            # Cache des réponses (cache_scope : nom de l'endpoint, None pour ne pas l'utiliser)
+            stages.append(Stage(
+                "response_cache",
+                lambda results: self._lookup_cached_response(
+                    namespace, message, results.get("retrieval", ""), history, results["history"]
+                ),
+                ("history",) + context_stage
+            ))
+        # Historique ramené au budget de tokens (fenêtre + résumé glissant)
+        stages.append(Stage(
+            "prompt",
+            lambda results: self.prompt_builder.fit(
+                {"question": message, "context": results.get("retrieval", ""), "history": results["history"]},
+                history,
+                session_id
+            ),
+            ("history",) + context_stage
+        ))
+        return stages
+
+    def _persist_turn(self, history: BaseChatMessageHistory, session_id: str, message: str, response: str) -> None:
+        """
+        Ajoute le tour à l'historique : le cache local est mis à jour immédiatement (le tour
+        suivant le voit), l'écriture MongoDB est faite en tâche de fond, dans l'ordre par session.
+        """
+        messages = [HumanMessage(content=message), AIMessage(content=response)]
+        if not isinstance(history, MongoChatMessageHistory):
+            self.background.submit("save_history", lambda: history.aadd_messages(messages), key=session_id)
+            return
+        history.append_local(messages)
+        # En cas d'échec, le cache local diverge de MongoDB : il sera rechargé
+        self.background.submit(
+            "save_history",
+            lambda: history.persist(messages),
+            key=session_id,
+            on_error=lambda _: history.invalidate()
         )
-        response_text = response.content
 
-        # Save the messages to MongoDB
-        await self.mongo_service.save_message(session_id, "user", message)
-        await self.mongo_service.save_message(session_id, "assistant", response_text)
+    @staticmethod
+    def _log_timings(session_id: str, timings: Dict[str, float]) -> None:
+        logging.info(
+            f"Turn stages for session {session_id}: "
+            + ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in timings.items())
+        )
 
-        return response_text
+    @traced("llm_service")
+    async def generate_response(self, message: str, session_id: str, context: Optional[List[Dict[str, str]]] = None, use_rag: bool = False, retrieval_mode: Optional[str] = None, cache_scope: Optional[str] = None) -> str:
+        history = self._get_session_history(session_id)
+        namespace = self._cache_namespace(cache_scope, use_rag, retrieval_mode)
+        stages = self._turn_stages(history, message, session_id, use_rag, retrieval_mode, namespace)
 
-    
-    async def get_conversation_history(self, session_id: str) -> List[Dict[str, str]]:
-        """Récupère l'historique depuis MongoDB"""
-        return await self.mongo_service.get_conversation_history(session_id)
+        async def generate(results: Dict[str, Any]) -> str:
+            cached = results.get("response_cache")
+            if cached is not None and cached.response is not None:
+                return cached.response
+            response = await self.chain.ainvoke(results["prompt"])
+            return response.content
+
+        llm_after = ("prompt", "response_cache") if namespace is not None else ("prompt",)
+        stages.append(Stage("llm", generate, llm_after))
+        results, timings = await StagePipeline("turn", stages).run()
+        self._log_timings(session_id, timings)
+
+        response = results["llm"]
+        self._persist_turn(history, session_id, message, response)
+        cached = results.get("response_cache")
+        if cached is not None and cached.response is None:
+            self.response_cache.store(namespace, message, results.get("retrieval", ""), response, cached.vector)
+        return response
+
+    async def stream_response(self, message: str, session_id: str, use_rag: bool = False, retrieval_mode: Optional[str] = None, cache_scope: Optional[str] = None) -> AsyncIterator[str]:
+        """
+        Variante streamée de generate_response : renvoie les tokens au fur et à mesure.
+        L'historique n'est mis à jour qu'une fois le flux terminé.
+        """
+        history = self._get_session_history(session_id)
+        namespace = self._cache_namespace(cache_scope, use_rag, retrieval_mode)
+        results, timings = await StagePipeline(
+            "turn", self._turn_stages(history, message, session_id, use_rag, retrieval_mode, namespace)
+        ).run()
+        self._log_timings(session_id, timings)
+
+        cached = results.get("response_cache")
+        if cached is not None and cached.response is not None:
+            self._persist_turn(history, session_id, message, cached.response)
+            yield cached.response
+            return
+
+        tokens = []
+        with span("turn", "llm_stream"):
+            async for chunk in self.chain.astream(results["prompt"]):
+                if chunk.content:
+                    tokens.append(chunk.content)
+                    yield chunk.content
+        # Historique et cache mis à jour uniquement si le flux est allé jusqu'au bout
+        response = "".join(tokens)
+        self._persist_turn(history, session_id, message, response)
+        if cached is not None:
+            self.response_cache.store(namespace, message, results.get("retrieval", ""), response, cached.vector)
+
+    async def get_conversation_history(self, session_id: str, skip: Optional[int] = None, limit: Optional[int] = None) -> List[Dict[str, str]]:
+        """
+        Récupère l'historique depuis MongoDB.
+        Avec `limit` seul, renvoie les derniers messages ; avec `skip` et `limit`, une page.
+        """
+        if limit is None:
+            return await self.mongo_service.get_conversation_history(session_id)
+        if skip is None:
+            return await self.mongo_service.get_recent_messages(session_id, limit)
+        return await self.mongo_service.get_messages_page(session_id, skip, limit)
 
     # Ajout de la méthode pour générer un résumé
-    async def generate_summary(self, text: str, max_length: int) -> Dict[str, Any]:
+    async def generate_summary(self, text: str, max_length: int, mode: str = "standard") -> Dict[str, Any]:
         try:
-            print("text", text)
-            logging.info(f"Original text: {text}")
             sanitized_text = text.replace(" ", " ").replace("\n", " ")
-            print(sanitized_text)
-            logging.info(f"Sanitized text: {sanitized_text}")
-            result = await self.summary_service.generate_summary(sanitized_text, max_length)
-            logging.info(f"Summary result: {result}")
-            return result
+            return await self.summary_service.generate_summary(sanitized_text, max_length, mode)
         except Exception as e:
             logging.error(f"Error during summary generation: {str(e)}")
             raise ValueError(f"Erreur lors de la génération du résumé : {str(e)}")
 
     
-    def cleanup_inactive_sessions(self):
-        """Nettoie les sessions inactives"""
-        for session_id, history in list(self.conversation_store.items()):
-            if not history.is_active():
-                del self.conversation_store[session_id]
+    async def stop(self) -> None:
+        """Attend les tâches d'arrière-plan (écritures d'historique, résumés glissants) avant l'arrêt"""
+        await self.background.drain()
+        await self.prompt_builder.stop()
+
+    def cleanup_inactive_sessions(self) -> int:
+        """Nettoie les sessions inactives (également fait périodiquement en arrière-plan)"""
+        return self.conversation_store.sweep()
 
     # Ajout de la méthode pour l'appel aux outils de l'assistant
-    async def process_with_tools(self, query: str) -> str:
-            return await self.tools.process_request(query)
+    async def process_with_tools(self, query: str, tool: Optional[str] = None) -> str:
+        return await self.tools.process_request(query, tool=tool)
     
 
-    async def get_all_conversation_ids(self) -> List[str]:
-        collection = self.mongo_service.get_collection("conversations")
-        cursor = collection.find({}, {"session_id": 1})
-        sessions = await cursor.to_list(length=None)  
-        return [doc["session_id"] for doc in sessions]
+    async def list_sessions(self, limit: int = 50, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Liste paginée des sessions avec nombre de messages et dernière activité"""
+        return await self.mongo_service.list_sessions(limit=limit, after=after)
     
     async def create_new_session(self) -> str:
-        collection = self.mongo_service.get_collection("conversations")
-        
-        cursor = collection.find({"session_id": {"$regex": "^session_\\d+$"}}, {"session_id": 1})
-        sessions = await cursor.to_list(length=None)
-        
-        session_numbers = []
-        for doc in sessions:
-            match = re.match(r"session_(\d+)", doc["session_id"])
-            if match:
-                session_numbers.append(int(match.group(1)))
-        
-        if session_numbers:
-            new_number = max(session_numbers) + 1
-        else:
-            new_number = 1
-        
-        session_id = f"session_{new_number}"
-        new_session = {
-            "session_id": session_id,
-            # "created_at": datetime.utcnow(),
-            # "last_activity": datetime.utcnow(),
-            # "message_count": 0,
-            # "tags": [],
-            # "summary": "",
-        }
-        await collection.insert_one(new_session)
-        return session_id
\ No newline at end of file
+        """Crée une nouvelle session (identifiant alloué atomiquement par MongoDB)"""
+        return await self.mongo_service.create_session()
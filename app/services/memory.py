@@ -4,19 +4,22 @@ Gestion de la mémoire des conversations
 """
 from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.messages import BaseMessage
-from typing import List
+from typing import List, Optional
 
 class InMemoryHistory(BaseChatMessageHistory):
     """
     Implémentation simple du stockage en mémoire de l'historique des conversations.
     Pour un environnement de production, considérer une solution persistante comme Redis.
     """
-    def __init__(self):
+    def __init__(self, max_messages: Optional[int] = None):
         self.messages: List[BaseMessage] = []
+        self.max_messages = max_messages
     
     def add_messages(self, messages: List[BaseMessage]) -> None:
-        """Ajoute une série de messages à l'historique"""
+        """Ajoute une série de messages à l'historique (en gardant les plus récents si limité)"""
         self.messages.extend(messages)
+        if self.max_messages is not None and len(self.messages) > self.max_messages:
+            self.messages = self.messages[-self.max_messages:]
     
     def clear(self) -> None:
         """Réinitialise l'historique de la conversation"""
@@ -0,0 +1,208 @@
+# services/metrics.py
+"""
+Métriques et traces de l'application.
+Registre minimal (compteurs, histogrammes, jauges calculées à la lecture) exporté au
+format texte Prometheus par /metrics, sans dépendance supplémentaire. Si OpenTelemetry
+est installé et activé, chaque étape chronométrée produit aussi un span.
+"""
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+from core.config import settings
+
+try:
+    from opentelemetry import trace
+except ImportError:  # Traces désactivées si OpenTelemetry n'est pas installé
+    trace = None
+
+# Bornes (secondes) des histogrammes de durée : de la milliseconde à la minute
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Par jeu de labels : effectifs par borne (non cumulés), somme et nombre d'observations
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0.0] * (len(self.buckets) + 3)
+            state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in values:
+            cumulative = 0.0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self, namespace: str = "chatbot"):
+        self.namespace = namespace
+        self._metrics: List[Any] = []
+        self._collectors: Dict[str, Tuple[str, Callable[[], Dict[str, Any]]]] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(f"{self.namespace}_{name}", documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(f"{self.namespace}_{name}", documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_stats(self, prefix: str, documentation: str, stats: Callable[[], Dict[str, Any]]) -> None:
+        """
+        Expose les statistiques existantes d'un composant (méthode stats()) comme jauges,
+        lues uniquement lors d'une collecte : rien n'est ajouté au chemin des requêtes.
+        """
+        self._collectors[f"{self.namespace}_{prefix}"] = (documentation, stats)
+
+    def render(self) -> str:
+        """Toutes les métriques au format texte Prometheus"""
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, (documentation, stats) in list(self._collectors.items()):
+            try:
+                values = stats()
+            except Exception as e:
+                logging.error(f"Metrics collector {prefix} failed: {str(e)}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                lines.extend([f"# HELP {name} {documentation} ({key})", f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+STAGE_SECONDS = metrics.histogram(
+    "stage_duration_seconds", "Durée des étapes de traitement", ("component", "stage")
+)
+STAGE_ERRORS = metrics.counter(
+    "stage_errors_total", "Étapes terminées par une erreur", ("component", "stage")
+)
+LLM_TOKENS = metrics.counter(
+    "llm_tokens_total", "Tokens consommés par les appels au LLM", ("usage", "kind")
+)
+PROMPT_TOKENS = metrics.histogram(
+    "prompt_tokens", "Taille des prompts de chat par partie (tokens)", ("part",),
+    buckets=(50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+)
+LLM_QUEUE_WAIT_SECONDS = metrics.histogram(
+    "llm_queue_wait_seconds", "Attente en file avant un appel au LLM", ("usage",)
+)
+LLM_CALLS = metrics.counter(
+    "llm_calls_total", "Appels au LLM par usage et issue (upstream, coalesced, timeout, error)", ("usage", "outcome")
+)
+BACKGROUND_FAILURES = metrics.counter(
+    "background_task_failures_total", "Tâches de fond (persistance après réponse) en échec", ("task",)
+)
+
+_tracer = trace.get_tracer("chatbot") if trace is not None and settings.otel_enabled else None
+
+
+@contextmanager
+def span(component: str, stage: str, **attributes: Any) -> Iterator[None]:
+    """Chronomètre une étape (histogramme Prometheus et, si activé, span OpenTelemetry)"""
+    otel_span = _tracer.start_as_current_span(f"{component}.{stage}", attributes=attributes) if _tracer else nullcontext()
+    started = time.perf_counter()
+    try:
+        with otel_span:
+            yield
+    except Exception:
+        STAGE_ERRORS.inc(component=component, stage=stage)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, component=component, stage=stage)
+
+
+def traced(component: str, stage: Optional[str] = None):
+    """Décorateur de méthode asynchrone : span(component, stage ou nom de la méthode)"""
+    def decorator(func):
+        name = stage or func.__name__.lstrip("_")
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(component, name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_usage(usage: str, message: Any) -> None:
+    """Comptabilise les tokens d'une réponse du LLM (usage_metadata de LangChain), s'ils sont fournis"""
+    usage_metadata = getattr(message, "usage_metadata", None)
+    if not usage_metadata:
+        return
+    LLM_TOKENS.inc(usage_metadata.get("input_tokens", 0), usage=usage, kind="input")
+    LLM_TOKENS.inc(usage_metadata.get("output_tokens", 0), usage=usage, kind="output")
@@ -0,0 +1,161 @@
+# services/mongo_history.py
+"""
+Historique de conversation adossé à MongoDB, chargé et mis à jour par LLMService.
+Seuls les N derniers messages sont chargés (derniers buckets de messages, lus avec l'état de
+la session en une seule agrégation) et conservés dans un petit cache local mis à jour à chaque
+écriture (write-through), avec le résumé glissant des messages plus anciens stocké sur le
+document de session.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Sequence
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from services.mongo_service import MongoService
+
+_ROLE_BY_TYPE = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+def message_to_dict(message: BaseMessage) -> Dict[str, str]:
+    """Convertit un message LangChain au format stocké dans MongoDB"""
+    return {"role": _ROLE_BY_TYPE.get(message.type, message.type), "content": message.content}
+
+
+def dict_to_message(doc: Dict) -> BaseMessage:
+    """Convertit un message stocké dans MongoDB en message LangChain"""
+    role = doc.get("role")
+    if role == "user":
+        return HumanMessage(content=doc["content"])
+    if role == "assistant":
+        return AIMessage(content=doc["content"])
+    return SystemMessage(content=doc["content"])
+
+
+class MongoChatMessageHistory(BaseChatMessageHistory):
+    def __init__(self,
+                 session_id: str,
+                 mongo_service: MongoService,
+                 max_messages: int = 50,
+                 refresh_interval: float = 30):
+        """
+        Args:
+            session_id: Identifiant de la conversation
+            mongo_service: Service d'accès à MongoDB
+            max_messages: Nombre de messages récents chargés et gardés en cache
+            refresh_interval: Durée (secondes) après laquelle le cache est rechargé depuis MongoDB,
+                pour prendre en compte les écritures faites par d'autres workers
+        """
+        self.session_id = session_id
+        self.mongo_service = mongo_service
+        self.max_messages = max_messages
+        self.refresh_interval = refresh_interval
+        self._messages: List[BaseMessage] = []
+        self._loaded_at: Optional[float] = None
+        # Nombre total de messages de la conversation et résumé de ses `summary_upto` premiers messages
+        self.message_count = 0
+        self.summary = ""
+        self.summary_upto = 0
+        # Écritures lancées par l'API synchrone (add_messages), enchaînées dans l'ordre
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._pending_write: Optional[asyncio.Future] = None
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        """Messages actuellement en cache (utiliser aget_messages pour charger depuis MongoDB)"""
+        return list(self._messages)
+
+    def _is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_interval
+
+    def _trim(self) -> None:
+        if len(self._messages) > self.max_messages:
+            self._messages = self._messages[-self.max_messages:]
+
+    async def aget_messages(self) -> List[BaseMessage]:
+        """Charge les derniers messages depuis MongoDB (une seule lecture) si le cache n'est pas à jour"""
+        self._loop = asyncio.get_running_loop()
+        if not self._is_fresh():
+            docs, state = await self.mongo_service.get_recent_history(self.session_id, self.max_messages)
+            self._messages = [dict_to_message(doc) for doc in docs]
+            self.message_count = max(state.get("message_count", 0), len(self._messages))
+            self.summary = state.get("summary", "")
+            self.summary_upto = state.get("summary_upto", 0)
+            self._loaded_at = time.monotonic()
+        return list(self._messages)
+
+    async def aadd_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """Persiste les messages en une seule écriture puis met à jour le cache"""
+        await self.persist(messages)
+        self.append_local(messages)
+
+    async def persist(self, messages: Sequence[BaseMessage]) -> None:
+        """Écrit les messages dans MongoDB sans toucher au cache local"""
+        await self.mongo_service.save_messages(
+            self.session_id, [message_to_dict(message) for message in messages]
+        )
+
+    def append_local(self, messages: Sequence[BaseMessage]) -> None:
+        """Ajoute les messages au cache local (la persistance peut être différée via persist)"""
+        self._messages.extend(messages)
+        self.message_count += len(messages)
+        self._trim()
+
+    def invalidate(self) -> None:
+        """Force un rechargement depuis MongoDB à la prochaine lecture"""
+        self._loaded_at = None
+
+    def set_summary(self, summary: str, summary_upto: int) -> None:
+        """Met à jour le résumé en cache s'il couvre plus de messages que l'actuel"""
+        if summary_upto >= self.summary_upto:
+            self.summary = summary
+            self.summary_upto = summary_upto
+
+    def add_messages(self, messages: Sequence[BaseMessage]) -> None:
+        """
+        Variante synchrone : le cache local est mis à jour immédiatement et l'écriture
+        MongoDB est planifiée sur la boucle d'événements (dans l'ordre des appels).
+        Depuis un autre thread, l'appel attend la fin de l'écriture.
+        """
+        messages = list(messages)
+        self.append_local(messages)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is not None:
+            self._loop = running
+            self._pending_write = running.create_task(self._persist_after(self._pending_write, messages))
+            self._pending_write.add_done_callback(self._on_write_done)
+        elif self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._persist_after(None, messages), self._loop).result()
+        else:
+            # Aucune boucle active (script) : écriture immédiate
+            asyncio.run(self.persist(messages))
+
+    async def _persist_after(self, previous: Optional[asyncio.Future], messages: Sequence[BaseMessage]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        await self.persist(messages)
+
+    def _on_write_done(self, task: asyncio.Future) -> None:
+        if task is self._pending_write:
+            self._pending_write = None
+        if not task.cancelled() and task.exception() is not None:
+            logging.error(f"Saving messages of session {self.session_id} failed: {str(task.exception())}")
+            # Le cache local contient des messages non écrits : rechargement à la prochaine lecture
+            self.invalidate()
+
+    async def aclear(self) -> None:
+        """Supprime la conversation dans MongoDB et vide le cache"""
+        await self.mongo_service.delete_conversation(self.session_id)
+        self.clear()
+
+    def clear(self) -> None:
+        """Vide le cache local (la conversation stockée n'est pas modifiée)"""
+        self._messages = []
+        self._loaded_at = None
+        self.message_count = 0
+        self.summary = ""
+        self.summary_upto = 0
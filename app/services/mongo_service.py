@@ -1,55 +1,431 @@
+import asyncio
+import base64
+import json
+import logging
+import re
+import uuid
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Union
 from models.conversation import Conversation, Message
 from core.config import settings
+from services.write_behind import MongoWriteBehindQueue
+from services.metrics import traced
+
+SESSION_COUNTER_ID = "session_id"
+SESSION_ID_PATTERN = r"^session_(\d+)$"
 
 class MongoService:
     def __init__(self):
         self.client = AsyncIOMotorClient(settings.mongodb_uri)
         self.db = self.client[settings.database_name]
+        # Un document par session (métadonnées) et des "buckets" de messages de taille fixe
         self.conversations = self.db[settings.collection_name]
+        self.buckets = self.db[settings.bucket_collection_name]
+        self.counters = self.db[settings.counter_collection_name]
+        self.bucket_size = settings.bucket_size
+
+        # Écriture différée optionnelle des messages (regroupés par bulk_write)
+        self.write_behind: Optional[MongoWriteBehindQueue] = None
+        if settings.mongo_write_behind:
+            self.write_behind = MongoWriteBehindQueue(
+                self._append_batch,
+                batch_size=settings.mongo_write_behind_batch_size,
+                flush_interval=settings.mongo_write_behind_flush_interval,
+                max_retries=settings.mongo_write_behind_max_retries,
+                retry_backoff=settings.mongo_write_behind_retry_backoff,
+                dead_letter_max=settings.mongo_write_behind_dead_letter_max
+            )
+
+    async def ensure_indexes(self) -> None:
+        """Crée les index nécessaires (appelé au démarrage de l'application)"""
+        await self.buckets.create_index(
+            [("session_id", ASCENDING), ("bucket_no", ASCENDING)], unique=True
+        )
+        try:
+            await self.conversations.create_index("session_id", unique=True)
+        except OperationFailure as e:
+            # Des doublons existants empêchent la création de l'index unique
+            logging.error(f"Unable to create unique index on session_id: {str(e)}")
+        await self.conversations.create_index(
+            [("updated_at", DESCENDING), ("session_id", DESCENDING)]
+        )
+        await self._seed_session_counter()
+
+    async def _seed_session_counter(self) -> None:
+        """
+        Initialise le compteur de sessions à partir des identifiants `session_<n>` existants.
+        Le parcours n'a lieu qu'une seule fois, lorsque le compteur n'existe pas encore.
+        """
+        if await self.counters.find_one({"_id": SESSION_COUNTER_ID}) is not None:
+            return
+        highest = 0
+        cursor = self.conversations.find({"session_id": {"$regex": SESSION_ID_PATTERN}}, {"session_id": 1})
+        async for doc in cursor:
+            match = re.match(SESSION_ID_PATTERN, doc["session_id"])
+            if match:
+                highest = max(highest, int(match.group(1)))
+        # $max rend l'initialisation sûre si plusieurs workers démarrent en même temps
+        await self.counters.update_one(
+            {"_id": SESSION_COUNTER_ID}, {"$max": {"seq": highest}}, upsert=True
+        )
+
+    async def _next_sequence(self, counter_id: str) -> int:
+        """Incrémente atomiquement un compteur et renvoie sa nouvelle valeur"""
+        counter = await self.counters.find_one_and_update(
+            {"_id": counter_id},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    @traced("mongo")
+    async def create_session(self) -> str:
+        """
+        Crée une nouvelle session en temps constant.
+        Selon `session_id_mode` : "counter" (session_<n>, compteur atomique) ou "uuid".
+        """
+        if settings.session_id_mode == "uuid":
+            session_id = str(uuid.uuid4())
+        else:
+            session_id = f"session_{await self._next_sequence(SESSION_COUNTER_ID)}"
+        now = datetime.utcnow()
+        await self.conversations.insert_one({
+            "session_id": session_id,
+            "created_at": now,
+            "updated_at": now,
+            "message_count": 0
+        })
+        return session_id
         
     async def save_message(self, session_id: str, role: str, content: str) -> bool:
         """Sauvegarde un nouveau message dans une conversation"""
-        message = Message(role=role, content=content)
-        result = await self.conversations.update_one(
+        return await self.save_messages(session_id, [{"role": role, "content": content}])
+
+    async def save_messages(self, session_id: str, messages: List[Union[Message, Dict[str, str]]]) -> bool:
+        """
+        Sauvegarde plusieurs messages en un seul lot.
+        Si l'écriture différée est activée, les messages sont simplement mis en file.
+        """
+        if not messages:
+            return False
+        now = datetime.utcnow()
+        docs = [
+            (m if isinstance(m, Message) else Message(role=m["role"], content=m["content"], timestamp=now)).model_dump()
+            for m in messages
+        ]
+        if self.write_behind is not None:
+            await self.write_behind.put(session_id, docs)
+            return True
+
+        await self._append_batch({session_id: docs})
+        return True
+
+    async def _reserve_positions(self, session_id: str, count: int, now: datetime) -> int:
+        """
+        Réserve atomiquement `count` positions dans la conversation ($inc du compteur)
+        et renvoie la position du premier message réservé.
+        """
+        session = await self.conversations.find_one_and_update(
             {"session_id": session_id},
             {
-                "$push": {"messages": message.model_dump()},
-                "$set": {"updated_at": datetime.utcnow()},
-                "$setOnInsert": {"created_at": datetime.utcnow()}
+                "$inc": {"message_count": count},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now}
             },
-            upsert=True
+            projection={"message_count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return session["message_count"] - count
+
+    @traced("mongo", "save_messages")
+    async def _append_batch(self, batch: Dict[str, List[Dict]]) -> None:
+        """
+        Ajoute les messages de plusieurs sessions : réservation des positions
+        puis écriture de tous les buckets concernés en un seul bulk_write.
+
+        L'appel est idempotent (nouvelles tentatives de l'écriture différée) : les positions
+        réservées sont conservées dans les messages et ne sont pas réservées à nouveau, et un
+        bucket contenant déjà le premier message de son lot n'est pas réécrit. Si l'écriture
+        échoue sans qu'aucun bucket de la session n'ait été écrit, la réservation est annulée.
+        """
+        now = datetime.utcnow()
+        pending = [session_id for session_id, docs in batch.items() if docs and "position" not in docs[0]]
+        starts = await asyncio.gather(*[
+            self._reserve_positions(session_id, len(batch[session_id]), now)
+            for session_id in pending
+        ])
+        for session_id, start in zip(pending, starts):
+            # La position réservée est stockée : l'ordre et la pagination ne dépendent
+            # ni de l'ordre d'arrivée des écritures concurrentes, ni d'un bucket incomplet
+            for offset, doc in enumerate(batch[session_id]):
+                doc["position"] = start + offset
+
+        writes: List[Tuple[Dict, Dict]] = []
+        for session_id, session_docs in batch.items():
+            per_bucket: Dict[int, List[Dict]] = {}
+            for doc in session_docs:
+                per_bucket.setdefault(doc["position"] // self.bucket_size, []).append(doc)
+            for bucket_no, docs in per_bucket.items():
+                writes.append((
+                    {"session_id": session_id, "bucket_no": bucket_no, "messages.position": {"$ne": docs[0]["position"]}},
+                    {
+                        "$push": {"messages": {"$each": docs, "$sort": {"position": ASCENDING}}},
+                        "$inc": {"count": len(docs)},
+                        "$set": {"updated_at": now},
+                        "$setOnInsert": {"created_at": now}
+                    }
+                ))
+        if not writes:
+            return
+        try:
+            await self._write_buckets(writes)
+        except Exception:
+            await self._release_positions(batch, dict(zip(pending, starts)))
+            raise
+
+    async def _write_buckets(self, writes: List[Tuple[Dict, Dict]]) -> None:
+        try:
+            await self.buckets.bulk_write(
+                [UpdateOne(query, update, upsert=True) for query, update in writes], ordered=False
+            )
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if e.details.get("writeConcernErrors") or any(error.get("code") != 11000 for error in write_errors):
+                raise
+            # Clé dupliquée : le bucket existe, soit créé au même instant par un autre lot (l'upsert
+            # filtré sur la position n'est pas rejoué par le serveur), soit contenant déjà ce lot
+            await asyncio.gather(*[self._push_to_existing_bucket(*writes[error["index"]]) for error in write_errors])
+
+    async def _push_to_existing_bucket(self, query: Dict, update: Dict) -> None:
+        result = await self.buckets.update_one(query, update)
+        if result.matched_count:
+            return
+        stored = await self.buckets.find_one(
+            {"session_id": query["session_id"], "bucket_no": query["bucket_no"],
+             "messages.position": query["messages.position"]["$ne"]},
+            {"_id": 1}
         )
-        return result.modified_count > 0 or result.upserted_id is not None
+        if stored is None:
+            raise RuntimeError(
+                f"Bucket {query['bucket_no']} of session {query['session_id']} missing, messages not written"
+            )
 
+    async def _release_positions(self, batch: Dict[str, List[Dict]], reserved: Dict[str, int]) -> None:
+        """
+        Annule les réservations d'un lot en échec, pour les sessions dont aucun bucket n'a été écrit
+        et qu'aucune réservation n'a suivi : `message_count` ne compte pas de messages absents.
+        Sinon les positions sont conservées et une nouvelle tentative complète les buckets manquants.
+        """
+        for session_id, start in reserved.items():
+            docs = batch[session_id]
+            first_positions = sorted({
+                doc["position"] for doc in docs
+                if doc["position"] == docs[0]["position"] or doc["position"] % self.bucket_size == 0
+            })
+            try:
+                written = await self.buckets.find_one(
+                    {"session_id": session_id, "messages.position": {"$in": first_positions}}, {"_id": 1}
+                )
+                if written is not None:
+                    continue
+                result = await self.conversations.update_one(
+                    {"session_id": session_id, "message_count": start + len(docs)},
+                    {"$inc": {"message_count": -len(docs)}}
+                )
+            except Exception as e:
+                logging.warning(f"Unable to release reserved positions for session {session_id}: {str(e)}")
+                continue
+            if result.modified_count:
+                # Nouvelle réservation lors d'une éventuelle nouvelle tentative
+                for doc in docs:
+                    doc.pop("position", None)
 
+    async def _read_buckets(self, query: Dict, sort_direction: int = ASCENDING, limit: int = 0) -> List[Dict]:
+        cursor = self.buckets.find(query, {"_id": 0, "bucket_no": 1, "messages": 1}).sort("bucket_no", sort_direction)
+        if limit:
+            cursor = cursor.limit(limit)
+        buckets = await cursor.to_list(length=None)
+        if sort_direction == DESCENDING:
+            buckets.reverse()
+        return buckets
+
+    def _ordered_messages(self, buckets: List[Dict]) -> List[Tuple[int, Dict]]:
+        """
+        Messages des buckets triés par position. Les messages écrits avant le stockage
+        de la position reçoivent celle déduite de leur bucket et de leur rang.
+        """
+        positioned = []
+        for bucket in buckets:
+            first = bucket["bucket_no"] * self.bucket_size
+            for index, message in enumerate(bucket.get("messages", [])):
+                message = dict(message)
+                position = message.pop("position", None)
+                positioned.append((first + index if position is None else position, message))
+        positioned.sort(key=lambda item: item[0])
+        return positioned
+
+    @traced("mongo", "history_fetch")
+    async def get_recent_messages(self, session_id: str, limit: int) -> List[Dict]:
+        """Récupère uniquement les `limit` derniers messages d'une conversation (derniers buckets)"""
+        if limit <= 0:
+            return []
+        bucket_limit = -(-limit // self.bucket_size) + 1
+        buckets = await self._read_buckets({"session_id": session_id}, DESCENDING, bucket_limit)
+        return [message for _, message in self._ordered_messages(buckets)[-limit:]]
+
+    @traced("mongo", "history_fetch")
+    async def get_recent_history(self, session_id: str, limit: int) -> Tuple[List[Dict], Dict]:
+        """
+        Récupère en une seule requête les `limit` derniers messages et l'état de la session
+        (nombre de messages et résumé glissant) : agrégation sur le document de session avec
+        un $lookup des derniers buckets.
+        """
+        bucket_limit = -(-max(limit, 0) // self.bucket_size) + 1
+        cursor = self.conversations.aggregate([
+            {"$match": {"session_id": session_id}},
+            {"$limit": 1},
+            {"$lookup": {
+                "from": self.buckets.name,
+                "let": {"session_id": "$session_id"},
+                "pipeline": [
+                    {"$match": {"$expr": {"$eq": ["$session_id", "$$session_id"]}}},
+                    {"$sort": {"bucket_no": DESCENDING}},
+                    {"$limit": bucket_limit},
+                    {"$project": {"_id": 0, "bucket_no": 1, "messages": 1}}
+                ],
+                "as": "buckets"
+            }},
+            {"$project": {"_id": 0, "message_count": 1, "summary": 1, "summary_upto": 1, "buckets": 1}}
+        ])
+        sessions = await cursor.to_list(length=1)
+        if not sessions:
+            return [], {}
+        state = sessions[0]
+        buckets = sorted(state.pop("buckets", []), key=lambda bucket: bucket["bucket_no"])
+        if limit <= 0:
+            return [], state
+        return [message for _, message in self._ordered_messages(buckets)[-limit:]], state
+
+    @traced("mongo")
+    async def get_messages_page(self, session_id: str, skip: int = 0, limit: int = 50) -> List[Dict]:
+        """
+        Récupère une page de messages (positions [skip, skip + limit[) sans charger toute la
+        conversation. La page est filtrée sur la position stockée de chaque message : une
+        écriture de bucket échouée laisse un trou sans décaler les pages suivantes.
+        """
+        if limit <= 0:
+            return []
+        buckets = await self._read_buckets({
+            "session_id": session_id,
+            "bucket_no": {"$gte": skip // self.bucket_size, "$lte": (skip + limit - 1) // self.bucket_size}
+        })
+        return [
+            message for position, message in self._ordered_messages(buckets)
+            if skip <= position < skip + limit
+        ]
+
+    @traced("mongo")
     async def get_conversation_history(self, session_id: str) -> List[Dict]:
-        """Récupère l'historique d'une conversation"""
-        conversation = await self.conversations.find_one({"session_id": session_id})
-        if conversation:
-            return conversation.get("messages", [])
-        return []
+        """Récupère l'historique complet d'une conversation"""
+        buckets = await self._read_buckets({"session_id": session_id})
+        return [message for _, message in self._ordered_messages(buckets)]
     
     async def delete_conversation(self, session_id: str) -> bool:
-        """Supprime une conversation"""
+        """Supprime une conversation et ses buckets de messages"""
+        await self.buckets.delete_many({"session_id": session_id})
         result = await self.conversations.delete_one({"session_id": session_id})
         return result.deleted_count > 0
     
+    @traced("mongo")
+    async def get_session_state(self, session_id: str) -> Dict:
+        """Champs dénormalisés d'une session : nombre de messages et résumé glissant"""
+        session = await self.conversations.find_one(
+            {"session_id": session_id},
+            {"_id": 0, "message_count": 1, "summary": 1, "summary_upto": 1}
+        )
+        return session or {}
+
+    async def save_session_summary(self, session_id: str, summary: str, summary_upto: int) -> bool:
+        """
+        Enregistre le résumé des `summary_upto` premiers messages de la conversation.
+        Le résumé ne peut qu'avancer : une mise à jour plus ancienne (autre worker) est ignorée.
+        """
+        result = await self.conversations.update_one(
+            {
+                "session_id": session_id,
+                "$or": [{"summary_upto": {"$lt": summary_upto}}, {"summary_upto": {"$exists": False}}]
+            },
+            {"$set": {"summary": summary, "summary_upto": summary_upto}}
+        )
+        return result.modified_count > 0
+
     # async def get_all_sessions(self) -> List[str]:
     #     """Récupère tous les IDs de session"""
     #     cursor = self.conversations.find({}, {"session_id": 1})
     #     sessions = await cursor.to_list(length=None)
     #     return [session["session_id"] for session in sessions]
 
-    async def get_all_sessions(self) -> List[str]:
-        cursor = self.conversations.find({}, {"session_id": 1})
-        sessions = []
-        async for session in cursor:
-            sessions.append(session["session_id"])
-        return sessions
+    @staticmethod
+    def _encode_session_cursor(session: Dict) -> str:
+        payload = {"u": session["updated_at"].isoformat(), "s": session["session_id"]}
+        return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+    @staticmethod
+    def _decode_session_cursor(cursor: str) -> Dict:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            return {"updated_at": datetime.fromisoformat(payload["u"]), "session_id": payload["s"]}
+        except Exception:
+            raise ValueError("Curseur de pagination invalide")
+
+    @traced("mongo")
+    async def list_sessions(self, limit: int = 50, after: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Liste paginée des sessions, de la plus récemment active à la plus ancienne.
+        S'appuie sur l'index (updated_at, session_id) et ne lit que les champs dénormalisés
+        (nombre de messages, dernière activité).
+
+        Returns:
+            La page de sessions et le curseur de la page suivante (None s'il n'y en a pas)
+        """
+        query: Dict = {"updated_at": {"$exists": True}}
+        if after:
+            position = self._decode_session_cursor(after)
+            query["$or"] = [
+                {"updated_at": {"$lt": position["updated_at"]}},
+                {"updated_at": position["updated_at"], "session_id": {"$lt": position["session_id"]}}
+            ]
+        cursor = self.conversations.find(
+            query,
+            {"_id": 0, "session_id": 1, "message_count": 1, "updated_at": 1}
+        ).sort([("updated_at", DESCENDING), ("session_id", DESCENDING)]).limit(limit + 1)
+        sessions = await cursor.to_list(length=limit + 1)
+
+        next_cursor = None
+        if len(sessions) > limit:
+            sessions = sessions[:limit]
+            next_cursor = self._encode_session_cursor(sessions[-1])
+        return sessions, next_cursor
 
     
     def get_collection(self, collection_name: str):
-        return self.db[collection_name]
\ No newline at end of file
+        return self.db[collection_name]
+
+    def start(self) -> None:
+        """Démarre les tâches d'arrière-plan (écriture différée)"""
+        if self.write_behind is not None:
+            self.write_behind.start()
+
+    async def stop(self) -> None:
+        """Vide la file d'écriture différée avant l'arrêt"""
+        if self.write_behind is not None:
+            await self.write_behind.stop()
+
+    def close(self) -> None:
+        """Ferme la connexion au serveur MongoDB"""
+        self.client.close()
@@ -0,0 +1,51 @@
+# services/pdf_extraction.py
+"""
+Extraction du texte des PDF en parallèle.
+Chaque PDF est découpé en plages de pages traitées dans un pool de processus,
+puis les morceaux de texte sont assemblés dans l'ordre.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import fitz
+
+
+def extract_page_range(pdf_path: str, start: int, end: int) -> str:
+    """Extrait le texte des pages [start, end[ d'un PDF (exécuté dans un processus du pool)"""
+    with fitz.open(pdf_path) as pdf_document:
+        return "".join(pdf_document.load_page(page_num).get_text() for page_num in range(start, end))
+
+
+def count_pages(pdf_path: str) -> int:
+    with fitz.open(pdf_path) as pdf_document:
+        return len(pdf_document)
+
+
+class PdfExtractor:
+    def __init__(self, max_workers: int = 2, pages_per_task: int = 8):
+        """
+        Args:
+            max_workers: Nombre de processus du pool d'extraction
+            pages_per_task: Nombre de pages traitées par tâche
+        """
+        self.pages_per_task = pages_per_task
+        self._executor = ProcessPoolExecutor(max_workers=max_workers)
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        return [
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+
+    async def extract(self, pdf_path: str) -> str:
+        """Extrait le texte d'un PDF, une plage de pages par tâche"""
+        loop = asyncio.get_running_loop()
+        page_count = await loop.run_in_executor(self._executor, count_pages, pdf_path)
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(self._executor, extract_page_range, pdf_path, start, end)
+            for start, end in self._page_ranges(page_count)
+        ])
+        return "".join(parts)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,122 @@
+# services/pipeline.py
+"""
+Exécution d'un tour de conversation en étapes explicites.
+Les étapes forment un graphe de dépendances : chacune démarre dès que celles dont elle
+dépend sont terminées, les étapes indépendantes s'exécutent donc en parallèle. Les
+écritures qui ne conditionnent pas la réponse sont confiées à des tâches de fond.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from services.metrics import BACKGROUND_FAILURES, span
+
+
+class Stage(NamedTuple):
+    name: str
+    run: Callable[[Dict[str, Any]], Awaitable[Any]]  # reçoit les résultats des étapes précédentes
+    after: Tuple[str, ...] = ()
+
+
+class StagePipeline:
+    def __init__(self, component: str, stages: List[Stage]):
+        """
+        Args:
+            component: Nom du composant pour les métriques de durée
+            stages: Étapes, chacune déclarée après celles dont elle dépend
+        """
+        declared: Set[str] = set()
+        for stage in stages:
+            missing = [name for name in stage.after if name not in declared]
+            if missing:
+                raise ValueError(f"L'étape {stage.name} dépend d'étapes non déclarées avant elle : {missing}")
+            declared.add(stage.name)
+        self.component = component
+        self.stages = stages
+
+    async def run(self) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """
+        Exécute le graphe d'étapes
+
+        Returns:
+            Les résultats et les durées (secondes) de chaque étape
+        """
+        results: Dict[str, Any] = {}
+        timings: Dict[str, float] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def execute(stage: Stage) -> None:
+            if stage.after:
+                await asyncio.gather(*[tasks[name] for name in stage.after])
+            started = time.perf_counter()
+            with span(self.component, stage.name):
+                results[stage.name] = await stage.run(results)
+            timings[stage.name] = time.perf_counter() - started
+
+        for stage in self.stages:
+            tasks[stage.name] = asyncio.ensure_future(execute(stage))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return results, timings
+
+
+class BackgroundTasks:
+    """
+    Tâches de fond lancées après la réponse (persistance...). Les tâches d'une même clé
+    (ex. une session) s'exécutent dans l'ordre de soumission ; les échecs sont journalisés,
+    comptés et signalés via un callback.
+    """
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+        self._last_by_key: Dict[str, asyncio.Task] = {}
+        self.completed = 0
+        self.failures = 0
+
+    def submit(self, name: str, work: Callable[[], Awaitable[Any]], key: Optional[str] = None,
+               on_error: Optional[Callable[[Exception], None]] = None) -> asyncio.Task:
+        """
+        Args:
+            name: Type de tâche (journaux et métriques)
+            work: Fonction lançant le travail
+            key: Clé d'ordonnancement (les tâches de même clé ne se chevauchent pas)
+            on_error: Appelé avec l'exception si la tâche échoue
+        """
+        previous = self._last_by_key.get(key) if key is not None else None
+
+        async def run() -> None:
+            if previous is not None:
+                await asyncio.wait([previous])
+            try:
+                await work()
+                self.completed += 1
+            except Exception as e:
+                self.failures += 1
+                BACKGROUND_FAILURES.inc(task=name)
+                logging.error(f"Background task {name} failed{f' ({key})' if key else ''}: {str(e)}")
+                if on_error is not None:
+                    on_error(e)
+
+        task = asyncio.create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        if key is not None:
+            self._last_by_key[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._last_by_key.get(key) is task:
+            del self._last_by_key[key]
+
+    async def drain(self) -> None:
+        """Attend la fin de toutes les tâches en cours (arrêt de l'application)"""
+        while self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"pending": len(self._tasks), "completed": self.completed, "failures": self.failures}
@@ -0,0 +1,156 @@
+# services/prompt_builder.py
+"""
+Assemblage du prompt sous budget de tokens.
+L'historique est réduit à une fenêtre glissante des messages récents ; les messages
+sortis de la fenêtre sont résumés en arrière-plan dans un résumé glissant stocké sur
+le document de session. Les chunks RAG sont ajoutés par pertinence jusqu'au budget.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from langchain_core.runnables import Runnable
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+from services.mongo_history import MongoChatMessageHistory
+from services.mongo_service import MongoService
+from services.metrics import PROMPT_TOKENS
+from services.token_counter import MESSAGE_OVERHEAD_TOKENS, TokenCounter
+
+# Nombre maximal de messages résumés par appel au LLM
+SUMMARY_BATCH_MESSAGES = 100
+
+
+class PromptBuilder:
+    def __init__(self,
+                 llm: Runnable,
+                 mongo_service: MongoService,
+                 counter: TokenCounter,
+                 system_prompt: str = "",
+                 history_budget: int = 1500,
+                 context_budget: int = 1500,
+                 summary_min_messages: int = 6,
+                 summary_max_words: int = 150):
+        """
+        Args:
+            llm: Modèle utilisé pour mettre à jour les résumés glissants
+            mongo_service: Service MongoDB (lecture des anciens messages, stockage du résumé)
+            counter: Compteur de tokens
+            system_prompt: Prompt système fixe (compté dans le détail des tokens)
+            history_budget: Budget de tokens de l'historique (résumé compris)
+            context_budget: Budget de tokens du contexte RAG
+            summary_min_messages: Nombre de messages sortis de la fenêtre avant de mettre à jour le résumé
+            summary_max_words: Longueur maximale (en mots) du résumé glissant
+        """
+        self.llm = llm
+        self.mongo_service = mongo_service
+        self.counter = counter
+        self.system_tokens = counter.count(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        self.history_budget = history_budget
+        self.context_budget = context_budget
+        self.summary_min_messages = summary_min_messages
+        self.summary_max_words = summary_max_words
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+
+    def pack_context(self, docs: List[Document]) -> Tuple[str, int]:
+        """
+        Concatène les chunks (triés par pertinence) tant que le budget n'est pas atteint
+
+        Returns:
+            Le contexte et son nombre de tokens
+        """
+        parts, used = [], 0
+        for doc in docs:
+            part = f"- {doc.page_content}"
+            tokens = self.counter.count(part)
+            if used + tokens > self.context_budget:
+                break
+            parts.append(part)
+            used += tokens
+        if len(parts) < len(docs):
+            logging.info(f"RAG context packed: {len(parts)}/{len(docs)} chunk(s), {used} tokens")
+        return "\n\n".join(parts), used
+
+    def _window(self, messages: List[BaseMessage], budget: int) -> List[BaseMessage]:
+        """Messages les plus récents tenant dans le budget (jamais coupés)"""
+        used, start = 0, len(messages)
+        while start > 0:
+            tokens = self.counter.count_message(messages[start - 1])
+            if used + tokens > budget:
+                break
+            used += tokens
+            start -= 1
+        return messages[start:]
+
+    async def fit(self, inputs: Dict, history, session_id: str) -> Dict:
+        """
+        Remplace l'historique des entrées de la chaîne par le résumé glissant et la fenêtre
+        de messages récents tenant dans le budget, puis journalise le détail des tokens.
+        """
+        messages: List[BaseMessage] = inputs.get("history", [])
+        summary = getattr(history, "summary", "")
+        summary_message = [SystemMessage(content=f"Résumé de la conversation précédente : {summary}")] if summary else []
+        summary_tokens = self.counter.count_messages(summary_message)
+
+        candidates = messages
+        if isinstance(history, MongoChatMessageHistory):
+            # Les messages déjà couverts par le résumé ne sont pas répétés
+            first_position = history.message_count - len(messages)
+            candidates = messages[max(0, history.summary_upto - first_position):]
+        window = self._window(candidates, max(0, self.history_budget - summary_tokens))
+        history_tokens = self.counter.count_messages(window)
+
+        if isinstance(history, MongoChatMessageHistory):
+            window_start = history.message_count - len(window)
+            if window_start - history.summary_upto >= self.summary_min_messages:
+                self._schedule_summary(history, window_start)
+
+        context_tokens = self.counter.count(f"Contexte : {inputs.get('context', '')}") + MESSAGE_OVERHEAD_TOKENS
+        question_tokens = self.counter.count(inputs.get("question", "")) + MESSAGE_OVERHEAD_TOKENS
+        total = self.system_tokens + context_tokens + summary_tokens + history_tokens + question_tokens
+        for part, tokens in (("system", self.system_tokens), ("context", context_tokens), ("summary", summary_tokens),
+                             ("history", history_tokens), ("question", question_tokens), ("total", total)):
+            PROMPT_TOKENS.observe(tokens, part=part)
+        logging.info(
+            f"Prompt tokens for session {session_id}: total={total} system={self.system_tokens} "
+            f"context={context_tokens} summary={summary_tokens} history={history_tokens} "
+            f"({len(window)}/{len(messages)} messages) question={question_tokens}"
+        )
+        return {**inputs, "history": summary_message + window}
+
+    def _schedule_summary(self, history: MongoChatMessageHistory, upto: int) -> None:
+        """Lance la mise à jour du résumé en arrière-plan (une seule à la fois par session)"""
+        task = self._summary_tasks.get(history.session_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self._update_summary(history, upto))
+        self._summary_tasks[history.session_id] = task
+        task.add_done_callback(lambda _: self._summary_tasks.pop(history.session_id, None))
+
+    async def _update_summary(self, history: MongoChatMessageHistory, upto: int) -> None:
+        """Intègre au résumé les messages [summary_upto, upto[ de la conversation"""
+        try:
+            start = history.summary_upto
+            upto = min(upto, start + SUMMARY_BATCH_MESSAGES)
+            docs = await self.mongo_service.get_messages_page(history.session_id, start, upto - start)
+            if not docs:
+                return
+            transcript = "\n".join(f"{doc['role']}: {doc['content']}" for doc in docs)
+            response = await self.llm.ainvoke([
+                SystemMessage(content=(
+                    "Vous mettez à jour le résumé d'une conversation entre un utilisateur et un assistant RH. "
+                    "Conservez les faits, décisions et préférences utiles pour la suite, "
+                    f"en {self.summary_max_words} mots maximum."
+                )),
+                HumanMessage(content=f"Résumé actuel :\n{history.summary or '(aucun)'}\n\nNouveaux messages :\n{transcript}")
+            ])
+            summary_upto = start + len(docs)
+            await self.mongo_service.save_session_summary(history.session_id, response.content, summary_upto)
+            history.set_summary(response.content, summary_upto)
+            logging.info(f"Rolling summary updated for session {history.session_id}: {summary_upto} message(s) covered")
+        except Exception as e:
+            logging.error(f"Error while updating rolling summary for session {history.session_id}: {str(e)}")
+
+    async def stop(self) -> None:
+        """Attend la fin des mises à jour de résumé en cours"""
+        if self._summary_tasks:
+            await asyncio.gather(*self._summary_tasks.values(), return_exceptions=True)
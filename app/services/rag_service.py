@@ -1,156 +1,441 @@
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
 from langchain_openai import OpenAIEmbeddings
-from typing import List
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from langchain.schema import Document
+from concurrent.futures import ThreadPoolExecutor
+from core.config import settings
+from services.embedding_cache import CachedEmbeddings, EmbeddingCacheStore
+from services.pdf_extraction import PdfExtractor
+from services.embedding_pipeline import EmbeddingPipeline
+from services.vector_backends import ChromaBackend, NumpyBackend, VectorBackend
+from services.bm25_index import BM25Index, reciprocal_rank_fusion
+from services.metrics import span, traced
+import asyncio
+import functools
+import hashlib
 import os
-import shutil
 import logging
+import sqlite3
 import fitz
 
 class RAGService:
     def __init__(self, persist_dir: str = "./data/vectorstore"):
         """
         Initialise le service RAG avec un vector store persistant
-        
+
         Args:
             persist_dir: Chemin où persister le vector store
         """
         self.persist_dir = persist_dir
-        
+
         # Création du dossier de persistance s'il n'existe pas
         os.makedirs(self.persist_dir, exist_ok=True)
-        
+
         self.embeddings = OpenAIEmbeddings(
-            api_key=os.getenv("OPENAI_API_KEY")
+            api_key=os.getenv("OPENAI_API_KEY"),
+            base_url=settings.openai_base_url
+        )
+        # Cache disque des embeddings : les textes déjà vus ne sont pas ré-envoyés à OpenAI
+        self.embedding_cache: Optional[CachedEmbeddings] = None
+        if settings.embedding_cache_enabled:
+            self.embedding_cache = CachedEmbeddings(
+                self.embeddings,
+                EmbeddingCacheStore(
+                    settings.embedding_cache_path,
+                    max_bytes=settings.embedding_cache_max_mb * 1024 * 1024
+                )
+            )
+            self.embeddings = self.embedding_cache
+
+        # Embeddings de l'indexation : lots groupés, requêtes parallèles et backoff adaptatif
+        self.embedding_pipeline = EmbeddingPipeline(
+            self.embeddings,
+            max_batch_size=settings.embedding_batch_size,
+            max_batch_tokens=settings.embedding_batch_tokens,
+            max_concurrency=settings.embedding_concurrency,
+            max_retries=settings.embedding_max_retries
         )
-        
+
         self.text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
-        
-        # Chargement d'un vector store existant ou création d'un nouveau
-        if os.path.exists(os.path.join(self.persist_dir, "chroma.sqlite3")):
-            self.vector_store = Chroma(
-                persist_directory=self.persist_dir,
-                embedding_function=self.embeddings
+
+        # Les appels bloquants (vector store, extraction PDF) sont exécutés hors de la boucle
+        # d'événements, dans des pools bornés : un pool pour les recherches et un pool
+        # dédié à l'indexation, pour qu'une grosse indexation ne bloque pas les chats.
+        self._query_executor = ThreadPoolExecutor(
+            max_workers=settings.rag_query_workers, thread_name_prefix="rag-query"
+        )
+        self._index_executor = ThreadPoolExecutor(
+            max_workers=settings.rag_index_workers, thread_name_prefix="rag-index"
+        )
+        # Extraction des PDF par plages de pages dans un pool de processus
+        self.pdf_extractor = PdfExtractor(
+            max_workers=settings.pdf_extraction_workers,
+            pages_per_task=settings.pdf_pages_per_task
+        )
+        # Contre-pression : nombre maximal d'indexations en attente ou en cours
+        self._index_slots = asyncio.Semaphore(settings.rag_max_pending_index_jobs)
+        # Une seule écriture à la fois dans le vector store
+        self._write_lock = asyncio.Lock()
+        # Version du corpus, incrémentée à chaque modification (invalide les réponses en cache)
+        self.corpus_version = 0
+
+        # Backend vectoriel : Chroma (par défaut) ou matrice NumPy partagée par mmap
+        self.vector_backend = self._create_vector_backend(settings.vector_backend)
+
+        # Index lexical BM25 sur les mêmes chunks (recherche hybride), stocké sur disque
+        # (SQLite FTS5) et partagé par les workers
+        self.bm25_index: Optional[BM25Index] = None
+        if settings.bm25_enabled:
+            try:
+                self.bm25_index = BM25Index(os.path.join(self.persist_dir, "bm25.sqlite3"))
+            except sqlite3.OperationalError as e:
+                # SQLite compilé sans FTS5 : la recherche hybride se replie sur la recherche dense
+                logging.error(f"BM25 index unavailable, hybrid search disabled: {str(e)}")
+
+    def _load_bm25_index(self) -> int:
+        """Construit l'index BM25 à partir des chunks déjà stockés, s'il n'existe pas encore"""
+        if len(self.bm25_index) or self.vector_backend.is_empty():
+            return 0
+        offset, page_size = 0, 1000
+        while True:
+            chunks = self.vector_backend.list(page_size, offset)
+            self.bm25_index.add_many(
+                (chunk["id"], chunk["content"], {"source": chunk["source"]}) for chunk in chunks
             )
-        else:
-            self.vector_store = None
+            offset += len(chunks)
+            if len(chunks) < page_size:
+                return offset
+
+    async def start(self) -> None:
+        """Hook de démarrage : construction initiale de l'index BM25 hors de la boucle d'événements"""
+        if self.bm25_index is not None:
+            count = await self._run_blocking(self._index_executor, self._load_bm25_index)
+            if count:
+                logging.info(f"BM25 index built from the vector store: {count} chunk(s)")
+
+    def _create_vector_backend(self, name: str) -> VectorBackend:
+        if name == "numpy":
+            return NumpyBackend(
+                os.path.join(self.persist_dir, "numpy"),
+                ivf_min_rows=settings.vector_ivf_min_rows,
+                ivf_nprobe=settings.vector_ivf_nprobe
+            )
+        if name == "chroma":
+            return ChromaBackend(self.persist_dir, self.embeddings)
+        raise ValueError(f"Backend vectoriel inconnu : {name}")
+
+    async def _run_blocking(self, executor: ThreadPoolExecutor, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Exécute une fonction bloquante dans le pool donné sans bloquer la boucle d'événements"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
 
     def extract_text_from_pdf(self, pdf_path: str) -> str:
-        text = ""
         with fitz.open(pdf_path) as pdf_document:
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                text += page.get_text()
-        return text
+            return "".join(page.get_text() for page in pdf_document)
+
+    async def aextract_text_from_pdf(self, pdf_path: str) -> str:
+        """Version asynchrone de extract_text_from_pdf : pages extraites en parallèle dans un pool de processus"""
+        return await self.pdf_extractor.extract(pdf_path)
 
-    async def load_and_index_texts(self, texts: List[str], clear_existing: bool = False) -> None:
+    @staticmethod
+    def default_source(text: str) -> str:
+        """Identifiant de source dérivé du contenu, pour les textes sans nom de fichier"""
+        return f"text-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]}"
+
+    @staticmethod
+    def chunk_id(source: str, chunk: str) -> str:
+        """Identifiant stable d'un chunk : hash de sa source et de son contenu"""
+        return hashlib.sha256(f"{source}\x00{chunk}".encode("utf-8")).hexdigest()
+
+    def _chunk_document(self, source: str, text: str) -> Dict[str, str]:
+        """Découpe un document et renvoie ses chunks indexés par identifiant (sans doublons)"""
+        chunks: Dict[str, str] = {}
+        for split in self.text_splitter.split_text(text):
+            chunks.setdefault(self.chunk_id(source, split), split)
+        return chunks
+
+    def _diff_document(self, source: str, chunks: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Compare les chunks d'un document à ceux déjà indexés : (nouveaux, supprimés)"""
+        existing_ids = self.vector_backend.ids_for_source(source)
+        new_ids = [chunk_id for chunk_id in chunks if chunk_id not in existing_ids]
+        removed_ids = list(existing_ids - chunks.keys())
+        return new_ids, removed_ids
+
+    def _diff_documents(self, chunks_by_source: Dict[str, Dict[str, str]]
+                        ) -> Tuple[Dict[str, Tuple[str, str]], List[str], Dict[str, int]]:
+        """
+        Compare les chunks de plusieurs documents à l'index (sources distinctes, donc
+        identifiants distincts) : chunks à ajouter {id: (source, texte)}, identifiants à
+        supprimer et totaux
+        """
+        totals = {"added": 0, "unchanged": 0, "removed": 0}
+        new_chunks: Dict[str, Tuple[str, str]] = {}
+        removed_ids: List[str] = []
+        for source, chunks in chunks_by_source.items():
+            new_ids, removed = self._diff_document(source, chunks)
+            new_chunks.update((chunk_id, (source, chunks[chunk_id])) for chunk_id in new_ids)
+            removed_ids.extend(removed)
+            totals["added"] += len(new_ids)
+            totals["unchanged"] += len(chunks) - len(new_ids)
+            totals["removed"] += len(removed)
+        return new_chunks, removed_ids, totals
+
+    def _write_chunks(self, ids: List[str], texts: List[str], embeddings: List[List[float]],
+                      metadatas: List[Dict[str, str]], removed_ids: List[str]) -> None:
+        """Écrit des chunks déjà embeddés et supprime les chunks obsolètes"""
+        self.vector_backend.upsert(ids, embeddings, texts, metadatas)
+        self.vector_backend.delete(removed_ids)
+        if self.bm25_index is not None:
+            self.bm25_index.add_many(zip(ids, texts, metadatas))
+            self.bm25_index.remove(removed_ids)
+
+    @traced("rag")
+    async def index_documents(self, documents: List[Tuple[str, str]], clear_existing: bool = False) -> Dict[str, int]:
+        """
+        Indexe des documents de manière incrémentale
+
+        Args:
+            documents: Liste de couples (source, texte) ; la source identifie le document
+                (nom de fichier) et permet de mettre à jour ses chunks lors d'une ré-indexation
+            clear_existing: Si True, supprime l'index existant avant d'indexer
+
+        Returns:
+            Nombre de chunks ajoutés, inchangés et supprimés
+        """
+        # Une source présente plusieurs fois dans le lot : la dernière version l'emporte
+        texts_by_source: Dict[str, str] = {}
+        for source, text in documents:
+            if source in texts_by_source:
+                logging.warning(f"Document {source} appears more than once in the batch; the last version is indexed")
+            texts_by_source[source] = text
+
+        async with self._index_slots:
+            if clear_existing:
+                async with self._write_lock:
+                    await self._run_blocking(self._index_executor, self._clear)
+
+            chunks_by_source: Dict[str, Dict[str, str]] = {}
+            for source, text in texts_by_source.items():
+                # Découpage par document : un chunk ne chevauche jamais deux documents
+                chunks_by_source[source] = await self._run_blocking(
+                    self._index_executor, self._chunk_document, source, text
+                )
+
+            # Comparaison provisoire hors verrou, pour embedder les chunks a priori nouveaux
+            # par requêtes groupées et parallèles sans bloquer les autres écritures
+            pending, _, _ = await self._run_blocking(self._index_executor, self._diff_documents, chunks_by_source)
+            vectors = await self.embedding_pipeline.embed([text for _, text in pending.values()])
+            embeddings_by_id = dict(zip(pending.keys(), vectors))
+
+            async with self._write_lock:
+                # Comparaison définitive sous verrou : une autre indexation des mêmes documents
+                # a pu écrire ou supprimer des chunks pendant le calcul des embeddings
+                new_chunks, removed_ids, totals = await self._run_blocking(
+                    self._index_executor, self._diff_documents, chunks_by_source
+                )
+                missing = [chunk_id for chunk_id in new_chunks if chunk_id not in embeddings_by_id]
+                if missing:
+                    vectors = await self.embedding_pipeline.embed([new_chunks[chunk_id][1] for chunk_id in missing])
+                    embeddings_by_id.update(zip(missing, vectors))
+                ids = list(new_chunks)
+                await self._run_blocking(
+                    self._index_executor,
+                    self._write_chunks,
+                    ids,
+                    [new_chunks[chunk_id][1] for chunk_id in ids],
+                    [embeddings_by_id[chunk_id] for chunk_id in ids],
+                    [{"source": new_chunks[chunk_id][0]} for chunk_id in ids],
+                    removed_ids
+                )
+                # Persistance explicite
+                await self._run_blocking(self._index_executor, self.vector_backend.persist)
+                if clear_existing or totals["added"] or totals["removed"]:
+                    self.corpus_version += 1
+
+        logging.info(
+            f"{len(texts_by_source)} document(s) indexed: {totals['added']} added, "
+            f"{totals['unchanged']} unchanged, {totals['removed']} removed"
+        )
+        return totals
+
+    async def load_and_index_texts(self, texts: List[str], clear_existing: bool = False,
+                                   sources: Optional[List[str]] = None) -> Dict[str, int]:
         """
         Charge et indexe une liste de textes
-        
+
         Args:
             texts: Liste de textes à indexer
             clear_existing: Si True, supprime l'index existant avant d'indexer
+            sources: Noms des documents correspondants (dérivés du contenu par défaut)
         """
-        # Nettoyage optionnel de l'existant
-        if clear_existing and os.path.exists(self.persist_dir):
-            shutil.rmtree(self.persist_dir)
-            os.makedirs(self.persist_dir)
-            self.vector_store = None
-            
-        # Découpage des textes
-        splits = self.text_splitter.split_text("\n\n".join(texts))
-        
-        if self.vector_store is None:
-            # Création initiale
-            indexed_texts = [{"content": text, "timestamp": i} for i, text in enumerate(splits)]
-            self.vector_store = Chroma.from_texts(
-                indexed_texts,
-                splits,
-                self.embeddings,
-                persist_directory=self.persist_dir
-            )
-            logging.info("Documents indexed: %s", splits)
-        else:
-            # Ajout à l'existant
-            self.vector_store.add_texts(splits)
-            logging.info(f"Additional documents indexed: {splits}")
-            
-        # Persistance explicite
-        self.vector_store.persist()
+        if sources is None:
+            sources = [self.default_source(text) for text in texts]
+        return await self.index_documents(list(zip(sources, texts)), clear_existing=clear_existing)
 
 
-    async def load_and_index_pdf(self, pdf_path: str, clear_existing: bool = False) -> None:
+    async def load_and_index_pdf(self, pdf_path: str, clear_existing: bool = False) -> Dict[str, int]:
         # Extract text from the PDF file
-        text = self.extract_text_from_pdf(pdf_path)
-        
+        text = await self.aextract_text_from_pdf(pdf_path)
+
         # Split and index the extracted text
-        await self.load_and_index_texts([text], clear_existing=clear_existing)
-    
+        return await self.index_documents([(os.path.basename(pdf_path), text)], clear_existing=clear_existing)
+
     async def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """
         Effectue une recherche par similarité
-        
+
         Args:
             query: Requête de recherche
             k: Nombre de résultats à retourner
-            
+
         Returns:
             Liste des documents les plus pertinents
         """
-        if not self.vector_store:
+        if self.vector_backend.is_empty():
             raise ValueError("Vector store not initialized. Please add documents first.")
-            
-        results = self.vector_store.similarity_search(query, k=k)
-        logging.info(f"Similarity search results: {[doc.page_content for doc in results]}")
+
+        # Embedding de la requête via le client asynchrone natif, puis recherche dans le pool
+        with span("rag", "embed_query"):
+            query_embedding = await self.embeddings.aembed_query(query)
+        with span("rag", "vector_query"):
+            results = await self._run_blocking(
+                self._query_executor, self.vector_backend.query, query_embedding, k
+            )
+        logging.info(f"Similarity search: {len(results)} result(s)")
         # return [doc.page_content for doc in results]
         return results
-    
-    def get_all_documents(self) -> List[str]:
-        if not self.vector_store:
+
+    async def hybrid_search(self, query: str, k: int = 4) -> List[Document]:
+        """
+        Recherche hybride : classements dense (embeddings) et lexical (BM25) fusionnés
+        par Reciprocal Rank Fusion
+
+        Args:
+            query: Requête de recherche
+            k: Nombre de résultats à retourner
+        """
+        if self.bm25_index is None:
+            return await self.similarity_search(query, k=k)
+
+        candidates = k * settings.hybrid_candidate_factor
+        dense_docs, lexical_hits = await asyncio.gather(
+            self.similarity_search(query, k=candidates),
+            self._bm25_search(query, candidates)
+        )
+
+        docs_by_id: Dict[str, Document] = {}
+        dense_ranking = []
+        for doc in dense_docs:
+            # Identifiant stocké par le backend (celui de l'index BM25) ; recalculé seulement
+            # pour un backend qui ne le renvoie pas
+            chunk_id = getattr(doc, "id", None) or self.chunk_id(doc.metadata.get("source"), doc.page_content)
+            docs_by_id.setdefault(chunk_id, doc)
+            dense_ranking.append(chunk_id)
+        lexical_ranking = [chunk_id for chunk_id, _ in lexical_hits]
+
+        results = []
+        for chunk_id, _ in reciprocal_rank_fusion([dense_ranking, lexical_ranking], k=settings.rrf_k):
+            doc = docs_by_id.get(chunk_id)
+            if doc is None:
+                stored = self.bm25_index.get(chunk_id)
+                if stored is None:
+                    continue
+                doc = Document(page_content=stored[0], metadata=stored[1])
+            results.append(doc)
+            if len(results) == k:
+                break
+        logging.info(f"Hybrid search: {len(results)} result(s)")
+        return results
+
+    async def _bm25_search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        with span("rag", "bm25_query"):
+            return await self._run_blocking(self._query_executor, self.bm25_index.search, query, k)
+
+    @traced("rag")
+    async def search(self, query: str, k: int = 4, mode: Optional[str] = None) -> List[Document]:
+        """Recherche selon le mode demandé : "dense" ou "hybrid" (par défaut : rag_retrieval_mode)"""
+        mode = mode or settings.rag_retrieval_mode
+        if mode == "hybrid":
+            return await self.hybrid_search(query, k=k)
+        if mode == "dense":
+            return await self.similarity_search(query, k=k)
+        raise ValueError(f"Mode de recherche inconnu : {mode}")
+
+    async def list_documents(self, limit: int = 100, offset: int = 0, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Liste paginée des chunks stockés, lue directement dans la collection
+        (identifiants et métadonnées) sans calcul d'embedding ni recherche vectorielle
+
+        Args:
+            limit: Nombre maximal de chunks renvoyés
+            offset: Nombre de chunks à sauter
+            source: Ne renvoie que les chunks de ce document
+        """
+        if self.vector_backend.is_empty():
             raise ValueError("Vector store not initialized. Please add documents first.")
-        
-        documents = []
-        # Recherche de tous les documents en utilisant une requête vide
-        results = self.vector_store.similarity_search("", k=100)
-        documents = [doc.page_content for doc in results]
-        
+        return await self._run_blocking(self._query_executor, self.vector_backend.list, limit, offset, source)
+
+    async def get_all_documents(self, limit: int = 100, offset: int = 0, source: Optional[str] = None) -> List[str]:
+        chunks = await self.list_documents(limit=limit, offset=offset, source=source)
+
         # Nettoyage des retours
-        documents = [doc.replace("\n", " ") for doc in documents]
-        return documents
-        
-    def clear(self) -> None:
+        return [chunk["content"].replace("\n", " ") for chunk in chunks]
+
+    def _clear(self) -> None:
+        self.vector_backend.clear()
+        if self.bm25_index is not None:
+            self.bm25_index.clear()
+
+    async def clear(self) -> None:
         """
         Supprime toutes les données du vector store
         """
-        if os.path.exists(self.persist_dir):
-            shutil.rmtree(self.persist_dir)
-            os.makedirs(self.persist_dir)
-        # self.vector_store = None
+        async with self._write_lock:
+            await self._run_blocking(self._index_executor, self._clear)
+            self.corpus_version += 1
         logging.info("Vector store cleared.")
 
     async def get_context(self) -> str:
         """
         Retrieve context for RAG.
         """
-        if not self.vector_store:
+        if self.vector_backend.is_empty():
             logging.error("Vector store not initialized.")
             raise ValueError("Vector store not initialized. Please add documents first.")
 
         try:
-            # Perform a similarity search with an empty query to get the most relevant documents
-            results = self.vector_store.similarity_search("", k=5)
+            # Lecture directe des premiers chunks stockés (sans embedding d'une requête vide)
+            results = await self.list_documents(limit=5)
             if not results:
-                logging.info("No documents found in similarity search.")
+                logging.info("No documents found in vector store.")
                 return ""
 
-            context = "\n\n".join([doc.page_content for doc in results])
-            logging.info(f"Generated context: {context}")
+            context = "\n\n".join([chunk["content"] for chunk in results])
+            logging.info(f"Generated context: {len(results)} chunk(s)")
             return context
 
         except Exception as e:
             logging.error(f"Error retrieving context from vector store: {str(e)}")
             raise
+
+    def embedding_cache_stats(self) -> Dict[str, float]:
+        """Statistiques du cache d'embeddings (vide si le cache est désactivé)"""
+        return self.embedding_cache.stats() if self.embedding_cache else {}
+
+    def embedding_pipeline_stats(self) -> Dict[str, float]:
+        """Débit et état du pipeline d'embeddings de l'indexation"""
+        return self.embedding_pipeline.stats()
+
+    def close(self) -> None:
+        """Arrête les pools de threads du service"""
+        self._query_executor.shutdown(wait=False, cancel_futures=True)
+        self._index_executor.shutdown(wait=True)
+        self.pdf_extractor.close()
+        self.vector_backend.close()
+        if self.bm25_index is not None:
+            self.bm25_index.close()
+        if self.embedding_cache:
+            self.embedding_cache.store.close()
@@ -0,0 +1,175 @@
+# services/response_cache.py
+"""
+Cache des réponses du LLM pour les questions récurrentes (FAQ RH).
+Recherche d'abord une correspondance exacte (question normalisée + empreinte du
+contexte RAG), puis une correspondance sémantique (similarité cosinus des embeddings
+de la question au-dessus d'un seuil). Éviction LRU et expiration (TTL).
+La clé ne contient pas l'historique de conversation : l'appelant ne doit utiliser le cache
+que pour des questions posées hors contexte (début de session), sans quoi une réponse
+propre à une session pourrait être servie à une autre.
+"""
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Ponctuation ignorée en début et fin de question ("Période d'essai ?" == "période d'essai")
+EDGE_PUNCTUATION = " \t\n?!.,;:…¿¡\"'«»"
+
+
+class CacheEntry(NamedTuple):
+    namespace: str
+    response: str
+    vector: Optional[np.ndarray]
+    created_at: float
+
+
+class CacheLookup(NamedTuple):
+    response: Optional[str]
+    vector: Optional[np.ndarray]  # Embedding de la question, réutilisé par store()
+
+
+class ResponseCache:
+    def __init__(self,
+                 embeddings: Optional[Embeddings] = None,
+                 max_entries: int = 1000,
+                 ttl: float = 3600,
+                 similarity_threshold: float = 0.95):
+        """
+        Args:
+            embeddings: Objet Embeddings pour la correspondance sémantique (None = exacte uniquement)
+            max_entries: Nombre maximal de réponses conservées
+            ttl: Durée de vie (secondes) d'une réponse en cache
+            similarity_threshold: Similarité cosinus minimale pour une correspondance sémantique
+        """
+        self.embeddings = embeddings
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Question normalisée : Unicode NFKC, minuscules, espaces et ponctuation de bord réduits"""
+        text = unicodedata.normalize("NFKC", text).casefold()
+        return re.sub(r"\s+", " ", text).strip(EDGE_PUNCTUATION)
+
+    @staticmethod
+    def _key(namespace: str, prompt: str, context: str) -> str:
+        context_hash = hashlib.sha256(context.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{namespace}\x00{prompt}\x00{context_hash}".encode("utf-8")).hexdigest()
+
+    def _is_expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    async def _embed(self, prompt: str) -> Optional[np.ndarray]:
+        if self.embeddings is None:
+            return None
+        try:
+            vector = np.asarray(await self.embeddings.aembed_query(prompt), dtype=np.float32)
+        except Exception as e:
+            # Le cache ne doit jamais empêcher une réponse : on se contente de la correspondance exacte
+            logging.warning(f"Response cache: query embedding failed: {str(e)}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _semantic_match(self, namespace: str, vector: np.ndarray, now: float) -> Optional[str]:
+        keys, vectors = [], []
+        for key, entry in self._entries.items():
+            if entry.namespace == namespace and entry.vector is not None and not self._is_expired(entry, now):
+                keys.append(key)
+                vectors.append(entry.vector)
+        if not vectors:
+            return None
+        scores = np.stack(vectors) @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.similarity_threshold:
+            return None
+        self._entries.move_to_end(keys[best])
+        return self._entries[keys[best]].response
+
+    async def lookup(self, namespace: str, prompt: str, context: str = "") -> CacheLookup:
+        """
+        Cherche une réponse en cache pour une question
+
+        Args:
+            namespace: Espace de cache (endpoint, mode de recherche, version du corpus)
+            prompt: Question de l'utilisateur
+            context: Contexte RAG injecté dans le prompt
+        """
+        now = time.monotonic()
+        normalized = self.normalize(prompt)
+        key = self._key(namespace, normalized, context)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if not self._is_expired(entry, now):
+                self.exact_hits += 1
+                self._entries.move_to_end(key)
+                return CacheLookup(entry.response, entry.vector)
+            del self._entries[key]
+            self.expirations += 1
+
+        vector = await self._embed(normalized)
+        if vector is not None:
+            response = self._semantic_match(namespace, vector, now)
+            if response is not None:
+                self.semantic_hits += 1
+                return CacheLookup(response, vector)
+        self.misses += 1
+        return CacheLookup(None, vector)
+
+    def record_bypass(self) -> None:
+        """Comptabilise une question non éligible au cache (ex. session avec historique)"""
+        self.bypassed += 1
+
+    def store(self, namespace: str, prompt: str, context: str, response: str,
+              vector: Optional[np.ndarray] = None) -> None:
+        """Enregistre une réponse (vector : embedding normalisé renvoyé par lookup)"""
+        key = self._key(namespace, self.normalize(prompt), context)
+        self._entries[key] = CacheEntry(namespace, response, vector, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, namespace: Optional[str] = None) -> int:
+        """Vide le cache (ou un seul espace) et renvoie le nombre d'entrées retirées"""
+        if namespace is None:
+            removed = len(self._entries)
+            self._entries.clear()
+            return removed
+        keys = [key for key, entry in self._entries.items() if entry.namespace == namespace]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def stats(self) -> Dict[str, float]:
+        """Compteurs d'utilisation du cache (taux de hit inclus)"""
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": hits / total if total else 0.0,
+            "bypassed": self.bypassed,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -0,0 +1,124 @@
+# services/session_cache.py
+"""
+Cache borné des historiques de conversation en mémoire.
+Combine une éviction LRU (nombre maximal de sessions) et une expiration
+par inactivité (TTL), avec une tâche de nettoyage en arrière-plan.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Optional, Tuple
+from langchain_core.chat_history import BaseChatMessageHistory
+
+
+class SessionCache:
+    def __init__(self,
+                 factory: Callable[[str], BaseChatMessageHistory],
+                 max_sessions: int = 1000,
+                 idle_timeout: float = 3600,
+                 sweep_interval: float = 60):
+        """
+        Args:
+            factory: Fonction créant l'historique d'une nouvelle session à partir de son identifiant
+            max_sessions: Nombre maximal de sessions conservées en mémoire
+            idle_timeout: Durée d'inactivité (secondes) au-delà de laquelle une session expire
+            sweep_interval: Intervalle (secondes) entre deux passages du nettoyeur
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self._entries: "OrderedDict[str, Tuple[BaseChatMessageHistory, float]]" = OrderedDict()
+        self._sweeper: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def _is_expired(self, last_access: float, now: float) -> bool:
+        return now - last_access > self.idle_timeout
+
+    def get(self, session_id: str,
+            factory: Optional[Callable[[str], BaseChatMessageHistory]] = None) -> BaseChatMessageHistory:
+        """Récupère l'historique d'une session, ou le crée s'il n'existe pas (ou a expiré)"""
+        now = time.monotonic()
+        entry = self._entries.get(session_id)
+        if entry is not None and not self._is_expired(entry[1], now):
+            self.hits += 1
+            history = entry[0]
+        else:
+            if entry is not None:
+                self.expirations += 1
+            self.misses += 1
+            history = (factory or self.factory)(session_id)
+
+        self._entries[session_id] = (history, now)
+        self._entries.move_to_end(session_id)
+
+        # Éviction LRU si la capacité est dépassée
+        while len(self._entries) > self.max_sessions:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return history
+
+    def pop(self, session_id: str) -> Optional[BaseChatMessageHistory]:
+        """Retire une session du cache"""
+        entry = self._entries.pop(session_id, None)
+        return entry[0] if entry else None
+
+    def sweep(self) -> int:
+        """Supprime les sessions inactives et renvoie le nombre de sessions retirées"""
+        now = time.monotonic()
+        # Les entrées sont ordonnées de la moins récente à la plus récente
+        expired = []
+        for session_id, (_, last_access) in self._entries.items():
+            if not self._is_expired(last_access, now):
+                break
+            expired.append(session_id)
+        for session_id in expired:
+            del self._entries[session_id]
+        self.expirations += len(expired)
+        return len(expired)
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logging.info(f"Session cache sweep: {removed} inactive session(s) removed")
+            except Exception as e:
+                logging.error(f"Error during session cache sweep: {str(e)}")
+
+    def start(self) -> None:
+        """Démarre la tâche de nettoyage en arrière-plan"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self) -> None:
+        """Arrête la tâche de nettoyage"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def stats(self) -> Dict[str, int]:
+        """Compteurs d'utilisation du cache"""
+        return {
+            "sessions": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
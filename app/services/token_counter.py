@@ -0,0 +1,74 @@
+# services/token_counter.py
+"""
+Comptage des tokens (tiktoken), partagé par l'assemblage des prompts et le pipeline
+d'embeddings. L'encodage est résolu au premier comptage et non à la construction :
+tiktoken télécharge son fichier BPE à la première utilisation, et le démarrage de
+l'application ne doit pas dépendre de l'accès réseau. Si l'encodage ne peut pas être
+chargé, le nombre de tokens est estimé à partir du nombre de caractères.
+"""
+import logging
+import threading
+from typing import Any, Optional, Sequence
+from langchain_core.messages import BaseMessage
+
+try:
+    import tiktoken
+except ImportError:  # Estimation approximative si tiktoken n'est pas installé
+    tiktoken = None
+
+# Tokens ajoutés par message par le format chat d'OpenAI (rôle, séparateurs)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimation sans encodage (environ 4 caractères par token)"""
+    return len(text) // 4 + 1
+
+
+class TokenCounter:
+    def __init__(self, model_name: Optional[str] = None, encoding_name: str = "cl100k_base"):
+        """
+        Args:
+            model_name: Modèle dont l'encodage est utilisé, s'il est connu de tiktoken
+            encoding_name: Encodage utilisé sinon
+        """
+        self.model_name = model_name
+        self.encoding_name = encoding_name
+        self._encoding: Any = None
+        self._resolved = False
+        self._lock = threading.Lock()
+
+    def _load_encoding(self) -> Any:
+        if tiktoken is None:
+            return None
+        try:
+            if self.model_name:
+                try:
+                    return tiktoken.encoding_for_model(self.model_name)
+                except KeyError:
+                    pass
+            return tiktoken.get_encoding(self.encoding_name)
+        except Exception as e:
+            logging.warning(f"tiktoken encoding unavailable, estimating token counts from characters: {str(e)}")
+            return None
+
+    @property
+    def encoding(self) -> Any:
+        if not self._resolved:
+            with self._lock:
+                if not self._resolved:
+                    self._encoding = self._load_encoding()
+                    self._resolved = True
+        return self._encoding
+
+    def count(self, text: str) -> int:
+        encoding = self.encoding
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        return estimate_tokens(text)
+
+    def count_message(self, message: BaseMessage) -> int:
+        return self.count(message.content) + MESSAGE_OVERHEAD_TOKENS
+
+    def count_messages(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.count_message(message) for message in messages)
@@ -1,73 +1,290 @@
-from langchain.tools import Tool
-from langchain.chains import LLMChain
-from langchain.agents import AgentExecutor, ZeroShotAgent
-import requests
-from typing import Dict, List
+# services/tools.py
+"""
+Outils de l'assistant, appelés par le LLM en function calling natif.
+Les appels d'outils d'une même étape sont exécutés en parallèle, chacun avec un délai
+maximal, et leurs résultats sont mis en cache (les outils sont déterministes).
+"""
+import ast
+import asyncio
 import json
+import logging
+import math
+import operator
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import BaseTool, StructuredTool
+from pydantic import BaseModel, Field
+from services.llm_gateway import LLMGateway, PRIORITY_BACKGROUND
+from services.metrics import span
+
+SYSTEM_PROMPT = (
+    "Vous êtes un assistant intelligent. Utilisez les outils disponibles lorsqu'ils sont utiles "
+    "pour répondre à l'utilisateur, puis répondez directement à partir de leurs résultats."
+)
+
+
+class SafeCalculator:
+    """
+    Évaluation d'expressions arithmétiques à partir de leur arbre syntaxique : seuls les
+    nombres, les opérateurs arithmétiques et quelques fonctions de math sont acceptés.
+    Chaque valeur intermédiaire est bornée, pour qu'aucune expression ne puisse monopoliser
+    le processeur (grands entiers, puissances, arrondis à un nombre de chiffres démesuré).
+    """
+
+    OPERATORS: Dict[type, Callable[..., Any]] = {
+        ast.Add: operator.add,
+        ast.Sub: operator.sub,
+        ast.Mult: operator.mul,
+        ast.Div: operator.truediv,
+        ast.FloorDiv: operator.floordiv,
+        ast.Mod: operator.mod,
+        ast.Pow: operator.pow,
+        ast.UAdd: operator.pos,
+        ast.USub: operator.neg,
+    }
+    FUNCTIONS: Dict[str, Callable[..., Any]] = {
+        "abs": abs, "min": min, "max": max,
+        "sqrt": math.sqrt, "exp": math.exp, "log": math.log, "log10": math.log10,
+        "sin": math.sin, "cos": math.cos, "tan": math.tan,
+        "floor": math.floor, "ceil": math.ceil,
+    }
+    CONSTANTS: Dict[str, float] = {"pi": math.pi, "e": math.e}
+
+    def __init__(self, max_length: int = 200, max_magnitude: float = 1e100, max_round_digits: int = 15):
+        """
+        Args:
+            max_length: Longueur maximale (caractères) d'une expression
+            max_magnitude: Valeur absolue maximale de toute valeur intermédiaire ou du résultat
+            max_round_digits: Nombre maximal de chiffres (en valeur absolue) pour round()
+        """
+        self.max_length = max_length
+        self.max_magnitude = max_magnitude
+        self.max_round_digits = max_round_digits
+
+    def evaluate(self, expression: str) -> float:
+        if len(expression) > self.max_length:
+            raise ValueError(f"Expression trop longue (maximum {self.max_length} caractères)")
+        try:
+            tree = ast.parse(expression.replace("^", "**"), mode="eval")
+        except SyntaxError:
+            raise ValueError(f"Expression invalide : {expression}")
+        return self._eval(tree.body)
+
+    def _bounded(self, value: Any) -> Any:
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            raise ValueError("Résultat non numérique")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError("Résultat non fini")
+        if abs(value) > self.max_magnitude:
+            raise ValueError("Valeur trop grande")
+        return value
+
+    def _power(self, base: Any, exponent: Any) -> Any:
+        # Ordre de grandeur du résultat estimé avant le calcul (les grands entiers sont coûteux)
+        if base not in (0, 1, -1) and exponent * math.log10(abs(base)) > math.log10(self.max_magnitude):
+            raise ValueError("Puissance trop grande")
+        return base ** exponent
+
+    def _round(self, value: Any, ndigits: Any = 0) -> Any:
+        if not isinstance(ndigits, int) or abs(ndigits) > self.max_round_digits:
+            raise ValueError(f"round() accepte au plus {self.max_round_digits} chiffres")
+        return round(value, ndigits)
+
+    def _eval(self, node: ast.AST) -> Any:
+        if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+            return self._bounded(node.value)
+        if isinstance(node, ast.Name) and node.id in self.CONSTANTS:
+            return self.CONSTANTS[node.id]
+        if isinstance(node, ast.UnaryOp) and type(node.op) in self.OPERATORS:
+            return self._bounded(self.OPERATORS[type(node.op)](self._eval(node.operand)))
+        if isinstance(node, ast.BinOp) and type(node.op) in self.OPERATORS:
+            left, right = self._eval(node.left), self._eval(node.right)
+            if isinstance(node.op, ast.Pow):
+                return self._bounded(self._power(left, right))
+            return self._bounded(self.OPERATORS[type(node.op)](left, right))
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            args = [self._eval(arg) for arg in node.args]
+            if node.func.id == "round" and 1 <= len(args) <= 2:
+                return self._bounded(self._round(*args))
+            if node.func.id in self.FUNCTIONS:
+                return self._bounded(self.FUNCTIONS[node.func.id](*args))
+        raise ValueError(f"Élément non autorisé dans l'expression : {ast.dump(node)[:60]}")
+
+
+class ToolResultCache:
+    """Cache LRU à expiration des résultats d'outils, par nom d'outil et arguments"""
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(name: str, args: Dict[str, Any]) -> str:
+        return json.dumps([name, args], sort_keys=True, ensure_ascii=False, default=str)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key: str, result: str) -> None:
+        self._entries[key] = (result, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class CalculatorInput(BaseModel):
+    expression: str = Field(description="Expression arithmétique, ex. (12.5 * 4) / sqrt(16)")
+
+
+class SearchInput(BaseModel):
+    query: str = Field(description="Requête de recherche")
+
+
+class TranslateInput(BaseModel):
+    text: str = Field(description="Texte à traduire")
+    target_language: str = Field(default="anglais", description="Langue cible")
+
 
 class AssistantTools:
-    def __init__(self, llm):
+    def __init__(self, llm, gateway: Optional[LLMGateway] = None, tool_timeout: float = 10,
+                 max_steps: int = 4, cache_max_entries: int = 256, cache_ttl: float = 300):
+        """
+        Args:
+            llm: Modèle de chat (doit supporter bind_tools)
+            gateway: Passerelle LLM (priorité basse) par laquelle passent les appels, si fournie
+            tool_timeout: Délai maximal (secondes) d'exécution d'un outil
+            max_steps: Nombre maximal d'allers-retours avec le LLM pour une requête
+            cache_max_entries: Nombre maximal de résultats d'outils en cache
+            cache_ttl: Durée de validité (secondes) d'un résultat en cache
+        """
         self.llm = llm
+        self.gateway = gateway
+        self.tool_timeout = tool_timeout
+        self.max_steps = max_steps
+        self.calculator = SafeCalculator()
+        self.cache = ToolResultCache(cache_max_entries, cache_ttl)
         self.tools = self._initialize_tools()
-        self.agent_executor = self._initialize_agent()
-    
-    def _initialize_tools(self) -> List[Tool]:
-        tools = [
-            Tool(
+        self._tools_by_name = {tool.name: tool for tool in self.tools}
+        self.llm_with_tools = self._bind()
+        self.timeouts = 0
+        self.errors = 0
+
+    def _initialize_tools(self) -> List[BaseTool]:
+        return [
+            StructuredTool.from_function(
+                coroutine=self._calculate,
                 name="Calculatrice",
-                func=self._calculate,
-                description="Utile pour effectuer des calculs mathématiques"
+                description="Utile pour effectuer des calculs mathématiques",
+                args_schema=CalculatorInput
             ),
-            Tool(
+            StructuredTool.from_function(
+                coroutine=self._search_web,
                 name="RechercheWeb",
-                func=self._search_web,
-                description="Recherche des informations sur le web"
+                description="Recherche des informations sur le web",
+                args_schema=SearchInput
             ),
-            Tool(
+            StructuredTool.from_function(
+                coroutine=self._translate,
                 name="Traducteur",
-                func=self._translate,
-                description="Traduit du texte entre différentes langues"
-            )
+                description="Traduit du texte entre différentes langues",
+                args_schema=TranslateInput
+            ),
         ]
-        return tools
-    
-    def _initialize_agent(self) -> AgentExecutor:
-        prompt = ZeroShotAgent.create_prompt(
-            self.tools,
-            prefix="Vous êtes un assistant intelligent. Utilisez ces outils pour aider l'utilisateur:",
-            suffix="Question: {input}\nPensée: Réfléchissons étape par étape:\n{agent_scratchpad}"
-        )
-        
-        llm_chain = LLMChain(llm=self.llm, prompt=prompt)
-        agent = ZeroShotAgent(llm_chain=llm_chain, tools=self.tools)
-        
-        return AgentExecutor.from_agent_and_tools(
-            agent=agent,
-            tools=self.tools,
-            verbose=True
-        )
-    
-    def _calculate(self, expression: str) -> str:
-        """Effectue un calcul mathématique"""
+
+    def _bind(self, tool_choice: Optional[str] = None):
+        """Modèle lié aux outils (tool_choice : nom d'un outil à appeler obligatoirement)"""
+        bound = self.llm.bind_tools(self.tools, tool_choice=tool_choice) if tool_choice else self.llm.bind_tools(self.tools)
+        return self.gateway.wrap(bound, "tools", PRIORITY_BACKGROUND) if self.gateway else bound
+
+    async def _calculate(self, expression: str) -> str:
+        """Effectue un calcul mathématique (hors boucle d'événements : le délai de l'outil s'applique)"""
         try:
-            return str(eval(expression))
-        except Exception as e:
+            result = await asyncio.get_running_loop().run_in_executor(None, self.calculator.evaluate, expression)
+            return str(result)
+        except (ValueError, ArithmeticError, TypeError) as e:
             return f"Erreur de calcul: {str(e)}"
-    
-    def _search_web(self, query: str) -> str:
+
+    async def _search_web(self, query: str) -> str:
         """Simule une recherche web"""
         # Implémentez votre logique de recherche ici
         return f"Résultats pour: {query}"
-    
-    def _translate(self, text: str) -> str:
+
+    async def _translate(self, text: str, target_language: str = "anglais") -> str:
         """Simule une traduction"""
         # Implémentez votre logique de traduction ici
-        return f"Traduction de: {text}"
-    
-    async def process_request(self, query: str) -> str:
-        """Traite une requête utilisateur avec les outils disponibles"""
-        try:
-            response = await self.agent_executor.arun(query)
-            return response
-        except Exception as e:
-            return f"Erreur lors du traitement: {str(e)}"
\ No newline at end of file
+        return f"Traduction ({target_language}) de: {text}"
+
+    async def _run_tool(self, call: Dict[str, Any]) -> ToolMessage:
+        """Exécute un appel d'outil demandé par le LLM ; les erreurs sont renvoyées au LLM"""
+        name, args = call["name"], call.get("args") or {}
+        tool = self._tools_by_name.get(name)
+        if tool is None:
+            return ToolMessage(content=f"Outil inconnu: {name}", tool_call_id=call["id"])
+
+        key = ToolResultCache.key(name, args)
+        result = self.cache.get(key)
+        if result is None:
+            try:
+                with span("tools", name):
+                    result = str(await asyncio.wait_for(tool.ainvoke(args), self.tool_timeout))
+                self.cache.set(key, result)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                logging.warning(f"Tool {name} timed out after {self.tool_timeout}s")
+                result = f"Erreur: l'outil {name} n'a pas répondu à temps"
+            except Exception as e:
+                self.errors += 1
+                logging.error(f"Tool {name} failed: {str(e)}")
+                result = f"Erreur lors de l'exécution de {name}: {str(e)}"
+        return ToolMessage(content=result, tool_call_id=call["id"])
+
+    async def process_request(self, query: str, tool: Optional[str] = None) -> str:
+        """
+        Traite une requête utilisateur avec les outils disponibles
+
+        Args:
+            query: Requête de l'utilisateur
+            tool: Outil à utiliser obligatoirement à la première étape (optionnel)
+        """
+        if tool is not None and tool not in self._tools_by_name:
+            raise ValueError(f"Outil inconnu: {tool}. Outils disponibles: {', '.join(self._tools_by_name)}")
+
+        messages: List[BaseMessage] = [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=query)]
+        model = self._bind(tool) if tool else self.llm_with_tools
+        response: Optional[AIMessage] = None
+        for _ in range(self.max_steps):
+            response = await model.ainvoke(messages)
+            if not response.tool_calls:
+                return response.content
+            messages.append(response)
+            # Les appels d'une même étape sont indépendants : exécution en parallèle
+            messages.extend(await asyncio.gather(*[self._run_tool(call) for call in response.tool_calls]))
+            model = self.llm_with_tools
+
+        logging.warning(f"Tool loop stopped after {self.max_steps} steps")
+        return response.content if response is not None and response.content else messages[-1].content
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "cache_entries": len(self.cache),
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "timeouts": self.timeouts,
+            "errors": self.errors,
+        }
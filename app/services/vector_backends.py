@@ -0,0 +1,627 @@
+# services/vector_backends.py
+"""
+Backends de stockage vectoriel utilisés par RAGService.
+
+- ChromaBackend : vector store Chroma persistant (comportement historique)
+- NumpyBackend : matrice float32 contiguë sur disque, partagée entre workers par mmap,
+  avec recherche exacte par produits scalaires vectorisés et index IVF optionnel
+  pour les grands corpus
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Set
+import numpy as np
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+
+class VectorBackend(ABC):
+    """Interface commune des backends vectoriels (méthodes bloquantes, appelées hors boucle)"""
+
+    @abstractmethod
+    def is_empty(self) -> bool:
+        """Indique si aucun chunk n'est indexé"""
+
+    @abstractmethod
+    def ids_for_source(self, source: str) -> Set[str]:
+        """Identifiants des chunks indexés pour un document source"""
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]], texts: List[str],
+               metadatas: List[Dict[str, Any]]) -> None:
+        """Ajoute ou remplace des chunks dont les embeddings sont déjà calculés"""
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> None:
+        """Supprime des chunks"""
+
+    @abstractmethod
+    def query(self, embedding: List[float], k: int, source: Optional[str] = None) -> List[Document]:
+        """Renvoie les k chunks les plus proches de l'embedding donné (Document.id : identifiant stocké)"""
+
+    @abstractmethod
+    def list(self, limit: int, offset: int, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Liste paginée des chunks stockés (id, contenu, source)"""
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Supprime tous les chunks"""
+
+    def persist(self) -> None:
+        """Persiste les écritures (no-op si le backend écrit directement sur disque)"""
+
+    def close(self) -> None:
+        """Libère les ressources du backend"""
+
+
+class PrecomputedEmbeddings(Embeddings):
+    """
+    Fonction d'embedding donnée à Chroma : renvoie les vecteurs déjà calculés par le
+    pipeline d'indexation pour les textes en cours d'écriture, sinon délègue au modèle.
+    """
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.pending: Dict[str, List[float]] = {}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = [text for text in texts if text not in self.pending]
+        computed = iter(self.embeddings.embed_documents(missing) if missing else [])
+        return [self.pending[text] if text in self.pending else next(computed) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+
+class ChromaBackend(VectorBackend):
+    # Taille maximale d'un lot d'écriture (Chroma limite la taille d'un upsert)
+    UPSERT_BATCH_SIZE = 1000
+    # Collection utilisée par défaut par le wrapper LangChain (données existantes)
+    COLLECTION_NAME = "langchain"
+
+    def __init__(self, persist_dir: str, embeddings: Embeddings):
+        self.persist_dir = persist_dir
+        self.embeddings = PrecomputedEmbeddings(embeddings)
+        self._write_lock = threading.Lock()
+        self._client = None
+        self.vector_store: Optional[Chroma] = None
+        # Chargement d'un vector store existant
+        if os.path.exists(os.path.join(self.persist_dir, "chroma.sqlite3")):
+            self._ensure_vector_store()
+
+    def _ensure_vector_store(self) -> Chroma:
+        if self.vector_store is None:
+            if self._client is None:
+                import chromadb
+                self._client = chromadb.PersistentClient(path=self.persist_dir)
+            # Client partagé avec le wrapper : les recherches interrogent la collection
+            # directement pour obtenir les identifiants stockés des chunks
+            self.vector_store = Chroma(
+                client=self._client,
+                collection_name=self.COLLECTION_NAME,
+                persist_directory=self.persist_dir,
+                embedding_function=self.embeddings
+            )
+        return self.vector_store
+
+    def is_empty(self) -> bool:
+        return self.vector_store is None
+
+    def ids_for_source(self, source: str) -> Set[str]:
+        return set(self._ensure_vector_store().get(where={"source": source}, include=[])["ids"])
+
+    def upsert(self, ids, embeddings, texts, metadatas) -> None:
+        if not ids:
+            return
+        vector_store = self._ensure_vector_store()
+        # add_texts (upsert par identifiant) obtient ses vecteurs de PrecomputedEmbeddings :
+        # les embeddings déjà calculés ne sont pas redemandés au modèle
+        with self._write_lock:
+            for start in range(0, len(ids), self.UPSERT_BATCH_SIZE):
+                end = start + self.UPSERT_BATCH_SIZE
+                self.embeddings.pending = dict(zip(texts[start:end], embeddings[start:end]))
+                try:
+                    vector_store.add_texts(texts[start:end], metadatas=metadatas[start:end], ids=ids[start:end])
+                finally:
+                    self.embeddings.pending = {}
+
+    def delete(self, ids: List[str]) -> None:
+        if ids:
+            self._ensure_vector_store().delete(ids=ids)
+
+    def query(self, embedding, k, source=None) -> List[Document]:
+        self._ensure_vector_store()
+        result = self._client.get_collection(self.COLLECTION_NAME).query(
+            query_embeddings=[embedding],
+            n_results=k,
+            where={"source": source} if source else None,
+            include=["documents", "metadatas"]
+        )
+        return [
+            Document(page_content=content, metadata=metadata or {}, id=chunk_id)
+            for chunk_id, content, metadata in zip(result["ids"][0], result["documents"][0], result["metadatas"][0])
+        ]
+
+    def list(self, limit, offset, source=None) -> List[Dict[str, Any]]:
+        result = self._ensure_vector_store().get(
+            where={"source": source} if source else None,
+            limit=limit,
+            offset=offset,
+            include=["documents", "metadatas"]
+        )
+        return [
+            {"id": chunk_id, "content": content, "source": (metadata or {}).get("source")}
+            for chunk_id, content, metadata in zip(result["ids"], result["documents"], result["metadatas"])
+        ]
+
+    def clear(self) -> None:
+        if self.vector_store is None and os.path.exists(os.path.join(self.persist_dir, "chroma.sqlite3")):
+            self._ensure_vector_store()
+        if self.vector_store is not None:
+            # Suppression via le client (la base reste ouverte par Chroma, on ne supprime pas le dossier)
+            self.vector_store.delete_collection()
+        self.vector_store = None
+
+    def persist(self) -> None:
+        if self.vector_store is not None:
+            self.vector_store.persist()
+
+
+class IVFIndex:
+    """
+    Index IVF (inverted file) : les vecteurs sont répartis entre `nlist` centroïdes
+    (k-means) et seule une partie des listes (`nprobe`) est parcourue à la recherche.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, indexed_rows: int):
+        self.centroids = centroids
+        self.order = order          # lignes triées par liste
+        self.offsets = offsets      # début de chaque liste dans `order` (taille nlist + 1)
+        self.indexed_rows = indexed_rows
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, alive: np.ndarray, nlist: int, iterations: int = 10,
+              sample_size: int = 50000, seed: int = 0) -> "IVFIndex":
+        rows = np.flatnonzero(alive)
+        rng = np.random.default_rng(seed)
+        sample = rows if len(rows) <= sample_size else rng.choice(rows, sample_size, replace=False)
+        data = np.asarray(matrix[np.sort(sample)])
+        nlist = max(1, min(nlist, len(data)))
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assignments == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    centroids[c] = centroid / norm if norm else centroid
+
+        # Affectation de toutes les lignes vivantes, par blocs pour limiter la mémoire
+        assignments = np.empty(len(rows), dtype=np.int32)
+        for start in range(0, len(rows), 65536):
+            block = np.asarray(matrix[rows[start:start + 65536]])
+            assignments[start:start + 65536] = np.argmax(block @ centroids.T, axis=1)
+        sort = np.argsort(assignments, kind="stable")
+        order = rows[sort].astype(np.int64)
+        offsets = np.searchsorted(assignments[sort], np.arange(nlist + 1)).astype(np.int64)
+        return cls(centroids.astype(np.float32), order, offsets, len(matrix))
+
+    def candidates(self, query: np.ndarray, nprobe: int, total_rows: int) -> np.ndarray:
+        nprobe = min(nprobe, len(self.centroids))
+        lists = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        parts = [self.order[self.offsets[c]:self.offsets[c + 1]] for c in lists]
+        # Les lignes ajoutées après la construction de l'index sont parcourues exhaustivement
+        if total_rows > self.indexed_rows:
+            parts.append(np.arange(self.indexed_rows, total_rows, dtype=np.int64))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def save(self, path: str) -> None:
+        np.savez(path, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                 indexed_rows=np.array([self.indexed_rows]))
+
+    @classmethod
+    def load(cls, path: str) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["order"], data["offsets"], int(data["indexed_rows"][0]))
+
+
+class _Snapshot(NamedTuple):
+    """État immuable lu par les recherches, remplacé d'un bloc lorsque la génération change"""
+    generation: int
+    matrix: Optional[np.ndarray]
+    alive: np.ndarray
+    ivf: Optional[IVFIndex]
+
+
+class NumpyBackend(VectorBackend):
+    """
+    Vecteurs normalisés stockés dans un fichier float32 contigu (ajout en fin de fichier),
+    lus par np.memmap : les workers d'une même machine partagent les pages via le cache
+    du système au lieu de garder chacun une copie de l'index. Les textes et métadonnées
+    sont dans une base SQLite ; les suppressions sont des marqueurs, compactés au besoin.
+
+    Les recherches ne prennent pas le verrou des écritures : chacune lit, dans une
+    transaction SQLite, un instantané (memmap, lignes vivantes, index IVF) associé à la
+    génération courante. Le compactage et l'index IVF sont écrits dans de nouveaux
+    fichiers, référencés dans la base lors du commit : un instantané reste cohérent
+    même pendant une reconstruction.
+
+    Les écritures de tous les workers partageant le dossier sont sérialisées par une
+    transaction BEGIN IMMEDIATE, prise avant de lire le nombre de lignes du fichier et
+    gardée jusqu'après l'ajout des vecteurs et l'insertion des lignes.
+    """
+
+    DEFAULT_VECTORS_FILE = "vectors.f32"
+    LEGACY_IVF_FILE = "ivf.npz"
+    WRITE_LOCK_TIMEOUT = 60  # secondes d'attente du verrou d'écriture tenu par un autre worker
+
+    def __init__(self, persist_dir: str, ivf_min_rows: int = 100000, ivf_nprobe: int = 16,
+                 compact_ratio: float = 0.3):
+        """
+        Args:
+            persist_dir: Dossier contenant le fichier de vecteurs, chunks.sqlite3 et l'index IVF
+            ivf_min_rows: Nombre de chunks à partir duquel l'index IVF est construit (0 = jamais)
+            ivf_nprobe: Nombre de listes IVF parcourues par recherche
+            compact_ratio: Proportion de lignes supprimées déclenchant un compactage
+        """
+        self.persist_dir = persist_dir
+        self.ivf_min_rows = ivf_min_rows
+        self.ivf_nprobe = ivf_nprobe
+        self.compact_ratio = compact_ratio
+        os.makedirs(persist_dir, exist_ok=True)
+        self.db_path = os.path.join(persist_dir, "chunks.sqlite3")
+
+        # Verrou des écritures de ce worker (les recherches ne le prennent pas) ; entre
+        # workers, les écritures sont sérialisées par le verrou SQLite (BEGIN IMMEDIATE)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.WRITE_LOCK_TIMEOUT)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " row INTEGER PRIMARY KEY,"
+            " id TEXT NOT NULL,"
+            " source TEXT,"
+            " content TEXT NOT NULL,"
+            " metadata TEXT,"
+            " deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_id ON chunks(id, deleted)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks(source, deleted)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        # Instantané partagé par les recherches, rechargé lorsque la génération change
+        # (écriture par ce worker ou un autre)
+        self._snapshot: Optional[_Snapshot] = None
+        self._snapshot_lock = threading.Lock()
+        # Une connexion de lecture par thread (lectures concurrentes en mode WAL)
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    # ---- Métadonnées ----
+
+    @staticmethod
+    def _get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _bump_generation(self) -> None:
+        self._set_meta("generation", int(self._get_meta(self._conn, "generation") or 0) + 1)
+
+    def _dim(self, conn: sqlite3.Connection) -> Optional[int]:
+        value = self._get_meta(conn, "dim")
+        return int(value) if value else None
+
+    def _vectors_path(self, conn: sqlite3.Connection) -> str:
+        return os.path.join(self.persist_dir, self._get_meta(conn, "vectors_file") or self.DEFAULT_VECTORS_FILE)
+
+    def _ivf_path(self, conn: sqlite3.Connection) -> Optional[str]:
+        name = self._get_meta(conn, "ivf_file")
+        if name:
+            return os.path.join(self.persist_dir, name)
+        legacy = os.path.join(self.persist_dir, self.LEGACY_IVF_FILE)
+        return legacy if os.path.exists(legacy) else None
+
+    def _row_count(self, conn: sqlite3.Connection) -> int:
+        dim = self._dim(conn)
+        path = self._vectors_path(conn)
+        if not dim or not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // (4 * dim)
+
+    @staticmethod
+    def _remove_files(*paths: Optional[str]) -> None:
+        for path in paths:
+            if path and os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logging.warning(f"Unable to remove {path}: {str(e)}")
+
+    @contextmanager
+    def _write_transaction(self) -> Iterator[List[Optional[str]]]:
+        """
+        Transaction d'écriture exclusive, y compris entre processus. Renvoie une liste
+        de fichiers devenus obsolètes, supprimés seulement après le commit.
+        """
+        obsolete: List[Optional[str]] = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield obsolete
+            except BaseException:
+                self._conn.rollback()
+                raise
+            self._conn.commit()
+        self._remove_files(*obsolete)
+
+    # ---- Lecture ----
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Mode autocommit : les transactions de lecture sont ouvertes explicitement
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def _read_transaction(self) -> Iterator[sqlite3.Connection]:
+        """Vue cohérente de la base (métadonnées, lignes, contenus) le temps d'une recherche"""
+        conn = self._reader()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    def _load_snapshot(self, conn: sqlite3.Connection) -> _Snapshot:
+        generation = int(self._get_meta(conn, "generation") or 0)
+        rows = self._row_count(conn)
+        matrix = None
+        if rows:
+            matrix = np.memmap(self._vectors_path(conn), dtype=np.float32, mode="r", shape=(rows, self._dim(conn)))
+        alive = np.zeros(rows, dtype=bool)
+        alive_rows = [r for (r,) in conn.execute("SELECT row FROM chunks WHERE deleted = 0 AND row < ?", (rows,))]
+        alive[alive_rows] = True
+        ivf = None
+        ivf_path = self._ivf_path(conn)
+        if ivf_path is not None:
+            try:
+                ivf = IVFIndex.load(ivf_path)
+            except OSError:
+                # Index remplacé entre-temps : recherche exhaustive pour cet instantané
+                ivf = None
+        if ivf is not None and ivf.indexed_rows > rows:
+            ivf = None
+        return _Snapshot(generation, matrix, alive, ivf)
+
+    def _snapshot_for(self, conn: sqlite3.Connection) -> _Snapshot:
+        """Instantané correspondant à la génération vue par la transaction en cours"""
+        generation = int(self._get_meta(conn, "generation") or 0)
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.generation == generation:
+            return snapshot
+        with self._snapshot_lock:
+            snapshot = self._snapshot
+            if snapshot is not None and snapshot.generation == generation:
+                return snapshot
+            snapshot = self._load_snapshot(conn)
+            # Remplacement atomique (affectation), jamais par un état plus ancien
+            if self._snapshot is None or snapshot.generation > self._snapshot.generation:
+                self._snapshot = snapshot
+            return snapshot
+
+    # ---- Interface VectorBackend ----
+
+    def is_empty(self) -> bool:
+        return self._reader().execute("SELECT 1 FROM chunks WHERE deleted = 0 LIMIT 1").fetchone() is None
+
+    def ids_for_source(self, source: str) -> Set[str]:
+        return {r for (r,) in self._reader().execute(
+            "SELECT id FROM chunks WHERE source = ? AND deleted = 0", (source,)
+        )}
+
+    def _mark_deleted(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            self._conn.execute(
+                f"UPDATE chunks SET deleted = 1 WHERE deleted = 0 AND id IN ({placeholders})", batch
+            )
+
+    def upsert(self, ids, embeddings, texts, metadatas) -> None:
+        if not ids:
+            return
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1, norms)
+        with self._write_transaction():
+            dim = self._dim(self._conn)
+            if dim is None:
+                self._set_meta("dim", vectors.shape[1])
+            elif dim != vectors.shape[1]:
+                raise ValueError(f"Dimension d'embedding {vectors.shape[1]} incompatible avec l'index ({dim})")
+            first_row = self._row_count(self._conn)
+            self._mark_deleted(list(ids))
+            with open(self._vectors_path(self._conn), "ab") as f:
+                # Lignes partielles ou non référencées laissées par une écriture interrompue
+                f.truncate(first_row * 4 * vectors.shape[1])
+                f.write(np.ascontiguousarray(vectors).tobytes())
+            self._conn.executemany(
+                "INSERT INTO chunks (row, id, source, content, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (first_row + i, chunk_id, (metadata or {}).get("source"), text, json.dumps(metadata or {}))
+                    for i, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas))
+                ]
+            )
+            self._bump_generation()
+
+    def delete(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        with self._write_transaction():
+            self._mark_deleted(list(ids))
+            self._bump_generation()
+
+    @staticmethod
+    def _top_k(snapshot: _Snapshot, query: np.ndarray, rows: Optional[np.ndarray], k: int) -> List[int]:
+        matrix, alive = snapshot.matrix, snapshot.alive
+        if rows is None:
+            scores = matrix @ query
+            scores[~alive] = -np.inf
+            candidates = None
+        else:
+            candidates = np.sort(rows[alive[rows]])
+            if len(candidates) == 0:
+                return []
+            scores = matrix[candidates] @ query
+        k = min(k, int(np.isfinite(scores).sum()))
+        if k <= 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [int(candidates[i]) if candidates is not None else int(i) for i in best]
+
+    def _query_snapshot(self, conn: sqlite3.Connection, snapshot: _Snapshot, query: np.ndarray, k: int,
+                        source: Optional[str]) -> List[Document]:
+        if snapshot.matrix is None:
+            return []
+        if source is not None:
+            rows = np.fromiter(
+                (r for (r,) in conn.execute("SELECT row FROM chunks WHERE source = ? AND deleted = 0", (source,))),
+                dtype=np.int64
+            )
+            rows = rows[rows < len(snapshot.matrix)]
+        elif snapshot.ivf is not None:
+            rows = snapshot.ivf.candidates(query, self.ivf_nprobe, len(snapshot.matrix))
+        else:
+            rows = None
+        best_rows = self._top_k(snapshot, query, rows, k)
+        if not best_rows:
+            return []
+        placeholders = ",".join("?" * len(best_rows))
+        by_row = {
+            row: (chunk_id, content, metadata)
+            for row, chunk_id, content, metadata in conn.execute(
+                f"SELECT row, id, content, metadata FROM chunks WHERE row IN ({placeholders})", best_rows
+            )
+        }
+        return [
+            Document(page_content=by_row[row][1], metadata=json.loads(by_row[row][2] or "{}"), id=by_row[row][0])
+            for row in best_rows if row in by_row
+        ]
+
+    def query(self, embedding, k, source=None) -> List[Document]:
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        for attempt in range(3):
+            try:
+                with self._read_transaction() as conn:
+                    return self._query_snapshot(conn, self._snapshot_for(conn), query, k, source)
+            except FileNotFoundError:
+                # Fichier de vecteurs remplacé (compactage) après le début de la transaction :
+                # nouvelle transaction sur la génération suivante
+                if attempt == 2:
+                    raise
+
+    def list(self, limit, offset, source=None) -> List[Dict[str, Any]]:
+        conn = self._reader()
+        if source:
+            cursor = conn.execute(
+                "SELECT id, content, source FROM chunks WHERE deleted = 0 AND source = ? ORDER BY row LIMIT ? OFFSET ?",
+                (source, limit, offset)
+            )
+        else:
+            cursor = conn.execute(
+                "SELECT id, content, source FROM chunks WHERE deleted = 0 ORDER BY row LIMIT ? OFFSET ?",
+                (limit, offset)
+            )
+        return [{"id": chunk_id, "content": content, "source": src} for chunk_id, content, src in cursor]
+
+    def clear(self) -> None:
+        with self._write_transaction() as obsolete:
+            obsolete.extend([self._vectors_path(self._conn), self._ivf_path(self._conn)])
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM meta WHERE key IN ('dim', 'ivf_file')")
+            # Nouveau fichier : les instantanés existants gardent l'ancien jusqu'à leur remplacement
+            self._set_meta("vectors_file", f"vectors-{uuid.uuid4().hex[:12]}.f32")
+            self._bump_generation()
+
+    def _compact(self, snapshot: _Snapshot, obsolete: List[Optional[str]]) -> None:
+        """Réécrit les vecteurs sans les lignes supprimées, dans un nouveau fichier (transaction d'écriture en cours)"""
+        alive_rows = np.flatnonzero(snapshot.alive)
+        obsolete.extend([self._vectors_path(self._conn), self._ivf_path(self._conn)])
+        vectors_file = f"vectors-{uuid.uuid4().hex[:12]}.f32"
+        with open(os.path.join(self.persist_dir, vectors_file), "wb") as f:
+            for start in range(0, len(alive_rows), 65536):
+                f.write(np.ascontiguousarray(snapshot.matrix[alive_rows[start:start + 65536]]).tobytes())
+        self._conn.execute("DELETE FROM chunks WHERE deleted = 1")
+        self._conn.executemany(
+            "UPDATE chunks SET row = ? WHERE row = ?",
+            [(new_row, int(old_row)) for new_row, old_row in enumerate(alive_rows)]
+        )
+        self._set_meta("vectors_file", vectors_file)
+        self._conn.execute("DELETE FROM meta WHERE key = 'ivf_file'")
+        self._bump_generation()
+        logging.info(f"Vector file compacted: {len(alive_rows)} row(s) kept")
+
+    def persist(self) -> None:
+        """Compacte si nécessaire et (re)construit l'index IVF pour les grands corpus"""
+        with self._write_transaction() as obsolete:
+            snapshot = self._load_snapshot(self._conn)
+            if snapshot.matrix is None:
+                return
+            total = len(snapshot.matrix)
+            alive = int(snapshot.alive.sum())
+            if total and (total - alive) / total > self.compact_ratio:
+                self._compact(snapshot, obsolete)
+                snapshot = self._load_snapshot(self._conn)
+                total = alive
+            vectors_file = self._get_meta(self._conn, "vectors_file")
+        if not self.ivf_min_rows or alive < self.ivf_min_rows:
+            return
+        # Reconstruction lorsque plus de 10 % des lignes ne sont pas couvertes par l'index
+        if snapshot.ivf is not None and total - snapshot.ivf.indexed_rows <= total // 10:
+            return
+
+        # Construction hors transaction (les autres écritures ne l'attendent pas) sur l'instantané :
+        # les ajouts ultérieurs sont couverts par le parcours des lignes non indexées
+        ivf = IVFIndex.build(snapshot.matrix, snapshot.alive, nlist=int(np.sqrt(alive)))
+        ivf_file = f"ivf-{uuid.uuid4().hex[:12]}.npz"
+        ivf_path = os.path.join(self.persist_dir, ivf_file)
+        ivf.save(ivf_path)
+        with self._write_transaction() as obsolete:
+            if self._get_meta(self._conn, "vectors_file") != vectors_file:
+                # Fichier de vecteurs compacté ou vidé entre-temps : les lignes indexées ne correspondent plus
+                obsolete.append(ivf_path)
+                return
+            obsolete.append(self._ivf_path(self._conn))
+            self._set_meta("ivf_file", ivf_file)
+            self._bump_generation()
+        logging.info(f"IVF index built: {len(ivf.centroids)} list(s) over {alive} row(s)")
+
+    def close(self) -> None:
+        with self._lock:
+            self._snapshot = None
+            self._conn.close()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
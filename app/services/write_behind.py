@@ -0,0 +1,155 @@
+# services/write_behind.py
+"""
+File d'écriture différée (write-behind) pour les messages de conversation.
+Les ajouts sont mis en file sans attendre MongoDB, puis regroupés par session (toutes
+sessions confondues) et écrits en un seul lot par la fonction d'écriture fournie.
+Un lot en échec est réessayé avec un délai croissant (la fonction d'écriture doit être
+idempotente), puis placé dans une file de lettres mortes d'où il peut être remis en file.
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+
+class MongoWriteBehindQueue:
+    def __init__(self,
+                 flush: Callable[[Dict[str, List[Dict]]], Awaitable[None]],
+                 batch_size: int = 100,
+                 flush_interval: float = 0.05,
+                 max_pending: int = 10000,
+                 max_retries: int = 3,
+                 retry_backoff: float = 0.5,
+                 dead_letter_max: int = 1000):
+        """
+        Args:
+            flush: Fonction (idempotente) écrivant un lot de messages regroupés par session
+            batch_size: Nombre maximal d'ajouts regroupés dans un même lot
+            flush_interval: Temps d'attente maximal (secondes) pour compléter un lot
+            max_pending: Taille maximale de la file (au-delà, les producteurs attendent)
+            max_retries: Nombre de nouvelles tentatives d'un lot en échec
+            retry_backoff: Délai (secondes) avant la première nouvelle tentative, doublé ensuite
+            dead_letter_max: Nombre maximal de lots conservés en lettres mortes
+        """
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._queue: "asyncio.Queue[Tuple[str, List[Dict]]]" = asyncio.Queue(maxsize=max_pending)
+        self._worker: Optional[asyncio.Task] = None
+        # Lots abandonnés après toutes les tentatives (les plus anciens sont perdus au-delà du maximum)
+        self._dead_letters: Deque[Dict[str, List[Dict]]] = deque(maxlen=dead_letter_max)
+
+        self.enqueued = 0
+        self.flushed_batches = 0
+        self.failed_batches = 0
+        self.retries = 0
+        self.dead_lettered_messages = 0
+
+    async def put(self, session_id: str, messages: List[Dict]) -> None:
+        """Met en file des messages à ajouter à une conversation"""
+        await self._queue.put((session_id, messages))
+        self.enqueued += 1
+
+    async def _next_batch(self) -> List[Tuple[str, List[Dict]]]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush(self, batch: List[Tuple[str, List[Dict]]]) -> None:
+        # Regroupement par session en conservant l'ordre d'arrivée des messages
+        grouped: Dict[str, List[Dict]] = {}
+        for session_id, messages in batch:
+            grouped.setdefault(session_id, []).extend(messages)
+        try:
+            # Le worker attend pendant les nouvelles tentatives : les lots suivants restent
+            # en file, ce qui préserve l'ordre des messages et fait pression sur les producteurs
+            for attempt in range(self.max_retries + 1):
+                try:
+                    await self.flush(grouped)
+                    self.flushed_batches += 1
+                    return
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        self._dead_letter(grouped, e)
+                        return
+                    self.retries += 1
+                    delay = self.retry_backoff * 2 ** attempt
+                    logging.warning(
+                        f"Write-behind flush failed for {len(batch)} append(s), retrying in {delay:.2f}s: {str(e)}"
+                    )
+                    await asyncio.sleep(delay)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _dead_letter(self, grouped: Dict[str, List[Dict]], error: Exception) -> None:
+        count = sum(len(messages) for messages in grouped.values())
+        self.failed_batches += 1
+        self.dead_lettered_messages += count
+        if len(self._dead_letters) == self._dead_letters.maxlen:
+            dropped = self._dead_letters[0]
+            logging.error(
+                f"Write-behind dead letters full, dropping {sum(len(m) for m in dropped.values())} message(s) "
+                f"for session(s) {', '.join(dropped)}"
+            )
+        self._dead_letters.append(grouped)
+        logging.error(
+            f"Write-behind flush failed after {self.max_retries + 1} attempt(s), {count} message(s) "
+            f"dead-lettered for session(s) {', '.join(grouped)}: {str(error)}"
+        )
+
+    async def requeue_dead_letters(self) -> int:
+        """Remet en file les lots en lettres mortes (après rétablissement de MongoDB) et renvoie leur nombre"""
+        requeued = 0
+        while self._dead_letters:
+            grouped = self._dead_letters.popleft()
+            for session_id, messages in grouped.items():
+                await self.put(session_id, messages)
+            requeued += 1
+        return requeued
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            await self._flush(batch)
+
+    def start(self) -> None:
+        """Démarre le worker d'écriture en arrière-plan"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Écrit les ajouts encore en file puis arrête le worker"""
+        if self._worker is None:
+            return
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        if self._dead_letters:
+            logging.error(f"Write-behind stopped with {len(self._dead_letters)} dead-lettered batch(es) not written")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "flushed_batches": self.flushed_batches,
+            "failed_batches": self.failed_batches,
+            "retries": self.retries,
+            "dead_letter_batches": len(self._dead_letters),
+            "dead_lettered_messages": self.dead_lettered_messages,
+        }
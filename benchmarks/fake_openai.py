@@ -0,0 +1,222 @@
+# benchmarks/fake_openai.py
+"""
+Faux serveur compatible OpenAI pour les benchmarks hors ligne.
+Expose /v1/chat/completions (réponse complète, flux SSE, appels d'outils) et
+/v1/embeddings avec une latence réglable, sans clé ni accès réseau.
+
+    python -m benchmarks.fake_openai --port 8100 --chat-latency 0.4 --token-latency 0.01
+
+L'application est ensuite pointée dessus avec OPENAI_BASE_URL=http://127.0.0.1:8100/v1
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+import time
+import uuid
+from typing import Any, Dict, List
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+ANSWER = (
+    "La période d'essai permet à l'employeur d'évaluer les compétences du salarié et au salarié "
+    "d'apprécier si le poste lui convient. Sa durée dépend de la catégorie professionnelle et "
+    "peut être renouvelée une fois si un accord de branche le prévoit."
+)
+
+
+class FakeOpenAIConfig:
+    def __init__(self, chat_latency: float = 0.3, token_latency: float = 0.0, embed_latency: float = 0.05,
+                 jitter: float = 0.1, dimensions: int = 1536, answer_tokens: int = 60):
+        """
+        Args:
+            chat_latency: Délai (secondes) avant le premier token d'une réponse de chat
+            token_latency: Délai (secondes) entre deux tokens générés
+            embed_latency: Délai (secondes) d'une requête d'embeddings
+            jitter: Variation relative aléatoire appliquée à chaque délai (0.1 = ±10 %)
+            dimensions: Dimension des embeddings renvoyés
+            answer_tokens: Nombre de "tokens" (mots) des réponses de chat
+        """
+        self.chat_latency = chat_latency
+        self.token_latency = token_latency
+        self.embed_latency = embed_latency
+        self.jitter = jitter
+        self.dimensions = dimensions
+        self.answer_tokens = answer_tokens
+
+    def delay(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + random.uniform(-self.jitter, self.jitter)))
+
+
+def _answer_words(count: int) -> List[str]:
+    words = ANSWER.split()
+    return [words[i % len(words)] for i in range(count)]
+
+
+def _fake_value(schema: Dict[str, Any]) -> Any:
+    """Valeur plausible pour un schéma JSON (sorties structurées et arguments d'outils)"""
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if kind == "object" or "properties" in schema:
+        return {name: _fake_value(prop) for name, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [_fake_value(schema.get("items", {"type": "string"})) for _ in range(3)]
+    if kind in ("number", "integer"):
+        return 1
+    if kind == "boolean":
+        return True
+    return " ".join(_answer_words(12))
+
+
+def _usage(prompt_tokens: int, completion_tokens: int) -> Dict[str, int]:
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _embedding(text: Any, dimensions: int) -> np.ndarray:
+    """Vecteur déterministe et normalisé dérivé du texte (ou des tokens) reçu"""
+    seed = int.from_bytes(hashlib.sha256(repr(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def create_app(config: FakeOpenAIConfig) -> FastAPI:
+    app = FastAPI(title="Fake OpenAI")
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "gpt-3.5-turbo")
+        prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in body.get("messages", []))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+
+        message: Dict[str, Any] = {"role": "assistant", "content": None}
+        tools = body.get("tools") or []
+        response_format = body.get("response_format") or {}
+        if tools:
+            function = tools[0]["function"]
+            message["tool_calls"] = [{
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {
+                    "name": function["name"],
+                    "arguments": json.dumps(_fake_value(function.get("parameters", {})), ensure_ascii=False)
+                }
+            }]
+            finish_reason = "tool_calls"
+        elif response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"].get("schema", {})
+            message["content"] = json.dumps(_fake_value(schema), ensure_ascii=False)
+            finish_reason = "stop"
+        else:
+            message["content"] = " ".join(_answer_words(config.answer_tokens))
+            finish_reason = "stop"
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.delay(config.chat_latency + config.token_latency * config.answer_tokens))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": _usage(prompt_tokens, config.answer_tokens),
+            })
+
+        async def events():
+            def chunk(delta: Dict[str, Any], finish: Any = None) -> str:
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                }
+                return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+            await asyncio.sleep(config.delay(config.chat_latency))
+            yield chunk({"role": "assistant", "content": ""})
+            if message.get("tool_calls"):
+                call = message["tool_calls"][0]
+                yield chunk({"tool_calls": [{"index": 0, **call}]})
+            else:
+                for i, word in enumerate(message["content"].split(" ")):
+                    if config.token_latency:
+                        await asyncio.sleep(config.delay(config.token_latency))
+                    yield chunk({"content": word if i == 0 else f" {word}"})
+            yield chunk({}, finish_reason)
+            if (body.get("stream_options") or {}).get("include_usage"):
+                usage = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [], "usage": _usage(prompt_tokens, config.answer_tokens)}
+                yield f"data: {json.dumps(usage)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        # Une chaîne, une liste de chaînes, ou des listes de tokens (tiktoken côté client)
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or config.dimensions
+        await asyncio.sleep(config.delay(config.embed_latency))
+
+        data = []
+        for index, item in enumerate(inputs):
+            vector = _embedding(item, dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vector.astype("<f4").tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(len(item) if isinstance(item, list) else len(str(item).split()) for item in inputs)
+        return JSONResponse({
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model", "owned_by": "fake"}]}
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Faux serveur compatible OpenAI (chat + embeddings)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--chat-latency", type=float, default=0.3, help="secondes avant le premier token")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="secondes entre deux tokens")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="secondes par requête d'embeddings")
+    parser.add_argument("--jitter", type=float, default=0.1, help="variation relative des délais")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--answer-tokens", type=int, default=60)
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(
+        chat_latency=args.chat_latency,
+        token_latency=args.token_latency,
+        embed_latency=args.embed_latency,
+        jitter=args.jitter,
+        dimensions=args.dimensions,
+        answer_tokens=args.answer_tokens
+    )
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# benchmarks/load.py
+"""
+Banc de charge de l'API : envoie des requêtes concurrentes sur /chat, /chat/rag,
+/summarize, /documents/index et /history, puis rapporte les latences p50/p95/p99,
+le débit et la mémoire (RSS), et compare le tout à une référence enregistrée.
+
+L'application tourne soit dans ce processus (--target inprocess, MongoDB simulé par
+mongomock-motor ou mongod local), soit sur un serveur déjà lancé (--target http://...).
+Les appels OpenAI sont dirigés vers benchmarks/fake_openai.py.
+
+    python -m benchmarks.fake_openai --port 8100 &
+    python -m benchmarks.load --scenarios chat,rag,history --concurrency 16 --requests 200 \\
+        --baseline benchmarks/baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app")
+
+QUESTIONS = [
+    "Qu'est-ce qu'une période d'essai ?",
+    "Comment calculer les congés payés d'un salarié à temps partiel ?",
+    "Quelles sont les étapes d'un processus de recrutement efficace ?",
+    "Comment préparer un entretien annuel d'évaluation ?",
+    "Quelle est la différence entre une rupture conventionnelle et une démission ?",
+    "Comment mettre en place une politique de télétravail ?",
+    "Quels avantages sociaux proposer pour fidéliser les talents ?",
+    "Comment rédiger une fiche de poste pour un développeur Python ?",
+]
+
+PARAGRAPH = (
+    "Le présent règlement précise les règles applicables en matière de temps de travail, de congés, "
+    "de télétravail et de formation professionnelle. Chaque salarié bénéficie d'un entretien "
+    "professionnel tous les deux ans, distinct de l'entretien annuel d'évaluation. Les demandes de "
+    "congés sont adressées au responsable hiérarchique au moins un mois à l'avance. "
+)
+
+Request = Tuple[str, str, Optional[Dict[str, Any]]]
+
+
+class BenchContext:
+    def __init__(self, sessions: List[str], use_cache: bool, summary_pages: int, summary_mode: str):
+        self.sessions = sessions
+        self.use_cache = use_cache
+        self.summary_text = PARAGRAPH * 8 * summary_pages
+        self.summary_mode = summary_mode
+        self.run_id = uuid.uuid4().hex[:8]
+
+    def session(self, i: int) -> str:
+        return self.sessions[i % len(self.sessions)]
+
+    def question(self, i: int) -> str:
+        # Suffixe unique sauf si l'on mesure le cache de réponses
+        question = QUESTIONS[i % len(QUESTIONS)]
+        return question if self.use_cache else f"{question} (requête {self.run_id}-{i})"
+
+    def document(self, i: int) -> str:
+        return f"Document {self.run_id}-{i}.\n\n" + PARAGRAPH * 10
+
+
+SCENARIOS: Dict[str, Callable[[BenchContext, int], Request]] = {
+    "chat": lambda ctx, i: ("POST", "/chat/chat", {
+        "message": ctx.question(i), "session_id": ctx.session(i), "use_cache": ctx.use_cache
+    }),
+    "rag": lambda ctx, i: ("POST", "/chat/chat/rag", {
+        "message": ctx.question(i), "session_id": ctx.session(i), "use_cache": ctx.use_cache
+    }),
+    "summarize": lambda ctx, i: ("POST", "/chat/summarize", {
+        "text": ctx.summary_text, "max_length": 800, "mode": ctx.summary_mode
+    }),
+    "index": lambda ctx, i: ("POST", "/chat/documents/index", {
+        "files": [f"bench_{ctx.run_id}_{i}.txt,{ctx.document(i)}"], "clear_existing": False
+    }),
+    "history": lambda ctx, i: ("GET", f"/chat/history/{ctx.session(i)}?limit=50", None),
+}
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Percentile par rang le plus proche"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """RSS courant (Mo) lu dans /proc ; None si indisponible"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+async def run_scenario(client: httpx.AsyncClient, name: str, ctx: BenchContext,
+                       requests: int, concurrency: int) -> Dict[str, Any]:
+    """Boucle fermée : `concurrency` clients enchaînent les requêtes jusqu'à en avoir envoyé `requests`"""
+    build = SCENARIOS[name]
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = iter(range(requests))
+
+    async def worker() -> None:
+        for i in counter:
+            method, path, body = build(ctx, i)
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                if response.status_code >= 400:
+                    key = str(response.status_code)
+                    errors[key] = errors.get(key, 0) + 1
+                    continue
+            except Exception as e:
+                key = e.__class__.__name__
+                errors[key] = errors.get(key, 0) + 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(errors.values()),
+        "error_types": errors,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "elapsed_s": elapsed,
+    }
+
+
+async def prepare(client: httpx.AsyncClient, ctx: BenchContext, sessions: int, corpus_docs: int,
+                  scenarios: List[str]) -> None:
+    """Crée les sessions et, pour les scénarios RAG, indexe un corpus de départ"""
+    for _ in range(sessions):
+        response = await client.post("/chat/chat/new-session")
+        response.raise_for_status()
+        ctx.sessions.append(response.json()["session_id"])
+    if "rag" in scenarios and corpus_docs:
+        files = [f"corpus_{ctx.run_id}_{i}.txt,{ctx.document(i)}" for i in range(corpus_docs)]
+        response = await client.post("/chat/documents/index", json={"files": files, "clear_existing": False})
+        response.raise_for_status()
+    if "history" in scenarios and "chat" not in scenarios and "rag" not in scenarios:
+        # Historique à relire : quelques tours par session
+        for i in range(sessions * 4):
+            await client.post("/chat/chat", json={"message": ctx.question(i), "session_id": ctx.session(i)})
+
+
+def load_inprocess_app(args: argparse.Namespace):
+    """Importe l'application dans ce processus, isolée dans un répertoire de travail temporaire"""
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["OPENAI_BASE_URL"] = args.openai_base_url
+    os.environ["MONGODB_URI"] = args.mongodb_uri
+    os.environ["DATABASE_NAME"] = f"chatbot_bench_{uuid.uuid4().hex[:8]}"
+    if args.mongo == "mock":
+        try:
+            import mongomock_motor
+        except ImportError:
+            sys.exit("mongomock-motor n'est pas installé (pip install mongomock-motor) ; utilisez sinon --mongo local")
+        import motor.motor_asyncio
+        motor.motor_asyncio.AsyncIOMotorClient = mongomock_motor.AsyncMongoMockClient
+
+    # Vector store, caches et téléversements dans un répertoire jetable
+    os.chdir(tempfile.mkdtemp(prefix="chatbot-bench-"))
+    sys.path.insert(0, APP_DIR)
+    from main import app
+    return app
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit(f"Scénario(s) inconnu(s) : {', '.join(unknown)} (disponibles : {', '.join(SCENARIOS)})")
+
+    ctx = BenchContext([], args.use_cache, args.summary_pages, args.summary_mode)
+    timeout = httpx.Timeout(args.timeout)
+    report: Dict[str, Any] = {"target": args.target, "scenarios": {}}
+
+    async def execute(client: httpx.AsyncClient, pid: Optional[int]) -> None:
+        await prepare(client, ctx, args.sessions, args.corpus_docs, scenarios)
+        for name in scenarios:
+            if args.warmup:
+                await run_scenario(client, name, ctx, args.warmup, min(args.concurrency, args.warmup))
+            result = await run_scenario(client, name, ctx, args.requests, args.concurrency)
+            result["rss_mb"] = rss_mb(pid)
+            report["scenarios"][name] = result
+            print_result(name, result)
+
+    if args.target == "inprocess":
+        app = load_inprocess_app(args)
+        transport = httpx.ASGITransport(app=app)
+        async with app.router.lifespan_context(app):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=timeout) as client:
+                await execute(client, None)
+        # ru_maxrss est en kilo-octets sous Linux
+        report["rss_peak_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    else:
+        async with httpx.AsyncClient(base_url=args.target, timeout=timeout) as client:
+            await execute(client, args.pid)
+    report["rss_mb"] = rss_mb(args.pid if args.target != "inprocess" else None)
+    return report
+
+
+def print_result(name: str, result: Dict[str, Any]) -> None:
+    rss = f"{result['rss_mb']:.0f} Mo" if result.get("rss_mb") is not None else "n/a"
+    print(
+        f"{name:<10} p50={result['p50_ms']:8.1f} ms  p95={result['p95_ms']:8.1f} ms  "
+        f"p99={result['p99_ms']:8.1f} ms  {result['throughput_rps']:7.1f} req/s  "
+        f"erreurs={result['errors']}  rss={rss}"
+    )
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Régressions par rapport à la référence (latence p95/p99, débit, mémoire)"""
+    regressions = []
+    for name, result in report["scenarios"].items():
+        reference = baseline.get("scenarios", {}).get(name)
+        if reference is None:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if reference[metric] and result[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{name}.{metric}: {result[metric]:.1f} > {reference[metric]:.1f}")
+        if reference["throughput_rps"] and result["throughput_rps"] < reference["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}.throughput_rps: {result['throughput_rps']:.1f} < {reference['throughput_rps']:.1f}"
+            )
+        if result["errors"] > reference.get("errors", 0):
+            regressions.append(f"{name}.errors: {result['errors']} > {reference.get('errors', 0)}")
+    peak, reference_peak = report.get("rss_peak_mb"), baseline.get("rss_peak_mb")
+    if peak and reference_peak and peak > reference_peak * (1 + tolerance):
+        regressions.append(f"rss_peak_mb: {peak:.0f} > {reference_peak:.0f}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Banc de charge de l'agent conversationnel")
+    parser.add_argument("--target", default="inprocess", help="'inprocess' ou URL d'un serveur lancé")
+    parser.add_argument("--scenarios", default="chat,rag,summarize,index,history")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="requêtes par scénario")
+    parser.add_argument("--warmup", type=int, default=5, help="requêtes de chauffe par scénario (non mesurées)")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--corpus-docs", type=int, default=20, help="documents indexés avant le scénario rag")
+    parser.add_argument("--summary-pages", type=int, default=2, help="taille du texte résumé (pages)")
+    parser.add_argument("--summary-mode", default="standard", choices=["standard", "fast"])
+    parser.add_argument("--use-cache", action="store_true", help="questions répétées et cache de réponses actif")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--openai-base-url", default="http://127.0.0.1:8100/v1")
+    parser.add_argument("--mongo", default="mock", choices=["mock", "local"], help="(inprocess) MongoDB simulé ou local")
+    parser.add_argument("--mongodb-uri", default="mongodb://127.0.0.1:27017")
+    parser.add_argument("--pid", type=int, help="(serveur distant local) PID dont la RSS est mesurée")
+    parser.add_argument("--output", help="fichier JSON où écrire le rapport")
+    parser.add_argument("--baseline", help="rapport de référence à comparer")
+    parser.add_argument("--save-baseline", action="store_true", help="enregistre le rapport comme référence")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="écart relatif toléré avant régression")
+    args = parser.parse_args()
+
+    # Chemins relatifs à résoudre avant un éventuel changement de répertoire (mode inprocess)
+    output = os.path.abspath(args.output) if args.output else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    report = asyncio.run(run(args))
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline_path and args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Référence enregistrée dans {baseline_path}")
+    elif baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("Régressions détectées :")
+            for regression in regressions:
+                print(f"  - {regression}")
+            sys.exit(1)
+        print(f"Aucune régression au-delà de {args.tolerance:.0%} par rapport à la référence.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+# Les modules de l'application s'importent depuis app/ (ex. `from services.rag_service import ...`)
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app"))
+
+# Settings() est instancié à l'import de core.config : les variables obligatoires doivent
+# exister avant la collecte des tests. Aucune connexion n'est ouverte par les tests.
+TEST_ENVIRONMENT = {
+    "MONGODB_URI": "mongodb://localhost:27017/test",
+    "OPENAI_API_KEY": "test",
+    "HEROKU_ENV": "production",  # pas de chargement du fichier .env local
+}
+for _name, _value in TEST_ENVIRONMENT.items():
+    os.environ.setdefault(_name, _value)
+
+
+class FakeTokenCounter:
+    """Compteur de tokens sans tiktoken (aucun téléchargement d'encodage)"""
+
+    def count(self, text: str) -> int:
+        return len(text) // 4 + 1
+
+
+@pytest.fixture(autouse=True)
+def test_environment(monkeypatch):
+    for name, value in TEST_ENVIRONMENT.items():
+        monkeypatch.setenv(name, value)
+
+
+@pytest.fixture
+def token_counter() -> FakeTokenCounter:
+    return FakeTokenCounter()
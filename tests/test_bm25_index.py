@@ -0,0 +1,141 @@
+"""
+Index BM25 (SQLite FTS5) partagé entre workers et fusion des classements par
+Reciprocal Rank Fusion.
+"""
+import asyncio
+import threading
+
+import pytest
+
+from services import rag_service as rag_module
+from services.bm25_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    yield index
+    index.close()
+
+
+def test_tokenize_keeps_technical_terms_and_folds_accents():
+    assert tokenize("Développeur C++ / C#, Node.js et ISO-27001") == [
+        "developpeur", "c++", "c#", "node.js", "et", "iso-27001"
+    ]
+
+
+def test_search_ranks_exact_terms(index):
+    index.add_many([
+        ("java", "Développeur Java avec Spring", {"source": "a.pdf"}),
+        ("cpp", "Développeur C++ embarqué, C++17 et Qt", {"source": "b.pdf"}),
+        ("node", "Développeur Node.js et React", {"source": "c.pdf"}),
+    ])
+
+    results = index.search("expérience c++")
+
+    assert [doc_id for doc_id, _ in results] == ["cpp"]
+    assert results[0][1] > 0
+    assert index.get("cpp") == ("Développeur C++ embarqué, C++17 et Qt", {"source": "b.pdf"})
+    # Les termes sont cités : un opérateur FTS5 dans la requête n'est pas interprété
+    assert index.search("NOT OR node.js") == [("node", pytest.approx(index.search("node.js")[0][1]))]
+
+
+def test_add_replaces_and_remove_deletes(index):
+    index.add("doc", "ancien texte kubernetes")
+    index.add("doc", "nouveau texte terraform")
+
+    assert len(index) == 1
+    assert index.search("kubernetes") == []
+    assert [doc_id for doc_id, _ in index.search("terraform")] == ["doc"]
+
+    index.remove(["doc"])
+    assert len(index) == 0 and index.search("terraform") == []
+
+
+def test_writes_are_visible_to_another_worker(tmp_path, index):
+    other = BM25Index(str(tmp_path / "bm25.sqlite3"))
+    try:
+        assert other.search("ansible") == []
+        index.add("doc", "automatisation ansible")
+        assert [doc_id for doc_id, _ in other.search("ansible")] == ["doc"]
+        other.clear()
+        assert index.search("ansible") == [] and len(index) == 0
+    finally:
+        other.close()
+
+
+def test_search_does_not_wait_for_an_open_write_transaction(index):
+    index.add("doc", "python fastapi")
+    writing, release = threading.Event(), threading.Event()
+
+    def slow_writer():
+        with index._lock:
+            index._conn.execute("BEGIN IMMEDIATE")
+            index._conn.execute("INSERT INTO chunks (id, content) VALUES ('pending', 'python')")
+            writing.set()
+            release.wait(5)
+            index._conn.commit()
+
+    writer = threading.Thread(target=slow_writer)
+    writer.start()
+    try:
+        assert writing.wait(5)
+        # Lecture de l'état validé, sans attendre le verrou des écritures
+        assert [doc_id for doc_id, _ in index.search("python")] == ["doc"]
+        assert len(index) == 1
+    finally:
+        release.set()
+        writer.join()
+    assert len(index) == 2
+
+
+def test_reciprocal_rank_fusion():
+    fused = reciprocal_rank_fusion([["a", "b", "c"], ["c", "a"]], k=60)
+
+    assert [doc_id for doc_id, _ in fused] == ["a", "c", "b"]
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[2][1] == pytest.approx(1 / 62)
+    assert reciprocal_rank_fusion([]) == []
+
+
+class KeywordEmbeddings:
+    """Embeddings déterministes : une dimension par mot-clé connu"""
+    KEYWORDS = ["python", "java", "cuisine", "jardin"]
+
+    def _embed(self, text: str):
+        words = tokenize(text)
+        return [float(words.count(keyword)) + 0.01 for keyword in self.KEYWORDS]
+
+    async def aembed_query(self, text: str):
+        return self._embed(text)
+
+
+def test_hybrid_search_fuses_on_stored_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag_module.settings, "embedding_cache_enabled", False)
+    monkeypatch.setattr(rag_module.settings, "bm25_enabled", True)
+    monkeypatch.setattr(rag_module.settings, "vector_backend", "numpy")
+    service = rag_module.RAGService(persist_dir=str(tmp_path))
+    try:
+        service.embeddings = KeywordEmbeddings()
+        chunks = [
+            ("chunk-python", "développeur python senior", {"source": "cv.pdf"}),
+            ("chunk-java", "développeur java", {"source": "cv.pdf"}),
+            ("chunk-cuisine", "recette de cuisine", {"source": "notes.txt"}),
+        ]
+        # Identifiants arbitraires : la fusion ne doit pas recalculer chunk_id(source, contenu)
+        service.vector_backend.upsert(
+            [chunk_id for chunk_id, _, _ in chunks],
+            [service.embeddings._embed(text) for _, text, _ in chunks],
+            [text for _, text, _ in chunks],
+            [metadata for _, _, metadata in chunks]
+        )
+        service.bm25_index.add_many(chunks)
+
+        results = asyncio.run(service.hybrid_search("python senior", k=3))
+
+        # Le chunk trouvé par les deux classements arrive en tête, une seule fois
+        ids = [doc.id for doc in results]
+        assert ids[0] == "chunk-python"
+        assert sorted(ids) == ["chunk-cuisine", "chunk-java", "chunk-python"]
+    finally:
+        service.close()
@@ -0,0 +1,145 @@
+"""
+Passerelle LLM : fusion des appels identiques (single-flight), ordre de priorité de la
+limite de concurrence et délais des flux.
+"""
+import asyncio
+from typing import List
+
+import pytest
+
+from services.llm_gateway import (
+    PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, LLMGateway, PriorityLimiter
+)
+
+
+def test_identical_concurrent_calls_share_one_upstream_call():
+    upstream: List[str] = []
+
+    async def call() -> str:
+        upstream.append("call")
+        await asyncio.sleep(0.05)
+        return "réponse"
+
+    async def scenario():
+        gateway = LLMGateway(max_concurrency=2)
+        results = await asyncio.gather(
+            gateway.run("chat", call, key="same"),
+            gateway.run("chat", call, key="same"),
+        )
+        return gateway, results
+
+    gateway, results = asyncio.run(scenario())
+
+    assert results == ["réponse", "réponse"]
+    assert upstream == ["call"]
+    stats = gateway.stats()["calls"]["chat"]
+    assert stats["calls"] == 2 and stats["upstream_calls"] == 1 and stats["coalesced"] == 1
+    assert gateway._in_flight == {}
+
+
+def test_different_keys_are_not_coalesced():
+    upstream: List[str] = []
+
+    async def scenario():
+        gateway = LLMGateway(max_concurrency=2)
+
+        async def call(key: str) -> str:
+            upstream.append(key)
+            return key
+
+        return await asyncio.gather(
+            gateway.run("chat", lambda: call("a"), key="a"),
+            gateway.run("chat", lambda: call("b"), key="b"),
+        )
+
+    assert asyncio.run(scenario()) == ["a", "b"]
+    assert sorted(upstream) == ["a", "b"]
+
+
+def test_cancelled_caller_does_not_cancel_shared_call():
+    async def scenario():
+        gateway = LLMGateway(max_concurrency=1)
+        finished = asyncio.Event()
+
+        async def call() -> str:
+            await asyncio.sleep(0.05)
+            finished.set()
+            return "ok"
+
+        first = asyncio.create_task(gateway.run("chat", call, key="k"))
+        second = asyncio.create_task(gateway.run("chat", call, key="k"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        return await second, finished.is_set()
+
+    assert asyncio.run(scenario()) == ("ok", True)
+
+
+def test_priority_limiter_serves_interactive_calls_first():
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        order: List[str] = []
+        await limiter.acquire(PRIORITY_INTERACTIVE)
+
+        async def waiter(name: str, priority: int) -> None:
+            await limiter.acquire(priority)
+            order.append(name)
+            limiter.release()
+
+        tasks = [
+            asyncio.create_task(waiter("summary-1", PRIORITY_BACKGROUND)),
+            asyncio.create_task(waiter("summary-2", PRIORITY_BACKGROUND)),
+            asyncio.create_task(waiter("chat", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.sleep(0.01)
+        assert limiter.queued == 3
+        limiter.release()
+        await asyncio.gather(*tasks)
+        return order, limiter.in_flight
+
+    order, in_flight = asyncio.run(scenario())
+
+    # Priorité d'abord, puis ordre d'arrivée
+    assert order == ["chat", "summary-1", "summary-2"]
+    assert in_flight == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        limiter = PriorityLimiter(1)
+        await limiter.acquire(PRIORITY_INTERACTIVE)
+        waiter = asyncio.create_task(limiter.acquire(PRIORITY_BACKGROUND))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        return limiter.in_flight, limiter.queued
+
+    assert asyncio.run(scenario()) == (0, 0)
+
+
+async def _chunks(first_delay: float, gap: float, count: int = 3):
+    await asyncio.sleep(first_delay)
+    for i in range(count):
+        yield i
+        await asyncio.sleep(gap)
+
+
+@pytest.mark.parametrize("first_delay, gap, received", [(0.5, 0, []), (0, 0.5, [0])])
+def test_stalled_stream_times_out_and_releases_its_slot(first_delay, gap, received):
+    async def scenario():
+        gateway = LLMGateway(max_concurrency=1, first_token_timeout=0.05, chunk_timeout=0.05)
+        chunks = []
+        with pytest.raises(asyncio.TimeoutError):
+            async for chunk in gateway.stream("chat", lambda: _chunks(first_delay, gap)):
+                chunks.append(chunk)
+        # La place est rendue : un flux suivant passe
+        complete = [chunk async for chunk in gateway.stream("chat", lambda: _chunks(0, 0.01))]
+        return gateway, chunks, complete
+
+    gateway, chunks, complete = asyncio.run(scenario())
+
+    assert chunks == received
+    assert complete == [0, 1, 2]
+    assert gateway.limiter.in_flight == 0
+    assert gateway.stats()["calls"]["chat"]["timeouts"] == 1
@@ -0,0 +1,213 @@
+"""
+Ajout de messages par buckets (MongoService._append_batch) : réservation des positions,
+idempotence des nouvelles tentatives de l'écriture différée, course à la création d'un
+bucket (E11000) et annulation de la réservation d'un lot non écrit.
+Les collections sont remplacées par des fakes en mémoire : aucune connexion n'est ouverte.
+"""
+import asyncio
+from types import SimpleNamespace
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+from services import mongo_service as mongo_module
+from services.mongo_service import MongoService
+
+BUCKET_SIZE = 2
+
+
+class FakeUpdateOne(NamedTuple):
+    filter: Dict
+    update: Dict
+    upsert: bool = False
+
+
+class FakeConversations:
+    def __init__(self):
+        self.docs: Dict[str, Dict] = {}
+
+    async def find_one_and_update(self, query: Dict, update: Dict, **kwargs: Any) -> Dict:
+        doc = self.docs.setdefault(query["session_id"], {"session_id": query["session_id"], "message_count": 0})
+        doc["message_count"] += update["$inc"]["message_count"]
+        return dict(doc)
+
+    async def update_one(self, query: Dict, update: Dict) -> SimpleNamespace:
+        doc = self.docs.get(query["session_id"])
+        if doc is None or doc["message_count"] != query["message_count"]:
+            return SimpleNamespace(matched_count=0, modified_count=0)
+        doc["message_count"] += update["$inc"]["message_count"]
+        return SimpleNamespace(matched_count=1, modified_count=1)
+
+
+class FakeBuckets:
+    """Collection de buckets avec index unique (session_id, bucket_no) et pannes injectables"""
+
+    def __init__(self):
+        self.docs: List[Dict] = []
+        # Exception levée par le prochain bulk_write, avant (`fail_before`) ou après l'avoir appliqué
+        self.fail_before: Optional[Exception] = None
+        self.fail_after: Optional[Exception] = None
+        # Indices d'opérations du prochain bulk_write en conflit avec une création concurrente
+        self.race_on: List[int] = []
+
+    def bucket(self, session_id: str, bucket_no: int) -> Optional[Dict]:
+        return next((doc for doc in self.docs if doc["session_id"] == session_id and doc["bucket_no"] == bucket_no), None)
+
+    def _matches(self, doc: Dict, query: Dict) -> bool:
+        positions = [message["position"] for message in doc["messages"]]
+        for key, condition in query.items():
+            if key == "messages.position":
+                if isinstance(condition, dict) and "$ne" in condition:
+                    if condition["$ne"] in positions:
+                        return False
+                elif isinstance(condition, dict) and "$in" in condition:
+                    if not set(condition["$in"]) & set(positions):
+                        return False
+                elif condition not in positions:
+                    return False
+            elif doc.get(key) != condition:
+                return False
+        return True
+
+    def _apply(self, doc: Dict, update: Dict) -> None:
+        doc["messages"] = sorted(
+            doc["messages"] + [dict(message) for message in update["$push"]["messages"]["$each"]],
+            key=lambda message: message["position"]
+        )
+        doc["count"] = doc.get("count", 0) + update["$inc"]["count"]
+
+    def _update(self, query: Dict, update: Dict, upsert: bool) -> int:
+        doc = next((doc for doc in self.docs if self._matches(doc, query)), None)
+        if doc is not None:
+            self._apply(doc, update)
+            return 1
+        if upsert:
+            if self.bucket(query["session_id"], query["bucket_no"]) is not None:
+                raise KeyError("E11000 duplicate key")
+            doc = {"session_id": query["session_id"], "bucket_no": query["bucket_no"], "messages": []}
+            self._apply(doc, update)
+            self.docs.append(doc)
+        return 0
+
+    async def bulk_write(self, requests: List[FakeUpdateOne], ordered: bool = True) -> None:
+        if self.fail_before is not None:
+            error, self.fail_before = self.fail_before, None
+            raise error
+        race_on, self.race_on = self.race_on, []
+        write_errors = []
+        for index, request in enumerate(requests):
+            if index in race_on:
+                write_errors.append({"index": index, "code": 11000})
+                continue
+            try:
+                self._update(request.filter, request.update, request.upsert)
+            except KeyError:
+                write_errors.append({"index": index, "code": 11000})
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors, "writeConcernErrors": []})
+        if self.fail_after is not None:
+            error, self.fail_after = self.fail_after, None
+            raise error
+
+    async def update_one(self, query: Dict, update: Dict) -> SimpleNamespace:
+        return SimpleNamespace(matched_count=self._update(query, update, upsert=False))
+
+    async def find_one(self, query: Dict, projection: Optional[Dict] = None) -> Optional[Dict]:
+        return next((doc for doc in self.docs if self._matches(doc, query)), None)
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(mongo_module, "UpdateOne", FakeUpdateOne)
+    monkeypatch.setattr(mongo_module.settings, "mongo_write_behind", False)
+    service = MongoService()
+    service.conversations = FakeConversations()
+    service.buckets = FakeBuckets()
+    service.bucket_size = BUCKET_SIZE
+    yield service
+    service.close()
+
+
+def _docs(*contents: str) -> List[Dict]:
+    return [{"role": "user", "content": content} for content in contents]
+
+
+def _stored(service: MongoService, session_id: str) -> Dict[int, List[str]]:
+    return {
+        doc["bucket_no"]: [message["content"] for message in doc["messages"]]
+        for doc in sorted(service.buckets.docs, key=lambda doc: doc["bucket_no"])
+        if doc["session_id"] == session_id
+    }
+
+
+def test_messages_are_spread_over_buckets_by_reserved_position(service):
+    async def scenario():
+        await service._append_batch({"s1": _docs("a", "b", "c"), "s2": _docs("x")})
+        await service._append_batch({"s1": _docs("d", "e")})
+
+    asyncio.run(scenario())
+
+    assert _stored(service, "s1") == {0: ["a", "b"], 1: ["c", "d"], 2: ["e"]}
+    assert _stored(service, "s2") == {0: ["x"]}
+    assert service.conversations.docs["s1"]["message_count"] == 5
+
+
+def test_retry_after_a_partially_acknowledged_write_does_not_duplicate(service):
+    batch = {"s1": _docs("a", "b", "c")}
+    service.buckets.fail_after = ConnectionError("réponse perdue")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await service._append_batch(batch)
+        # Nouvelle tentative de l'écriture différée avec le même lot (positions conservées)
+        await service._append_batch(batch)
+
+    asyncio.run(scenario())
+
+    assert _stored(service, "s1") == {0: ["a", "b"], 1: ["c"]}
+    assert service.conversations.docs["s1"]["message_count"] == 3
+
+
+def test_failed_write_releases_the_reserved_positions(service):
+    batch = {"s1": _docs("a", "b")}
+    service.buckets.fail_before = ConnectionError("MongoDB indisponible")
+
+    async def scenario():
+        with pytest.raises(ConnectionError):
+            await service._append_batch(batch)
+        assert service.conversations.docs["s1"]["message_count"] == 0
+        assert all("position" not in doc for doc in batch["s1"])
+        await service._append_batch(batch)
+
+    asyncio.run(scenario())
+
+    assert _stored(service, "s1") == {0: ["a", "b"]}
+    assert service.conversations.docs["s1"]["message_count"] == 2
+
+
+def test_duplicate_key_on_a_concurrently_created_bucket_pushes_into_it(service):
+    async def scenario():
+        await service._append_batch({"s1": _docs("a")})
+        # L'upsert du lot suivant perd la course à la création du bucket 0
+        service.buckets.race_on = [0]
+        await service._append_batch({"s1": _docs("b")})
+
+    asyncio.run(scenario())
+
+    assert _stored(service, "s1") == {0: ["a", "b"]}
+
+
+def test_duplicate_key_is_not_ignored_when_messages_are_missing(service):
+    batch = {"s1": _docs("a")}
+    service.buckets.race_on = [0]
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await service._append_batch(batch)
+
+    asyncio.run(scenario())
+
+    # Aucun bucket écrit : la réservation est annulée
+    assert _stored(service, "s1") == {}
+    assert service.conversations.docs["s1"]["message_count"] == 0
@@ -0,0 +1,147 @@
+"""
+NumpyBackend : instantanés par génération, compactage dans un nouveau fichier et index IVF,
+avec plusieurs instances (workers) partageant le même dossier.
+"""
+import os
+from typing import List
+
+import numpy as np
+import pytest
+
+from services.vector_backends import NumpyBackend
+
+DIM = 8
+
+
+def _unit(index: int) -> List[float]:
+    vector = [0.0] * DIM
+    vector[index % DIM] = 1.0
+    return vector
+
+
+def _upsert(backend: NumpyBackend, ids: List[str], vectors: List[List[float]], source: str = "doc.txt") -> None:
+    backend.upsert(ids, vectors, [f"texte {chunk_id}" for chunk_id in ids], [{"source": source} for _ in ids])
+
+
+def _meta(backend: NumpyBackend, key: str):
+    return backend._get_meta(backend._conn, key)
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = NumpyBackend(str(tmp_path), ivf_min_rows=0)
+    yield backend
+    backend.close()
+
+
+def test_query_returns_stored_ids_and_replaces_upserted_chunks(backend):
+    _upsert(backend, ["a", "b"], [_unit(0), _unit(1)])
+    _upsert(backend, ["a"], [_unit(2)])
+
+    assert [doc.id for doc in backend.query(_unit(2), k=1)] == ["a"]
+    # L'ancienne version de "a" (la plus proche de _unit(0)) est marquée supprimée
+    assert sorted(doc.id for doc in backend.query(_unit(0), k=10)) == ["a", "b"]
+    assert backend.ids_for_source("doc.txt") == {"a", "b"}
+
+
+def test_source_filter(backend):
+    _upsert(backend, ["a"], [_unit(0)], source="a.txt")
+    _upsert(backend, ["b"], [_unit(0)], source="b.txt")
+
+    docs = backend.query(_unit(0), k=5, source="b.txt")
+
+    assert [doc.id for doc in docs] == ["b"]
+    assert docs[0].metadata == {"source": "b.txt"}
+
+
+def test_snapshot_is_reloaded_when_generation_changes(backend):
+    _upsert(backend, ["a"], [_unit(0)])
+    backend.query(_unit(0), k=1)
+    first = backend._snapshot
+
+    _upsert(backend, ["b"], [_unit(1)])
+    assert [doc.id for doc in backend.query(_unit(1), k=1)] == ["b"]
+    second = backend._snapshot
+
+    assert second.generation > first.generation
+    # L'instantané précédent reste lisible et cohérent (une ligne)
+    assert first.matrix.shape == (1, DIM) and second.matrix.shape == (2, DIM)
+
+
+def test_writes_from_another_worker_are_visible(tmp_path, backend):
+    _upsert(backend, ["a"], [_unit(0)])
+    backend.query(_unit(0), k=1)
+
+    other = NumpyBackend(str(tmp_path), ivf_min_rows=0)
+    try:
+        _upsert(other, ["b"], [_unit(1)])
+        other.delete(["a"])
+    finally:
+        other.close()
+
+    assert [doc.id for doc in backend.query(_unit(0), k=5)] == ["b"]
+
+
+def test_compaction_rewrites_vectors_to_a_new_file(tmp_path):
+    backend = NumpyBackend(str(tmp_path), ivf_min_rows=0, compact_ratio=0.3)
+    try:
+        ids = [f"c{i}" for i in range(10)]
+        _upsert(backend, ids, [_unit(i) for i in range(10)])
+        old_path = backend._vectors_path(backend._conn)
+        backend.query(_unit(0), k=1)
+        before = backend._snapshot
+        backend.delete(ids[:5])
+
+        backend.persist()
+
+        new_path = backend._vectors_path(backend._conn)
+        assert new_path != old_path and not os.path.exists(old_path)
+        assert backend._row_count(backend._conn) == 5
+        assert {doc.id for doc in backend.query(_unit(7), k=10)} == set(ids[5:])
+        assert backend.query(_unit(7), k=1)[0].id == "c7"
+        # Les lignes ont été renumérotées : l'ancien instantané n'est plus celui des recherches
+        assert backend._snapshot.generation > before.generation
+    finally:
+        backend.close()
+
+
+def test_ivf_index_is_built_and_covers_rows_added_afterwards(tmp_path):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(300, DIM)).astype(np.float32)
+    backend = NumpyBackend(str(tmp_path), ivf_min_rows=100, ivf_nprobe=4)
+    try:
+        ids = [f"v{i}" for i in range(len(vectors))]
+        _upsert(backend, ids, vectors.tolist())
+
+        backend.persist()
+
+        ivf_file = _meta(backend, "ivf_file")
+        assert ivf_file and ivf_file.startswith("ivf-")
+        assert os.path.exists(os.path.join(str(tmp_path), ivf_file))
+        for i in (0, 123, 299):
+            assert backend.query(vectors[i].tolist(), k=1)[0].id == ids[i]
+        assert backend._snapshot.ivf is not None
+
+        # Ligne ajoutée après la construction : parcourue exhaustivement
+        extra = rng.normal(size=DIM).astype(np.float32)
+        _upsert(backend, ["extra"], [extra.tolist()])
+        assert backend.query(extra.tolist(), k=1)[0].id == "extra"
+    finally:
+        backend.close()
+
+
+def test_clear_removes_vectors_and_index(tmp_path):
+    backend = NumpyBackend(str(tmp_path), ivf_min_rows=0)
+    try:
+        _upsert(backend, ["a"], [_unit(0)])
+        old_path = backend._vectors_path(backend._conn)
+
+        backend.clear()
+
+        assert backend.is_empty()
+        assert backend.query(_unit(0), k=1) == []
+        assert not os.path.exists(old_path)
+        _upsert(backend, ["b"], [_unit(1)])
+        assert [doc.id for doc in backend.query(_unit(1), k=1)] == ["b"]
+    finally:
+        backend.close()
@@ -0,0 +1,122 @@
+"""
+Une grosse indexation ne doit pas dégrader la latence des recherches des chats :
+les écritures bloquantes s'exécutent dans le pool d'indexation, les recherches dans
+le pool de requêtes, et la boucle d'événements reste libre.
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from services import rag_service as rag_module
+from services.vector_backends import VectorBackend
+
+INDEX_BLOCK_SECONDS = 1.0  # durée d'une écriture bloquante dans le vector store
+QUERY_SECONDS = 0.01
+CONCURRENT_QUERIES = 8
+
+
+class FakeEmbeddings(Embeddings):
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+class BlockingBackend(VectorBackend):
+    """Backend en mémoire dont les écritures bloquent le thread appelant"""
+
+    def __init__(self):
+        self.chunks: Dict[str, Dict[str, Any]] = {"seed": {"content": "période d'essai", "source": "seed"}}
+        self.write_threads: List[str] = []
+        self.writing = threading.Event()
+
+    def is_empty(self) -> bool:
+        return not self.chunks
+
+    def ids_for_source(self, source: str) -> Set[str]:
+        return {chunk_id for chunk_id, chunk in self.chunks.items() if chunk["source"] == source}
+
+    def upsert(self, ids, embeddings, texts, metadatas) -> None:
+        self.write_threads.append(threading.current_thread().name)
+        self.writing.set()
+        time.sleep(INDEX_BLOCK_SECONDS)
+        for chunk_id, text, metadata in zip(ids, texts, metadatas):
+            self.chunks[chunk_id] = {"content": text, "source": metadata["source"]}
+
+    def delete(self, ids) -> None:
+        for chunk_id in ids:
+            self.chunks.pop(chunk_id, None)
+
+    def query(self, embedding, k, source: Optional[str] = None) -> List[Document]:
+        time.sleep(QUERY_SECONDS)
+        return [
+            Document(page_content=chunk["content"], metadata={"source": chunk["source"]})
+            for chunk in list(self.chunks.values())[:k]
+        ]
+
+    def list(self, limit, offset, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        chunks = [{"id": chunk_id, **chunk} for chunk_id, chunk in self.chunks.items()]
+        return chunks[offset:offset + limit]
+
+    def clear(self) -> None:
+        self.chunks.clear()
+
+
+@pytest.fixture
+def rag_service(tmp_path, monkeypatch, token_counter):
+    monkeypatch.setattr(rag_module.settings, "embedding_cache_enabled", False)
+    monkeypatch.setattr(rag_module.settings, "bm25_enabled", False)
+    monkeypatch.setattr(rag_module.settings, "vector_backend", "numpy")
+    service = rag_module.RAGService(persist_dir=str(tmp_path))
+    service.embeddings = FakeEmbeddings()
+    service.embedding_pipeline.embeddings = service.embeddings
+    service.embedding_pipeline.counter = token_counter
+    service.vector_backend = BlockingBackend()
+    yield service
+    service.close()
+
+
+async def _timed_searches(service) -> List[float]:
+    async def timed() -> float:
+        started = time.perf_counter()
+        await service.similarity_search("durée de la période d'essai", k=4)
+        return time.perf_counter() - started
+
+    return await asyncio.gather(*[timed() for _ in range(CONCURRENT_QUERIES)])
+
+
+def test_search_latency_stays_flat_during_large_index_job(rag_service):
+    document = "\n\n".join(f"Article {i} : la période d'essai est renouvelable une fois." for i in range(2000))
+
+    async def scenario():
+        idle = await _timed_searches(rag_service)
+
+        index_job = asyncio.create_task(rag_service.load_and_index_texts([document], sources=["convention.txt"]))
+        # Les recherches sont lancées pendant l'écriture bloquante de l'indexation
+        while not rag_service.vector_backend.writing.is_set():
+            await asyncio.sleep(0.005)
+        under_load = await _timed_searches(rag_service)
+        still_indexing = not index_job.done()
+        totals = await index_job
+        return idle, under_load, still_indexing, totals
+
+    idle, under_load, still_indexing, totals = asyncio.run(scenario())
+
+    assert still_indexing, "l'indexation aurait dû être encore en cours pendant les recherches"
+    assert totals["added"] > 0
+    assert all(name.startswith("rag-index") for name in rag_service.vector_backend.write_threads)
+    # Les recherches ne doivent pas attendre la fin de l'écriture (INDEX_BLOCK_SECONDS)
+    assert max(under_load) < INDEX_BLOCK_SECONDS / 4
+    assert max(under_load) < max(idle) + 0.1
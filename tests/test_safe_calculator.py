@@ -0,0 +1,95 @@
+"""
+Calculatrice de l'assistant : seules les expressions arithmétiques bornées sont évaluées,
+et le cache des résultats d'outils est un LRU à expiration.
+"""
+import time
+
+import pytest
+
+from services.tools import SafeCalculator, ToolResultCache
+
+
+@pytest.fixture
+def calculator() -> SafeCalculator:
+    return SafeCalculator()
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("(12.5 * 4) / sqrt(16)", 12.5),
+    ("2 ^ 10", 1024),
+    ("-3 + abs(-2) * max(1, 4)", 5),
+    ("round(pi, 3)", 3.142),
+    ("round(1234.5, -2)", 1200),
+    ("10 ** -3", 0.001),
+    ("(-1) ** 1000001", -1),
+    ("0 ** 1000000", 0),
+])
+def test_evaluates_arithmetic(calculator, expression, expected):
+    assert calculator.evaluate(expression) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("expression", [
+    "2**10**10",          # tour de puissances : rejetée avant le calcul du grand entier
+    "9**9**9",
+    "10 ** 101",
+    "0.5 ** -1000",
+    "1e308 * 10",         # résultat infini
+    "10**50 * 10**51",    # valeur intermédiaire hors bornes
+    "exp(1000)",
+])
+def test_rejects_values_out_of_bounds(calculator, expression):
+    started = time.perf_counter()
+    # Erreurs converties en message par l'outil Calculatrice
+    with pytest.raises((ValueError, ArithmeticError)):
+        calculator.evaluate(expression)
+    assert time.perf_counter() - started < 0.5
+
+
+@pytest.mark.parametrize("expression", [
+    "round(1.5, 10**6)",
+    "round(1.5, -16)",
+    "round(1.5, 2.5)",
+])
+def test_rejects_unbounded_round(calculator, expression):
+    with pytest.raises(ValueError, match="round"):
+        calculator.evaluate(expression)
+
+
+@pytest.mark.parametrize("expression", [
+    "__import__('os').system('id')",
+    "(1).__class__",
+    "open('/etc/passwd')",
+    "sqrt(x=4)",
+    "'a' * 3",
+    "[1, 2]",
+    "(-8) ** 0.5",        # nombre complexe
+    "True + 1",
+    "2 +",
+])
+def test_rejects_non_arithmetic_expressions(calculator, expression):
+    with pytest.raises(ValueError):
+        calculator.evaluate(expression)
+
+
+def test_rejects_long_expressions():
+    with pytest.raises(ValueError, match="trop longue"):
+        SafeCalculator(max_length=10).evaluate("1 + 1 + 1 + 1 + 1")
+
+
+def test_tool_result_cache_is_lru_with_expiry(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ToolResultCache(max_entries=2, ttl=10)
+    first, second, third = (ToolResultCache.key("Calculatrice", {"expression": str(i)}) for i in range(3))
+
+    cache.set(first, "0")
+    cache.set(second, "1")
+    assert cache.get(first) == "0"
+    cache.set(third, "2")
+    # `second` était le moins récemment utilisé
+    assert cache.get(second) is None
+    assert len(cache) == 2
+
+    now[0] = 11
+    assert cache.get(first) is None
+    assert (cache.hits, cache.misses) == (1, 2)
@@ -0,0 +1,108 @@
+"""
+Écriture différée des messages : regroupement par session, nouvelles tentatives,
+lettres mortes et remise en file.
+"""
+import asyncio
+from typing import Dict, List
+
+from services.write_behind import MongoWriteBehindQueue
+
+
+class FlakyFlush:
+    """Fonction d'écriture qui échoue tant que `failures` n'est pas épuisé"""
+
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.calls = 0
+        self.written: List[Dict[str, List[Dict]]] = []
+
+    async def __call__(self, batch: Dict[str, List[Dict]]) -> None:
+        self.calls += 1
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("MongoDB indisponible")
+        self.written.append({session_id: list(messages) for session_id, messages in batch.items()})
+
+
+def _message(content: str) -> Dict:
+    return {"role": "user", "content": content}
+
+
+def test_appends_are_grouped_by_session_in_arrival_order():
+    flush = FlakyFlush()
+
+    async def scenario():
+        queue = MongoWriteBehindQueue(flush, batch_size=10, flush_interval=0.05)
+        queue.start()
+        await queue.put("s1", [_message("a")])
+        await queue.put("s2", [_message("x")])
+        await queue.put("s1", [_message("b"), _message("c")])
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert flush.written == [{
+        "s1": [_message("a"), _message("b"), _message("c")],
+        "s2": [_message("x")],
+    }]
+    assert stats["flushed_batches"] == 1 and stats["pending"] == 0
+
+
+def test_failed_batch_is_retried_with_backoff():
+    flush = FlakyFlush(failures=2)
+
+    async def scenario():
+        queue = MongoWriteBehindQueue(flush, flush_interval=0.01, max_retries=3, retry_backoff=0.01)
+        queue.start()
+        await queue.put("s1", [_message("a")])
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert flush.calls == 3
+    assert flush.written == [{"s1": [_message("a")]}]
+    assert stats["retries"] == 2 and stats["failed_batches"] == 0 and stats["dead_letter_batches"] == 0
+
+
+def test_failed_batch_goes_to_dead_letters_and_comes_back_through_requeue():
+    flush = FlakyFlush(failures=2)
+
+    async def scenario():
+        queue = MongoWriteBehindQueue(flush, flush_interval=0.01, max_retries=1, retry_backoff=0.01)
+        queue.start()
+        await queue.put("s1", [_message("a"), _message("b")])
+        await queue._queue.join()
+        dead = queue.stats()
+
+        # MongoDB rétabli : le lot est remis en file puis écrit
+        requeued = await queue.requeue_dead_letters()
+        await queue.stop()
+        return dead, requeued, queue.stats()
+
+    dead, requeued, stats = asyncio.run(scenario())
+
+    assert dead["dead_letter_batches"] == 1 and dead["dead_lettered_messages"] == 2
+    assert dead["failed_batches"] == 1 and dead["retries"] == 1
+    assert requeued == 1
+    assert flush.written == [{"s1": [_message("a"), _message("b")]}]
+    assert stats["dead_letter_batches"] == 0 and stats["flushed_batches"] == 1
+
+
+def test_dead_letters_are_bounded():
+    flush = FlakyFlush(failures=10)
+
+    async def scenario():
+        queue = MongoWriteBehindQueue(flush, batch_size=1, flush_interval=0.01, max_retries=0, dead_letter_max=2)
+        queue.start()
+        for content in ("a", "b", "c"):
+            await queue.put("s1", [_message(content)])
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+
+    # Les lots les plus anciens sont perdus au-delà du maximum
+    assert [batch["s1"][0]["content"] for batch in queue._dead_letters] == ["b", "c"]
+    assert queue.stats()["dead_lettered_messages"] == 3